@@ -7,22 +7,33 @@ from routes.student_routes import student_bp
 from routes.admin_routes import admin_bp
 from services.face_recognition_service import FaceRecognitionService
 from services.attendance_service import AttendanceService
+from services.frame_dispatcher import FrameDispatcher, FrameDropped
+from services.frame_stream import stream_frames
+from services.video_ingest import VideoIngestWorker, parse_sources
 import cv2
-import threading
-import time
 import numpy as np
 import base64
+import math
 import os
 
+try:
+    # Optional: WebSocket streaming endpoint (pip install flask-sock)
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
 app = Flask(__name__)
 app.config.from_object(Config)
 Config.init_app(app)
 # Enable CORS for API endpoints so a separately-hosted frontend (e.g. GitHub Pages)
 # can call the backend on Render. Tighten origins in production if desired.
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+# max_age lets browsers cache the preflight instead of repeating it for every frame.
+CORS(app, resources={r"/api/*": {"origins": "*"}}, max_age=600)
 
-# Initialize services and attach to the Flask app so routes can access them via current_app
-app.face_service = FaceRecognitionService()
+# Initialize services and attach to the Flask app so routes can access them via current_app.
+# With recognition workers this process never recognizes frames itself, so it skips
+# loading the gallery and warming the models (each worker holds its own copy).
+app.face_service = FaceRecognitionService(preload=Config.RECOGNITION_WORKERS <= 0)
 app.attendance_service = AttendanceService()
 
 # Module-level convenience references so route handlers and background threads
@@ -31,12 +42,56 @@ app.attendance_service = AttendanceService()
 # directly available.
 face_service = app.face_service
 attendance_service = app.attendance_service
+
+# CPU-bound recognition runs in a per-camera sharded process pool (see RECOGNITION_WORKERS)
+frame_dispatcher = FrameDispatcher(face_service)
+# Headless cameras (INGEST_SOURCES); started once in the process that serves requests
+# (gunicorn.conf.py post_fork, the first request, or `python app.py`), or by tools/ingest_sources.py
+ingest_worker = VideoIngestWorker(frame_dispatcher, attendance_service)
+
+
+def start_ingest():
+    """Start the configured INGEST_SOURCES in this process (no-op after the first call)"""
+    ingest_worker.ensure_started(parse_sources(Config.INGEST_SOURCES))
+
+
+@app.before_request
+def _start_ingest_in_worker():
+    # A pid comparison once started; covers servers without the gunicorn hook
+    start_ingest()
+
+
+def _read_image_upload(field):
+    """Return ``(image_bytes, fields)`` from the request body.
+
+    Accepts a raw ``image/*`` (or octet-stream) body, a multipart form with
+    the image in ``field``, or JSON with a base64 string / data URL in
+    ``field``. ``fields`` holds the other form or JSON values (the query
+    string for raw bodies). Raises ValueError for malformed base64.
+    """
+    mimetype = request.mimetype or ''
+    if mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        return request.get_data(), request.args
+    if mimetype == 'multipart/form-data':
+        upload = request.files.get(field)
+        return (upload.read() if upload else None), request.form
+    # Use silent parsing so we don't raise on bad/missing Content-Type
+    data = request.get_json(silent=True) or {}
+    raw = data.get(field)
+    if not raw:
+        return None, data
+    # Accept data URLs or raw base64
+    if isinstance(raw, str) and ',' in raw:
+        raw = raw.split(',')[1]
+    return base64.b64decode(raw), data
+
+
 @app.route('/api/check-face', methods=['POST'])
 def check_face():
     try:
-        data = request.get_json()
-        photo_data = data['photo'].split(',')[1] if ',' in data['photo'] else data['photo']
-        photo_bytes = base64.b64decode(photo_data)
+        photo_bytes, _ = _read_image_upload('photo')
+        if not photo_bytes:
+            return jsonify({'face_detected': False, 'error': 'Invalid image data'})
         
         # Convert to numpy array
         nparr = np.frombuffer(photo_bytes, np.uint8)
@@ -81,10 +136,27 @@ def health_check():
     return jsonify({'status': 'ok'}), 200
 
 
+@app.route('/api/detection-stats', methods=['GET'])
+def detection_stats():
+    """Per-stage timing and hit counters of single-image face detection.
+
+    Counters are kept per worker process, hence the pid.
+    """
+    stats_fn = getattr(face_service, 'detection_stats', None)
+    return jsonify({'pid': os.getpid(), 'stats': stats_fn() if stats_fn else {}}), 200
+
+
+@app.route('/api/ingest-stats', methods=['GET'])
+def ingest_stats():
+    """Throughput and lag counters of the server-side video sources of this process"""
+    return jsonify({'pid': os.getpid(), 'sources': ingest_worker.stats()}), 200
+
+
 @app.context_processor
 def inject_app_config():
     # Expose a small subset of tunable client/server thresholds to templates
     cfg = {
+        'FRAME_STREAMING': Sock is not None,
         'RECOGNITION_COOLDOWN_MS': Config.RECOGNITION_COOLDOWN_MS,
         'SOUND_COOLDOWN_MS': Config.SOUND_COOLDOWN_MS,
         'DISTANCE_MARGIN': Config.DISTANCE_MARGIN,
@@ -96,93 +168,97 @@ def inject_app_config():
     }
     return dict(app_config=cfg)
 
+def _with_attendance(recognized_faces):
+    """Record attendance for recognized faces and add today's attendance details to each.
+
+    All appearances go to the attendance service in one call (in memory; it persists them
+    in the background). ``attendance_marked`` tells whether the appearance was recorded.
+    """
+    # Record appearance: first appearance of the day is login_time; update logout_time to last appearance
+    todays = attendance_service.record_appearances(
+        [(face['student_id'], face['name']) for face in recognized_faces]) or {}
+
+    attendance_info = []
+    for face in recognized_faces:
+        # Attendance details from today's records
+        today_attendance = todays.get(face['student_id'])
+        face['attendance_marked'] = bool(today_attendance)
+        if today_attendance:
+            # Normalize legacy/new keys: attendance service stores 'login_time'/'logout_time'/'duration'
+            face['first_timestamp'] = today_attendance.get('first_timestamp') or today_attendance.get('login_time')
+            face['last_timestamp'] = today_attendance.get('last_timestamp') or today_attendance.get('logout_time')
+
+            # Normalize work hours: some records store a string like '1.23 hours'
+            duration_val = today_attendance.get('duration') or today_attendance.get('work_hours')
+            work_hours = 0.0
+            if isinstance(duration_val, str):
+                try:
+                    work_hours = float(duration_val.split()[0])
+                except Exception:
+                    work_hours = 0.0
+            elif isinstance(duration_val, (int, float)):
+                work_hours = float(duration_val)
+
+            face['work_hours'] = work_hours
+        # include photo_url if provided by face service
+        try:
+            photo_path = face.get('photo_path')
+            if photo_path:
+                from flask import url_for
+                fname = os.path.basename(photo_path)
+                face['photo_url'] = url_for('static', filename=f'images/student_photos/{fname}')
+        except Exception:
+            pass
+        
+        attendance_info.append(face)
+    return attendance_info
+
+
 @app.route('/api/process-frame', methods=['POST'])
 def process_frame():
     """Process video frame for face recognition"""
     try:
-        # Get frame data from request
-        # Use silent parsing so we don't raise on bad/missing Content-Type
-        frame_data = request.get_json(silent=True)
-        # Defensive logging for debugging intermittent 400s
+        # Get frame data from request: raw image body, multipart upload or base64 JSON
         try:
-            print("/api/process-frame received request. Keys:", list(frame_data.keys()) if frame_data else None)
-        except Exception:
-            print("/api/process-frame received request. Keys: Unable to list keys")
+            frame_bytes, fields = _read_image_upload('frame')
+        except ValueError as be:
+            print(f"/api/process-frame: invalid base64 frame data: {str(be)}")
+            traceback.print_exc()
+            return jsonify({'success': False, 'error': f'Invalid base64 frame data: {str(be)}', 'recognized_faces': []}), 200
+
+        # Defensive logging for debugging intermittent 400s
+        print(f"/api/process-frame received {request.mimetype or 'untyped'} body, frame bytes: {len(frame_bytes) if frame_bytes else None}")
 
-        if not frame_data or 'frame' not in frame_data:
+        if not frame_bytes:
             # Return a graceful non-HTTP-error response so the client won't see repeated 400s
             print("/api/process-frame: no frame data provided or missing 'frame' key")
             return jsonify({'success': False, 'error': 'No frame data provided', 'recognized_faces': []}), 200
 
-        raw_frame = frame_data['frame']
-        # Accept data URLs or raw base64
-        if isinstance(raw_frame, str) and ',' in raw_frame:
-            raw_frame = raw_frame.split(',')[1]
-
-        print(f"Received frame length: {len(raw_frame) if isinstance(raw_frame, str) else 'N/A'}")
+        # Recognition state is kept per camera so kiosks don't reset each other's counters.
+        # Clients send a stable session id; fall back to the client address.
+        camera_id = (fields.get('camera_id') or request.args.get('camera_id')
+                     or request.headers.get('X-Camera-Id') or request.remote_addr)
 
-        # Decode base64 frame
+        # Decode and process the frame in the camera's worker; a newer frame from
+        # the same camera replaces this one if it is still waiting
         try:
-            frame_bytes = base64.b64decode(raw_frame)
-        except Exception as be:
-            print(f"/api/process-frame: invalid base64 frame data: {str(be)}")
-            traceback.print_exc()
-            return jsonify({'success': False, 'error': f'Invalid base64 frame data: {str(be)}', 'recognized_faces': []}), 200
-        nparr = np.frombuffer(frame_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if frame is None:
+            recognized_faces, load = frame_dispatcher.dispatch(camera_id, frame_bytes)
+        except FrameDropped as fd:
+            response = jsonify({'success': False, 'dropped': True, 'error': str(fd), 'recognized_faces': [], **fd.load})
+            response.headers['Retry-After'] = str(max(1, int(math.ceil(fd.load['retry_after_ms'] / 1000.0))))
+            return response, 200
+
+        if recognized_faces is None:
             print("/api/process-frame: could not decode frame")
-            return jsonify({'success': False, 'error': 'Could not decode frame', 'recognized_faces': []}), 200
-        
-        # Process frame
-        recognized_faces = face_service.process_frame(frame)
+            return jsonify({'success': False, 'error': 'Could not decode frame', 'recognized_faces': [], **load}), 200
 
         # Update attendance for recognized faces
-        attendance_info = []
-        for face in recognized_faces:
-            student_id = face['student_id']
-            name = face['name']
-            
-            # Update last seen time
-            # Record appearance: first appearance of the day is login_time; update logout_time to last appearance
-            attendance_service.record_appearance(student_id, name)
-
-            # Get attendance details from today's records
-            today_attendance = attendance_service.get_today_attendance(student_id)
-            if today_attendance:
-                # Normalize legacy/new keys: attendance service stores 'login_time'/'logout_time'/'duration'
-                face['attendance_marked'] = True
-                face['first_timestamp'] = today_attendance.get('first_timestamp') or today_attendance.get('login_time')
-                face['last_timestamp'] = today_attendance.get('last_timestamp') or today_attendance.get('logout_time')
-
-                # Normalize work hours: some records store a string like '1.23 hours'
-                duration_val = today_attendance.get('duration') or today_attendance.get('work_hours')
-                work_hours = 0.0
-                if isinstance(duration_val, str):
-                    try:
-                        work_hours = float(duration_val.split()[0])
-                    except Exception:
-                        work_hours = 0.0
-                elif isinstance(duration_val, (int, float)):
-                    work_hours = float(duration_val)
-
-                face['work_hours'] = work_hours
-            # include photo_url if provided by face service
-            try:
-                photo_path = face.get('photo_path')
-                if photo_path:
-                    from flask import url_for
-                    fname = os.path.basename(photo_path)
-                    face['photo_url'] = url_for('static', filename=f'images/student_photos/{fname}')
-            except Exception:
-                pass
-            
-            attendance_info.append(face)
-        
+        attendance_info = _with_attendance(recognized_faces)
+
         return jsonify({
             'success': True,
-            'recognized_faces': attendance_info
+            'recognized_faces': attendance_info,
+            **load
         })
     except Exception as e:
         # Log full traceback for debugging but return 200 to avoid flooding client with 400s
@@ -190,20 +266,92 @@ def process_frame():
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e), 'recognized_faces': []}), 200
 
-def check_timeouts():
-    """Background task to check for session timeouts"""
-    while True:
+def _read_frame_batch():
+    """Return ``[(camera_id, frame_bytes), ...]`` from a /api/process-frames request.
+
+    Accepts a multipart form with repeated ``frame`` files and a matching
+    repeated ``camera_id`` field (a missing id falls back to the file name),
+    or JSON ``{"frames": [{"camera_id": ..., "frame": <base64 or data URL>}]}``.
+    Raises ValueError for malformed input.
+    """
+    if request.mimetype == 'multipart/form-data':
+        uploads = request.files.getlist('frame')
+        camera_ids = request.form.getlist('camera_id')
+        return [(camera_ids[i] if i < len(camera_ids) else upload.filename, upload.read())
+                for i, upload in enumerate(uploads)]
+    data = request.get_json(silent=True) or {}
+    frames = []
+    for item in data.get('frames') or []:
+        raw = item.get('frame') if isinstance(item, dict) else None
+        if not raw:
+            raise ValueError('every entry needs a frame')
+        # Accept data URLs or raw base64
+        if ',' in raw:
+            raw = raw.split(',')[1]
+        frames.append((item.get('camera_id'), base64.b64decode(raw)))
+    return frames
+
+
+@app.route('/api/process-frames', methods=['POST'])
+def process_frames():
+    """Recognize a batch of frames from one or more cameras in a single request.
+
+    Descriptors and the gallery search run as one batch per recognition
+    worker, and the attendance of every recognized face is recorded with a
+    single write. Results come back in request order.
+    """
+    try:
         try:
-            attendance_service.check_and_update_timeouts()
-        except Exception as e:
-            # Log but keep the thread alive
-            print('Error in check_timeouts:', e)
-        time.sleep(60)  # Check every minute
+            frames = _read_frame_batch()
+        except (ValueError, AttributeError, TypeError) as be:
+            return jsonify({'success': False, 'error': f'Invalid frame batch: {str(be)}', 'results': []}), 200
+        if not frames:
+            return jsonify({'success': False, 'error': 'No frames provided', 'results': []}), 200
+        max_frames = getattr(Config, 'BATCH_MAX_FRAMES', 16)
+        if len(frames) > max_frames:
+            return jsonify({'success': False, 'error': f'At most {max_frames} frames per request', 'results': []}), 200
+
+        fallback_id = request.headers.get('X-Camera-Id') or request.remote_addr
+        frames = [(camera_id or fallback_id, frame_bytes) for camera_id, frame_bytes in frames]
+        try:
+            batch, load = frame_dispatcher.dispatch_batch(frames)
+        except FrameDropped as fd:
+            response = jsonify({'success': False, 'dropped': True, 'error': str(fd), 'results': [], **fd.load})
+            response.headers['Retry-After'] = str(max(1, int(math.ceil(fd.load['retry_after_ms'] / 1000.0))))
+            return response, 200
+
+        # One attendance write for the faces of every frame
+        _with_attendance([face for faces in batch if faces for face in faces])
+
+        results = []
+        for (camera_id, _), faces in zip(frames, batch):
+            if faces is None:
+                results.append({'camera_id': camera_id, 'success': False, 'error': 'Could not decode frame', 'recognized_faces': []})
+            else:
+                results.append({'camera_id': camera_id, 'success': True, 'recognized_faces': faces})
+        return jsonify({'success': True, 'results': results, **load})
+    except Exception as e:
+        print(f"Unexpected error in /api/process-frames: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e), 'results': []}), 200
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/ws/process-frame')
+    def process_frame_stream(ws):
+        """Streaming variant of /api/process-frame: binary JPEG frames in, JSON
+        recognition results out (see services/frame_stream.py)"""
+        camera_id = request.args.get('camera_id') or request.remote_addr
+        stream_frames(ws, camera_id, frame_dispatcher.dispatch, enrich=_with_attendance)
+
 
 if __name__ == '__main__':
-    # Start timeout checker in background thread
-    timeout_thread = threading.Thread(target=check_timeouts, daemon=True)
-    timeout_thread.start()
+    # Session timeouts need no thread here: attendance_service.timeouts starts
+    # with the first session in whichever process serves requests (gunicorn too)
+
+    # Start ingesting any configured server-side video sources
+    start_ingest()
     
     # Run the Flask application
     # When deployed to platforms like Render or Cloud Run, they provide
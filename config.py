@@ -12,11 +12,43 @@ class Config:
     STUDENT_PHOTOS_DIR = os.path.join(BASE_DIR, 'static', 'images', 'student_photos')
     STUDENTS_JSON = os.path.join(DATA_DIR, 'students.json')
     ATTENDANCE_JSON = os.path.join(DATA_DIR, 'attendance.json')
+    # Binary gallery: raw float32 encoding matrix + JSONL row index (students.json keeps metadata)
+    ENCODINGS_FILE = os.path.join(DATA_DIR, 'encodings.f32')
+    ENCODINGS_INDEX = os.path.join(DATA_DIR, 'encodings_index.jsonl')
+    # Student/attendance storage: 'json' (the files above), 'partitioned' (one attendance file per day),
+    # 'eventlog' (append-only attendance log) or 'sqlite'; the others import the JSON files on first use
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+    SQLITE_PATH = os.environ.get('SQLITE_PATH') or os.path.join(DATA_DIR, 'face_attendance.db')
+    ATTENDANCE_DIR = os.path.join(DATA_DIR, 'attendance')
+    ATTENDANCE_DAY_CACHE = 32              # partitioned: days besides today kept in memory (LRU)
+    ATTENDANCE_LOG_DIR = os.path.join(DATA_DIR, 'attendance_log')
+    ATTENDANCE_COMPACT_S = 600             # eventlog: fold the log into per-day snapshots this often
     
     # Attendance Settings
     AUTO_LOGOUT_TIME = timedelta(hours=8)  # Auto logout after 8 hours
     FACE_TIMEOUT = timedelta(minutes=5)    # Assume logout if face not detected for 5 minutes
     SESSION_EXPIRY = timedelta(days=2)     # Close old session if new login after 2 days
+    ATTENDANCE_WRITE_BEHIND = True         # keep today's attendance in memory and persist it in the background
+    ATTENDANCE_FLUSH_S = 30                # merge in-memory attendance into the storage this often (and on shutdown)
+    ATTENDANCE_JOURNAL_S = 1.0             # append new appearances to the crash journal this often
+    ATTENDANCE_COALESCE_S = 30             # persist a student's repeated sightings (logout time) at most this often
+    ADMIN_DASHBOARD_DAYS = 7               # days of attendance rendered on the admin dashboard
+    CAMERA_SESSION_TTL = timedelta(minutes=5)  # Drop per-camera recognition state after this much inactivity
+    MAX_CAMERA_SESSIONS = 256              # Upper bound on tracked cameras (least recently used are dropped)
+
+    # /api/process-frame worker pool: frames are sharded by camera onto single-process executors
+    # Each worker holds its own models and gallery; 0 = run in the request thread
+    RECOGNITION_WORKERS = int(os.environ.get('RECOGNITION_WORKERS', min(4, os.cpu_count() or 1)))
+    FRAME_QUEUE_DEPTH = 1                  # frames a camera may have waiting behind the one in flight (older ones are dropped)
+    RECOGNITION_TIMEOUT_S = 10             # give up on a frame (and tell the client to retry) after this long
+    RECOGNITION_START_METHOD = os.environ.get('RECOGNITION_START_METHOD')  # multiprocessing start method (default forkserver)
+    BATCH_MAX_FRAMES = 16                  # /api/process-frames: most frames accepted in one request
+
+    # Server-side video sources (services/video_ingest.py, tools/ingest_sources.py)
+    INGEST_SOURCES = os.environ.get('INGEST_SOURCES', '')  # "id=uri;id2=uri2": camera index, stream URL or video file
+    INGEST_SAMPLE_FPS = float(os.environ.get('INGEST_SAMPLE_FPS', 2.0))  # frames per second sent to recognition
+    INGEST_RECONNECT_S = 5                 # pause before reopening a stream that ended or failed
+    INGEST_REALTIME_FILES = True           # play video files at their own frame rate instead of as fast as possible
     
     # Face Recognition Settings
     FACE_RECOGNITION_TOLERANCE = 0.5       # Lower is more strict (reduce false positives)
@@ -35,6 +67,27 @@ class Config:
     TEMPLATE_THRESHOLD = 0.65             # server: minimal template match score
     COSINE_DISTANCE_GUARD = 0.90          # server: guard to avoid accepting cosine if distance too large
     MIN_CONSECUTIVE_FRAMES = 4            # Number of consecutive frames required to confirm recognition
+    TEMPLATE_CACHE_SIZE = 1024            # LRU size of precomputed stored-photo face crops for the template fallback
+    MAX_EMBEDDINGS_PER_STUDENT = 5        # enrollment photos kept per student (1 = re-registering replaces the encoding)
+    # Single-image detection (registration / check-face): stages run until a confident hit
+    DLIB_DETECTION_SCALES = (1.0, 0.75, 1.5)  # HOG image scales, tried in this order until reordered by success rate
+    DETECTION_CONFIDENT_FACE_SIZE = 80    # a detected face at least this wide (px) ends the search early
+    DETECTION_TIME_BUDGET_MS = 1500       # no further detection stage is started after this long
+    DETECTION_ADAPTIVE_ORDER = True       # try stages in order of their observed hit rate
+    MODEL_WARM_UP = True                  # run one dummy inference at startup so the first request is not slow
+    FRAME_DETECTION_UPSAMPLE = 1          # dlib upsampling for the single per-frame detection pass (finds smaller faces)
+    # Per-camera face tracking: confirmed faces reuse their identity instead of re-encoding every frame
+    FACE_TRACK_IOU_THRESHOLD = 0.3        # minimum box overlap to continue a track
+    FACE_TRACK_REENCODE_INTERVAL = 10     # recompute a confirmed track's descriptor every N frames (1 = every frame)
+    FACE_TRACK_APPEARANCE_THRESHOLD = 12.0  # mean gray-level change of the face thumbnail that forces a re-encode
+    FACE_TRACK_MAX_MISSES = 2             # frames a track survives without a matching detection
+
+    # Gallery search (approximate nearest-neighbour index)
+    ANN_INDEX = os.environ.get('ANN_INDEX', 'auto')  # 'brute', 'ivf', or 'auto' (ivf once the gallery is large)
+    ANN_MIN_GALLERY_SIZE = 5000           # 'auto' keeps the exact linear scan below this many encodings
+    ANN_NLIST = 0                         # IVF clusters; 0 picks ~sqrt(gallery size)
+    ANN_NPROBE = 8                        # IVF clusters scanned per query (higher = better recall, slower)
+    ANN_REBUILD_FRACTION = 0.1            # rebuild the index once rows added since the last build exceed this fraction
     
     # Time Zone Settings
     TIMEZONE = 'Asia/Kolkata'             # Default timezone for timestamps
@@ -0,0 +1,8 @@
+# Read by gunicorn from the working directory (Procfile, scripts/start.sh).
+
+
+def post_fork(server, worker):
+    # With --preload the app is built in the master, whose threads do not survive
+    # the fork: start the headless cameras (INGEST_SOURCES) in each worker
+    import app
+    app.start_ingest()
@@ -1,8 +1,9 @@
 from flask import Blueprint, jsonify, request, render_template, send_file, current_app
-from utils.helpers import load_json
+from services.storage import get_storage
+from utils.helpers import get_current_time
 import csv
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import tempfile
 from config import Config
 import base64
@@ -16,10 +17,12 @@ admin_bp = Blueprint('admin', __name__)
 
 @admin_bp.route('/admin/dashboard')
 def admin_dashboard():
-    """Admin dashboard showing all attendance records"""
-    attendance_records = current_app.attendance_service.get_all_attendance()
+    """Admin dashboard showing the attendance of the last ADMIN_DASHBOARD_DAYS days (older days via the date filter)"""
+    end = get_current_time().date()
+    start = end - timedelta(days=max(1, getattr(Config, 'ADMIN_DASHBOARD_DAYS', 7)) - 1)
+    attendance_records = current_app.attendance_service.get_attendance_between(start.isoformat(), end.isoformat())
     # Load registered students to display on dashboard
-    students = load_json(Config.STUDENTS_JSON)
+    students = get_storage().list_students()
     return render_template('admin_dashboard.html', attendance_records=attendance_records, students=students)
 
 
@@ -90,9 +93,14 @@ def register_student():
 
 @admin_bp.route('/admin/export-attendance')
 def export_attendance():
-    """Export attendance records as CSV"""
+    """Export attendance records as CSV (all of them, or ``?start=&end=`` dates inclusive)"""
     try:
-        attendance_records = current_app.attendance_service.get_all_attendance()
+        start, end = request.args.get('start'), request.args.get('end')
+        if start or end:
+            attendance_records = current_app.attendance_service.get_attendance_between(
+                start or '0000-00-00', end or '9999-99-99')
+        else:
+            attendance_records = current_app.attendance_service.get_all_attendance()
         # Write CSV using the standard library to avoid a pandas dependency
         if not attendance_records:
             # Ensure at least headers exist
@@ -126,10 +134,13 @@ def get_attendance():
     date = request.args.get('date')
     student_id = request.args.get('student_id')
 
-    records = current_app.attendance_service.get_all_attendance(date)
-
     if student_id:
-        records = [r for r in records if r['student_id'] == student_id]
+        # Indexed per-student query; the date filter is applied to that (short) history
+        records = current_app.attendance_service.get_student_attendance(student_id)
+        if date:
+            records = [r for r in records if r.get('date') == date]
+    else:
+        records = current_app.attendance_service.get_all_attendance(date)
 
     return jsonify(records)
 
@@ -137,5 +148,5 @@ def get_attendance():
 @admin_bp.route('/api/students')
 def api_students():
     """Return list of registered students as JSON (used by static admin UI)."""
-    students = load_json(Config.STUDENTS_JSON) or []
+    students = get_storage().list_students()
     return jsonify(students)
\ No newline at end of file
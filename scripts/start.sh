@@ -37,4 +37,4 @@ for f in "$MODEL_DIR"/*.bz2; do
 done
 
 echo "Starting Gunicorn..."
-exec gunicorn app:app --bind 0.0.0.0:${PORT:-8080} --workers 2
+exec gunicorn app:app --bind 0.0.0.0:${PORT:-8080} --workers 1 --threads 8 --preload
@@ -0,0 +1,126 @@
+"""Approximate nearest-neighbour indexes over the face encoding gallery.
+
+Both indexes only produce a *shortlist* of gallery rows for a probe; the caller
+re-ranks that shortlist with exact distances so the tolerance and margin rules
+are applied to true scores. ``BruteForceIndex`` returns every row and is used
+for small galleries. ``IVFFlatIndex`` clusters the rows with k-means and only
+scans the ``nprobe`` clusters closest to the probe.
+"""
+import numpy as np
+
+from services.gallery import top_k
+
+
+def _nearest_centroid(data, centroids, chunk=8192):
+    """Return the index of the closest centroid for every row of ``data``."""
+    c_sq = np.einsum('ij,ij->i', centroids, centroids)
+    out = np.empty(data.shape[0], dtype=np.intp)
+    for start in range(0, data.shape[0], chunk):
+        block = data[start:start + chunk]
+        # |x|^2 is constant per row so it does not change the argmin
+        d = c_sq[None, :] - 2.0 * (block @ centroids.T)
+        out[start:start + chunk] = np.argmin(d, axis=1)
+    return out
+
+
+def _kmeans(data, k, n_iter, rng):
+    """Plain Lloyd's k-means; empty clusters are re-seeded from random rows."""
+    centroids = data[rng.choice(data.shape[0], k, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _nearest_centroid(data, centroids)
+        counts = np.bincount(assign, minlength=k)
+        order = np.argsort(assign, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        nonempty = counts > 0
+        sums = np.add.reduceat(data[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        empty = np.flatnonzero(~nonempty)
+        if empty.size:
+            centroids[empty] = data[rng.choice(data.shape[0], empty.size, replace=False)]
+    return centroids
+
+
+class BruteForceIndex:
+    """Exhaustive 'index': the shortlist is the whole gallery."""
+
+    kind = 'brute'
+
+    def __init__(self, matrix):
+        self.size = matrix.shape[0]
+
+    def search(self, probe):
+        return np.arange(self.size)
+
+
+class IVFFlatIndex:
+    """Inverted-file index with flat (uncompressed) lists.
+
+    ``nlist`` controls the number of k-means clusters (defaults to about
+    ``sqrt(n)``) and ``nprobe`` how many of them are scanned per query. Raising
+    ``nprobe`` trades latency for recall; ``nprobe == nlist`` is exact.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, matrix, nlist=0, nprobe=8, n_iter=10, train_size=50000, seed=0):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        n = matrix.shape[0]
+        if not nlist:
+            nlist = int(np.sqrt(n))
+        self.nlist = max(1, min(int(nlist), n))
+        self.nprobe = max(1, min(int(nprobe), self.nlist))
+        self.size = n
+
+        rng = np.random.default_rng(seed)
+        train = matrix
+        if n > train_size:
+            train = matrix[rng.choice(n, train_size, replace=False)]
+        self.centroids = _kmeans(train, self.nlist, n_iter, rng)
+        self.centroid_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+
+        assign = _nearest_centroid(matrix, self.centroids)
+        counts = np.bincount(assign, minlength=self.nlist)
+        self.list_rows = np.argsort(assign, kind='stable')
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def search(self, probe):
+        """Return the sorted gallery rows in the ``nprobe`` closest clusters."""
+        probe = np.asarray(probe, dtype=np.float32).reshape(-1)
+        d = self.centroid_sq - 2.0 * (self.centroids @ probe)
+        lists = top_k(d, self.nprobe)
+        rows = np.concatenate([
+            self.list_rows[self.list_offsets[j]:self.list_offsets[j + 1]] for j in lists
+        ])
+        rows.sort()
+        return rows
+
+
+def build_index(matrix, kind='auto', min_size=5000, **params):
+    """Build the index configured by ``kind`` ('brute', 'ivf' or 'auto').
+
+    'auto' only switches to IVF once the gallery has at least ``min_size``
+    rows; below that a linear scan is both exact and fast enough.
+    """
+    n = matrix.shape[0]
+    if kind == 'ivf' or (kind == 'auto' and n >= min_size):
+        if n > 0:
+            return IVFFlatIndex(matrix, **params)
+    return BruteForceIndex(matrix)
+
+
+def recall_at_k(index, matrix, queries, k=1):
+    """Fraction of the exact top-k neighbours that the index shortlist contains.
+
+    This is the recall-vs-brute-force check used to tune ``nlist``/``nprobe``.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    if matrix.shape[0] == 0 or queries.shape[0] == 0:
+        return 1.0
+    hits = 0
+    for q in queries:
+        distances = np.linalg.norm(matrix - q, axis=1)
+        exact = top_k(distances, k)
+        shortlist = index.search(q)
+        hits += np.isin(exact, shortlist).sum()
+    return hits / float(len(queries) * min(k, matrix.shape[0]))
@@ -1,20 +1,104 @@
-from datetime import datetime
+"""Attendance records, persisted through ``services.storage`` (attendance.json or SQLite).
+
+Today's records live in memory: recording an appearance only updates that
+state and queues a journal entry, so the recognition path never touches the
+disk. Repeated sightings are coalesced: a student's first sighting of the day
+is queued at once (and wakes the flusher), later ones only move the in-memory
+logout time and are queued at most once per ATTENDANCE_COALESCE_S seconds, or
+on shutdown. A background flusher appends queued entries to a per-process journal
+(``attendance.json.<pid>.journal``) every ATTENDANCE_JOURNAL_S seconds and
+merges the changed records into the storage every ATTENDANCE_FLUSH_S seconds
+and on shutdown, after which the journal is truncated. Journals left behind by
+a crash are replayed on startup (those of live processes are left to them). A flush merges rather than overwrites
+(earliest login, latest logout), so several processes can record attendance
+into the same storage.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
 from utils.helpers import (
     load_json, save_json, get_current_time,
     is_session_expired, calculate_duration
 )
 from config import Config
+from services.storage import get_storage, parse_time
+from services.session_timeouts import SessionTimeoutScheduler
+
+def _pid_alive(pid):
+    """Whether the journal of ``pid`` may still be written by another process"""
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
 
 class AttendanceService:
-    def __init__(self):
+    def __init__(self, write_behind=None, storage=None):
+        self.storage = storage or get_storage()
         self.active_sessions = {}  # Keep track of active sessions in memory
+        self.write_behind = write_behind if write_behind is not None else getattr(Config, 'ATTENDANCE_WRITE_BEHIND', True)
+        self._journal_base = Config.ATTENDANCE_JSON
+        self._lock = threading.Lock()        # in-memory state
+        self._flush_lock = threading.Lock()  # journal and file writes
+        self._today_date = None
+        self._today = {}    # student_id -> today's record
+        self._dirty = {}    # (student_id, date) -> record changed since the last flush
+        self._events = []   # appearances not yet in the journal
+        self._pending = {}  # (student_id, date) -> record seen again since it was last queued
+        self._queued_at = {}  # (student_id, date) -> monotonic time it was last queued
+        self._stop = threading.Event()
+        self._wake = threading.Event()  # a first sighting is waiting to be flushed
+        # Sessions end FACE_TIMEOUT after the last sighting (see close_sessions)
+        self.timeouts = SessionTimeoutScheduler(self.close_sessions)
+        self._flusher = None
+        self._flusher_pid = None
         # Migrate attendance file to canonical fields if needed
         self._migrate_attendance()
+        self._recover_journals()
+        self._load_today()
+        # The flusher starts with the first sighting (see _ensure_flusher)
+        # Coalesced sightings are only queued later, so flush them at exit in either mode
+        atexit.register(self.close)
+
+    @property
+    def journal_path(self):
+        # Per process: under gunicorn --preload the service is built in the master
+        return f"{self._journal_base}.{os.getpid()}.journal"
+
+    def _ensure_flusher(self):
+        """Start the flusher in this process if it is not running here.
+
+        The service is created at import time, which under ``gunicorn --preload``
+        is the master; its thread does not survive the fork into the worker.
+        """
+        if not self.write_behind or self._stop.is_set() or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            self._flusher = threading.Thread(target=self._flush_loop, name='attendance-flusher', daemon=True)
+            self._flusher.start()
 
     def _migrate_attendance(self):
         """Ensure attendance records contain canonical keys: first_timestamp, last_timestamp, work_hours (float).
         Keep legacy keys for backward compatibility but populate canonical ones.
+        Only applies to attendance.json; the SQLite import keeps legacy fields as they are.
         """
+        if self.storage.kind != 'json':
+            return
         try:
             records = load_json(Config.ATTENDANCE_JSON)
             changed = False
@@ -39,48 +123,179 @@ class AttendanceService:
         except Exception as e:
             print(f"Error migrating attendance records: {e}")
         
+    def _load_today(self):
+        today = get_current_time().date().isoformat()
+        records = {}
+        for rec in self.storage.attendance_on(today):
+            records.setdefault(rec.get('student_id'), rec)
+        with self._lock:
+            self._today_date = today
+            self._today = records
+
+    def _recover_journals(self):
+        """Replay journals left by processes that did not flush (crash, kill) into the storage.
+
+        Journals of other live processes (workers, the ingest tool) are left
+        alone: they may be appended to while being replayed. A journal carrying
+        this process's pid can only be left from an earlier run that reused it.
+        """
+        prefix = Config.ATTENDANCE_JSON + '.'
+        journals = [path for path in sorted(glob.glob(glob.escape(Config.ATTENDANCE_JSON) + '.*.journal'))
+                    if not _pid_alive(path[len(prefix):-len('.journal')])]
+        if not journals:
+            return
+        spans = []
+        for path in journals:
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                            seen = parse_time(entry['time'])
+                        except (ValueError, KeyError):
+                            continue  # torn last line
+                        spans.append((entry['student_id'], entry.get('name'), seen, seen))
+            except OSError as e:
+                print(f"Error reading attendance journal {path}: {e}")
+        # Replaying twice is harmless (merges are idempotent), losing a journal is not
+        if spans and self.storage.extend_attendance(spans) is None:
+            return
+        for path in journals:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if spans:
+            print(f"Recovered {len(spans)} attendance update(s) from {len(journals)} journal(s)")
+
+    def _flush_loop(self):
+        interval = getattr(Config, 'ATTENDANCE_FLUSH_S', 30)
+        next_flush = time.monotonic() + interval
+        while not self._stop.is_set():
+            woken = self._wake.wait(getattr(Config, 'ATTENDANCE_JOURNAL_S', 1.0))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self._queue_due()
+                if woken or time.monotonic() >= next_flush:
+                    self.flush()
+                    next_flush = time.monotonic() + interval
+                else:
+                    self._write_journal()
+            except Exception as e:
+                print(f"Error flushing attendance: {e}")
+
+    def _queue(self, key, record, name, seen, now):
+        # Called with _lock held: hand the record to the next journal write and flush
+        self._dirty[key] = record
+        self._events.append({'student_id': key[0], 'name': name, 'time': seen})
+        self._queued_at[key] = now
+        self._pending.pop(key, None)
+
+    def _queue_due(self, force=False):
+        """Queue coalesced sightings whose interval has passed (all of them with ``force``)"""
+        interval = getattr(Config, 'ATTENDANCE_COALESCE_S', 30)
+        now = time.monotonic()
+        with self._lock:
+            for key, rec in list(self._pending.items()):
+                if force or now - self._queued_at.get(key, 0.0) >= interval:
+                    self._queue(key, rec, rec.get('name'), rec['logout_time'], now)
+
+    def _write_journal(self):
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return
+            try:
+                with open(self.journal_path, 'a') as f:
+                    f.write(''.join(json.dumps(e) + '\n' for e in events))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                print(f"Error writing attendance journal: {e}")
+                with self._lock:
+                    self._events[:0] = events
+
+    def flush(self):
+        """Merge the records changed since the last flush into the storage.
+
+        Returns True on success (or when there was nothing to write).
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+                dirty, self._dirty = self._dirty, {}
+                pending = [(student_id, dict(rec)) for (student_id, _), rec in dirty.items()]
+            if not pending:
+                return True
+            try:
+                merged = self.storage.extend_attendance(
+                    [(student_id, rec.get('name'), parse_time(rec['login_time']), parse_time(rec['logout_time']))
+                     for student_id, rec in pending])
+            except Exception as e:
+                print(f"Error flushing attendance: {e}")
+                merged = None
+            if merged is None:
+                with self._lock:
+                    for key, rec in dirty.items():
+                        self._dirty.setdefault(key, rec)
+                    self._events[:0] = events
+                return False
+            # Everything journaled so far is now stored
+            try:
+                if os.path.exists(self.journal_path):
+                    os.remove(self.journal_path)
+            except OSError:
+                pass
+            with self._lock:
+                # Pick up earlier logins recorded by other processes
+                for rec in merged:
+                    mine = self._today.get(rec.get('student_id'))
+                    if (mine is not None and rec.get('date') == self._today_date
+                            and parse_time(rec['login_time']) < parse_time(mine['login_time'])):
+                        mine['login_time'] = rec['login_time']
+                        mine['duration'] = calculate_duration(mine['login_time'], mine['logout_time'])
+            return True
+
+    def close(self):
+        """Stop the flusher and write everything still in memory"""
+        self._stop.set()
+        self._wake.set()
+        self.timeouts.stop()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join(5)
+        self._queue_due(force=True)
+        self.flush()
+
     def get_today_attendance(self, student_id):
         """Get today's attendance record for a student"""
+        today = get_current_time().date().isoformat()
+        with self._lock:
+            if self._today_date == today and student_id in self._today:
+                return dict(self._today[student_id])
         try:
-            today = datetime.now().date().isoformat()
-            attendance_records = load_json(Config.ATTENDANCE_JSON)
-
-            for entry in attendance_records:
-                if entry.get('student_id') == student_id and entry.get('date') == today:
-                    return entry
-
-            return None
+            return self.storage.get_attendance(student_id, today)
         except Exception as e:
             print(f"Error getting today's attendance: {str(e)}")
             return None
     
     def mark_login(self, student_id, name):
         """Mark a student's login"""
+        self.flush()
         current_time = get_current_time()
-        attendance_records = load_json(Config.ATTENDANCE_JSON)
-        
+
         # Legacy method: create a login record if none exists for today.
         # For the new first/last appearance logic prefer using record_appearance().
         today = current_time.date().isoformat()
-        # Check if today's record exists
-        for record in attendance_records:
-            if record.get('student_id') == student_id and record.get('date') == today:
-                # Already has today's record; do not create another
-                return False
-
-        new_record = {
-            "student_id": student_id,
-            "name": name,
-            "login_time": current_time.isoformat(),
-            "logout_time": current_time.isoformat(),
-            "duration": "0.00 hours",
-            "date": today
-        }
+        if self.storage.get_attendance(student_id, today) is not None:
+            # Already has today's record; do not create another
+            return False
 
-        attendance_records.append(new_record)
         self.active_sessions[student_id] = current_time
-
-        return save_json(Config.ATTENDANCE_JSON, attendance_records)
+        self.timeouts.touch(student_id)
+        return self.storage.extend_attendance([(student_id, name, current_time, current_time)], 'login') is not None
 
     def record_appearance(self, student_id, name):
         """Record a user's appearance: first appearance of the day is login_time, last appearance updates logout_time.
@@ -88,91 +303,153 @@ class AttendanceService:
         This method ensures only the first login_time is kept and logout_time is updated to the most recent appearance during the day.
         Returns True on success.
         """
+        return self.record_appearances([(student_id, name)]) is not None
+
+    def record_appearances(self, appearances):
+        """Record several ``(student_id, name)`` appearances.
+
+        Same rules as ``record_appearance``. Only the in-memory state of today
+        is updated; the write-behind flusher persists it, a student's repeated
+        sightings at most once per ATTENDANCE_COALESCE_S seconds. Returns
+        ``{student_id: today's record}`` for the students seen, or None if the
+        records could not be saved (only possible without write-behind).
+        """
+        current_time = get_current_time()
+        today = current_time.date().isoformat()
+        now = current_time.isoformat()
+        mono = time.monotonic()
+        interval = getattr(Config, 'ATTENDANCE_COALESCE_S', 30)
+        seen = {}
+        first_sighting = False
+        with self._lock:
+            queued = len(self._events)
+            if today != self._today_date:
+                # New day: yesterday's records stay queued for the next flush
+                self._today_date = today
+                self._today = {}
+            for student_id, name in appearances:
+                existing = self._today.get(student_id)
+                if existing is None:
+                    # First appearance of the day: set both login and logout to now
+                    existing = {
+                        "student_id": student_id,
+                        "name": name,
+                        "login_time": now,
+                        "logout_time": now,
+                        "duration": "0.00 hours",
+                        "date": today
+                    }
+                    self._today[student_id] = existing
+                    self._queue((student_id, today), existing, name, now, mono)
+                    first_sighting = True
+                else:
+                    # Update logout_time to the latest appearance
+                    existing['logout_time'] = now
+                    # Recompute duration
+                    existing['duration'] = calculate_duration(existing['login_time'], existing['logout_time'])
+                    if mono - self._queued_at.get((student_id, today), 0.0) >= interval:
+                        self._queue((student_id, today), existing, name, now, mono)
+                    else:
+                        self._pending[(student_id, today)] = existing
+
+                # Update active sessions/last seen
+                self.active_sessions[student_id] = current_time
+                seen[student_id] = dict(existing)
+
+            queued = len(self._events) > queued
+
+        for student_id in seen:
+            self.timeouts.touch(student_id)
+        if self.write_behind:
+            self._ensure_flusher()
+            if first_sighting:
+                self._wake.set()
+        elif queued and not self.flush():
+            return None
+        return seen
+    
+    def record_sightings(self, sightings):
+        """Merge ``(student_id, name, first_seen, last_seen)`` sightings into the records in one batch.
+
+        Used for recorded video: a sighting extends the record of its day
+        (``first_seen``'s date) to cover it, creating the record if needed.
+        Times are timezone-aware datetimes. Returns the number of records
+        touched, or None if they could not be saved.
+        """
         try:
-            current_time = get_current_time()
-            today = current_time.date().isoformat()
-            attendance_records = load_json(Config.ATTENDANCE_JSON)
-
-            # Find existing today's record
-            existing = None
-            for rec in attendance_records:
-                if rec.get('student_id') == student_id and rec.get('date') == today:
-                    existing = rec
-                    break
-
-            if existing is None:
-                # First appearance of the day: set both login and logout to now
-                new_record = {
-                    "student_id": student_id,
-                    "name": name,
-                    "login_time": current_time.isoformat(),
-                    "logout_time": current_time.isoformat(),
-                    "duration": "0.00 hours",
-                    "date": today
-                }
-                attendance_records.append(new_record)
-            else:
-                # Update logout_time to the latest appearance
-                existing['logout_time'] = current_time.isoformat()
-                # Recompute duration
-                existing['duration'] = calculate_duration(existing['login_time'], existing['logout_time'])
-
-            # Update active sessions/last seen
-            self.active_sessions[student_id] = current_time
-
-            return save_json(Config.ATTENDANCE_JSON, attendance_records)
+            if not self.flush():
+                return None
+            merged = self.storage.extend_attendance(sightings, 'video')
+            if merged is None:
+                return None
+            return len({(rec['student_id'], rec['date']) for rec in merged})
         except Exception as e:
-            print(f"Error recording appearance: {e}")
-            return False
-    
+            print(f"Error recording sightings: {e}")
+            return None
+
     def mark_logout(self, student_id):
         """Mark a student's logout"""
+        self.flush()
         current_time = get_current_time()
-        attendance_records = load_json(Config.ATTENDANCE_JSON)
-        
+
         # Find the student's active session
-        for record in attendance_records:
-            if (record['student_id'] == student_id and 
-                not record['logout_time']):
-                record['logout_time'] = current_time.isoformat()
-                record['duration'] = calculate_duration(
-                    record['login_time'],
-                    record['logout_time']
-                )
-                
+        for record in self.storage.student_attendance(student_id):
+            if not record.get('logout_time'):
                 # Remove from active sessions
                 self.active_sessions.pop(student_id, None)
-                
-                return save_json(Config.ATTENDANCE_JSON, attendance_records)
-        
+                self.timeouts.discard(student_id)
+                login = parse_time(record['login_time'])
+                return self.storage.extend_attendance(
+                    [(student_id, record.get('name'), login, current_time)], 'logout') is not None
+
         return False
     
     def get_student_attendance(self, student_id):
         """Get attendance history for a specific student"""
-        attendance_records = load_json(Config.ATTENDANCE_JSON)
-        return [
-            record for record in attendance_records 
-            if record['student_id'] == student_id
-        ]
+        self.flush()
+        return self.storage.student_attendance(student_id)
     
     def get_all_attendance(self, date=None):
         """Get all attendance records, optionally filtered by date"""
-        attendance_records = load_json(Config.ATTENDANCE_JSON)
+        self.flush()
         if date:
-            return [
-                record for record in attendance_records 
-                if record['date'] == date
-            ]
-        return attendance_records
+            return self.storage.attendance_on(date)
+        return self.storage.all_attendance()
+
+    def get_attendance_between(self, start, end):
+        """Get the attendance records dated ``start`` to ``end`` (inclusive ISO dates)"""
+        self.flush()
+        return self.storage.attendance_between(start, end)
     
+    def close_sessions(self, student_ids):
+        """End the sessions of ``student_ids`` (timed out) with one write.
+
+        Called by the timeout scheduler. The last sighting of each student,
+        possibly still held back by coalescing, becomes the stored logout time.
+        """
+        ids = set(student_ids)
+        if not ids:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            for student_id in ids:
+                self.active_sessions.pop(student_id, None)
+            for key, rec in list(self._pending.items()):
+                if key[0] in ids:
+                    self._queue(key, rec, rec.get('name'), rec['logout_time'], now)
+        return self.flush()
+
     def check_and_update_timeouts(self):
-        """Check for timed out sessions and mark logouts"""
+        """Close the sessions that timed out (the scheduler normally does this on its own)"""
         current_time = get_current_time()
-        
-        for student_id, last_seen in list(self.active_sessions.items()):
-            if (current_time - last_seen) > Config.FACE_TIMEOUT:
-                self.mark_logout(student_id)
+        expired = [student_id for student_id, last_seen in list(self.active_sessions.items())
+                   if (current_time - last_seen) > Config.FACE_TIMEOUT]
+        for student_id in expired:
+            self.timeouts.discard(student_id)
+        return self.close_sessions(expired)
     
     def update_last_seen(self, student_id):
         """Update the last seen time for an active session"""
-        self.active_sessions[student_id] = get_current_time()
\ No newline at end of file
+        self.active_sessions[student_id] = get_current_time()
+        self.timeouts.touch(student_id)
+
@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+
+class CameraSession:
+    """Recognition state that belongs to a single client camera."""
+
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        self.consecutive_frames = {}  # match_key -> consecutive matching frames
+        self.tracker = None           # FaceTracker, for services that track faces across frames
+        self.last_seen = 0.0
+
+
+class CameraSessionStore:
+    """Bounded, TTL-evicted map of camera_id -> CameraSession.
+
+    Entries are kept in least-recently-used order, so a lookup is O(1) and
+    eviction only ever inspects the oldest entries. Sessions idle for longer
+    than ``ttl`` seconds, or beyond ``max_sessions``, are dropped.
+    """
+
+    def __init__(self, ttl=None, max_sessions=None, clock=time.monotonic):
+        if ttl is None:
+            ttl = Config.CAMERA_SESSION_TTL.total_seconds()
+        if max_sessions is None:
+            max_sessions = getattr(Config, 'MAX_CAMERA_SESSIONS', 256)
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, camera_id):
+        """Return the session for ``camera_id``, creating it if needed"""
+        now = self._clock()
+        with self._lock:
+            session = self._sessions.get(camera_id)
+            if session is None or now - session.last_seen > self.ttl:
+                session = CameraSession(camera_id)
+                self._sessions[camera_id] = session
+            self._sessions.move_to_end(camera_id)
+            session.last_seen = now
+            self._evict(now)
+            return session
+
+    def _evict(self, now):
+        # Oldest entries are at the front; stop at the first one still alive
+        while self._sessions:
+            camera_id, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - oldest.last_seen > self.ttl:
+                del self._sessions[camera_id]
+            else:
+                break
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, camera_id):
+        return camera_id in self._sessions
@@ -0,0 +1,127 @@
+import threading
+import time
+
+from config import Config
+
+
+class DetectionStage:
+    """One way of finding a face, with its running counters.
+
+    ``detect(image)`` returns ``(result, quality)`` for a hit or None for a
+    miss. Stages in a lower ``tier`` always run before those in a higher one;
+    only stages within a tier are reordered.
+    """
+
+    def __init__(self, name, detect, tier=0):
+        self.name = name
+        self.detect = detect
+        self.tier = tier
+        self.calls = 0
+        self.hits = 0
+        self.confident_hits = 0
+        self.errors = 0
+        self.skipped = 0
+        self.total_time = 0.0
+
+    def success_rate(self):
+        # Laplace-smoothed so untried stages keep their configured place
+        return (self.hits + 1.0) / (self.calls + 2.0)
+
+    def stats(self):
+        return {
+            'tier': self.tier,
+            'calls': self.calls,
+            'hits': self.hits,
+            'confident_hits': self.confident_hits,
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'hit_rate': round(self.hits / self.calls, 4) if self.calls else None,
+            'avg_ms': round(1000.0 * self.total_time / self.calls, 2) if self.calls else None,
+        }
+
+
+class DetectionStrategy:
+    """Run detection stages in order and stop at the first confident hit.
+
+    A hit whose quality reaches ``confident_quality`` ends the search; weaker
+    hits are remembered and the best of them is returned if no stage is
+    confident. Once ``budget_ms`` has elapsed no further stage is started (the
+    first one always runs). With ``adaptive`` ordering, stages are tried in
+    order of their observed success rate within each tier.
+    """
+
+    def __init__(self, stages, confident_quality=0.0, budget_ms=None, adaptive=None, clock=time.perf_counter):
+        self.stages = list(stages)
+        self.confident_quality = confident_quality
+        self.budget_ms = budget_ms if budget_ms is not None else getattr(Config, 'DETECTION_TIME_BUDGET_MS', 1500)
+        self.adaptive = adaptive if adaptive is not None else getattr(Config, 'DETECTION_ADAPTIVE_ORDER', True)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.misses = 0
+        self.budget_exhausted = 0
+
+    def ordered_stages(self):
+        """Stages in the order the next call will try them"""
+        with self._lock:
+            if not self.adaptive:
+                return sorted(self.stages, key=lambda s: s.tier)
+            # sorted() is stable, so equal rates keep the configured order
+            return sorted(self.stages, key=lambda s: (s.tier, -s.success_rate()))
+
+    def run(self, image):
+        """Return the result of the best hit, or None if no stage found a face"""
+        start = self._clock()
+        best = None
+        exhausted = False
+        stages = self.ordered_stages()
+        for n, stage in enumerate(stages):
+            if n and self.budget_ms and (self._clock() - start) * 1000.0 >= self.budget_ms:
+                exhausted = True
+                with self._lock:
+                    for skipped in stages[n:]:
+                        skipped.skipped += 1
+                break
+
+            t0 = self._clock()
+            error = False
+            try:
+                hit = stage.detect(image)
+            except Exception as e:
+                hit, error = None, True
+                if Config.DEBUG_MODE:
+                    print(f"Detection stage {stage.name} failed: {e}")
+            elapsed = self._clock() - t0
+
+            confident = hit is not None and hit[1] >= self.confident_quality
+            with self._lock:
+                stage.calls += 1
+                stage.total_time += elapsed
+                stage.errors += error
+                if hit is not None:
+                    stage.hits += 1
+                    stage.confident_hits += confident
+            if hit is not None and (best is None or hit[1] > best[1]):
+                best = hit
+            if confident:
+                break
+
+        with self._lock:
+            self.calls += 1
+            self.misses += best is None
+            self.budget_exhausted += exhausted
+        return best[0] if best is not None else None
+
+    def stats(self):
+        """Per-stage counters plus totals, stages listed in their current order"""
+        ordered = self.ordered_stages()
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'misses': self.misses,
+                'budget_exhausted': self.budget_exhausted,
+                'budget_ms': self.budget_ms,
+                'adaptive': self.adaptive,
+                'order': [s.name for s in ordered],
+                'stages': {s.name: s.stats() for s in ordered},
+            }
@@ -8,15 +8,25 @@ except Exception:
 import cv2
 import numpy as np
 from config import Config
-from utils.helpers import load_json
+from utils.helpers import index_student_photos
+from services.gallery import LiveGallery, top_k
+from services.encoding_store import open_gallery_store
+from services.storage import get_storage
+from services.detection_strategy import DetectionStage, DetectionStrategy
+from services.camera_sessions import CameraSessionStore
+from services.face_tracker import FaceTracker, box_iou
+from services import model_registry
+from collections import OrderedDict
+import threading
 import os
 
+
 class DlibFaceService:
+    FRAME_SCALE = 2  # process_frame works on half-size frames
+
     def __init__(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_student_ids = []
-        self.consecutive_frames = {}  # Track consecutive detections
+        self.live_gallery = LiveGallery()
+        self.camera_sessions = CameraSessionStore()  # Per-camera face tracks
 
         # Instance-level flag for dlib availability
         self.dlib_available = DLIB_AVAILABLE
@@ -34,82 +44,96 @@ class DlibFaceService:
                 if Config.DEBUG_MODE:
                     print(f"Loading dlib models from: {model_dir}")
 
-                self.detector = dlib.get_frontal_face_detector()
-                self.shape_predictor = dlib.shape_predictor(shape_path)
-                self.face_rec_model = dlib.face_recognition_model_v1(face_rec_path)
+                # Loaded once per process and shared with any other service instance
+                self.detector = model_registry.dlib_detector()
+                self.shape_predictor = model_registry.dlib_shape_predictor(shape_path)
+                self.face_rec_model = model_registry.dlib_face_rec_model(face_rec_path)
             except Exception as e:
                 # If model files are missing or there's an error, fall back to OpenCV cascade
                 if Config.DEBUG_MODE:
                     print(f"dlib models not available or failed to load: {e}")
                 self.dlib_available = False
-                # Use local cascade file (from models dir) as primary fallback
-                model_dir = getattr(Config, 'MODEL_DIR', os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', 'models'))
-                cascade_path = os.path.join(model_dir, 'haarcascade_frontalface_default.xml')
-                if not os.path.exists(cascade_path):
-                    # fallback to OpenCV package data if present
-                    # cv2.data can be a string path or a module with attribute `haarcascades`
-                    cascade_path = ''
-                    cv2_data = getattr(cv2, 'data', None)
-                    try:
-                        if isinstance(cv2_data, str):
-                            cascade_path = os.path.join(cv2_data, 'haarcascade_frontalface_default.xml')
-                        elif cv2_data and hasattr(cv2_data, 'haarcascades'):
-                            cascade_path = os.path.join(cv2_data.haarcascades, 'haarcascade_frontalface_default.xml')
-                        elif hasattr(cv2, 'data') and isinstance(getattr(cv2, 'data'), str):
-                            cascade_path = os.path.join(getattr(cv2, 'data'), 'haarcascade_frontalface_default.xml')
-                    except Exception:
-                        cascade_path = ''
-                if Config.DEBUG_MODE:
-                    print(f"Using cascade at: {cascade_path}")
-                self.detector = cv2.CascadeClassifier(cascade_path)
+                self.detector = model_registry.haar_cascade()
         else:
             # dlib not installed; use OpenCV cascade as a lightweight fallback
             if Config.DEBUG_MODE:
                 print("dlib not available — using OpenCV Haar cascade fallback for face detection")
-            model_dir = getattr(Config, 'MODEL_DIR', os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', 'models'))
-            cascade_path = os.path.join(model_dir, 'haarcascade_frontalface_default.xml')
-            if not os.path.exists(cascade_path):
-                # cv2.data can be a string or module; prefer cv2.data.haarcascades when available
-                cascade_path = ''
-                cv2_data = getattr(cv2, 'data', None)
-                try:
-                    if isinstance(cv2_data, str):
-                        cascade_path = os.path.join(cv2_data, 'haarcascade_frontalface_default.xml')
-                    elif cv2_data and hasattr(cv2_data, 'haarcascades'):
-                        cascade_path = os.path.join(cv2_data.haarcascades, 'haarcascade_frontalface_default.xml')
-                except Exception:
-                    cascade_path = ''
-            if Config.DEBUG_MODE:
-                print(f"Using cascade at: {cascade_path}")
-            self.detector = cv2.CascadeClassifier(cascade_path)
+            self.detector = model_registry.haar_cascade()
+
+        # (student_id, photo_path) -> 100x100 grayscale crop or None, LRU ordered
+        self._template_cache = OrderedDict()
+        self._template_lock = threading.Lock()
+
+        # Single-image detection used by get_face_encoding (registration, check-face)
+        confident_size = getattr(Config, 'DETECTION_CONFIDENT_FACE_SIZE', 80)
+        self.encoding_strategy = DetectionStrategy(
+            [self._scale_stage(scale) for scale in getattr(Config, 'DLIB_DETECTION_SCALES', (1.0, 0.75, 1.5))],
+            confident_quality=confident_size * confident_size,
+        ) if self.dlib_available else None
 
         self.load_known_faces()
+        if getattr(Config, 'MODEL_WARM_UP', True):
+            self.warm_up()
     
     def load_known_faces(self):
-        """Load known face encodings from students.json"""
-        students = load_json(Config.STUDENTS_JSON)
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_student_ids = []
-        self.known_face_photos = []
-        
-        for student in students:
-            self.known_face_encodings.append(np.array(student['encoding']))
-            self.known_face_names.append(student['name'])
-            self.known_student_ids.append(student['student_id'])
-            # Optional photo path for fallback matching. If not present, try to find a photo file
-            photo = student.get('photo_path')
-            if not photo:
-                # look up in the student photos directory for files starting with student_id_
-                try:
-                    files = os.listdir(Config.STUDENT_PHOTOS_DIR)
-                    matched = [f for f in files if f.startswith(f"{student.get('student_id')}_")]
-                    if matched:
-                        photo = os.path.join(Config.STUDENT_PHOTOS_DIR, matched[-1])
-                except Exception:
-                    photo = None
-            self.known_face_photos.append(photo)
-    
+        """Load known face encodings from the binary encoding store.
+
+        students.json only provides metadata (photo paths); a legacy file with
+        inline encodings is converted first. Builds a complete new gallery and
+        swaps it in with one assignment, so concurrent ``process_frame`` calls
+        keep using the previous one until it is ready. Photos are looked up
+        with a single directory listing.
+        """
+        store, students = open_gallery_store(get_storage().list_students())
+        self._photo_index = index_student_photos()
+        self._student_photos = {s.get('student_id'): s.get('photo_path') for s in students if s.get('photo_path')}
+        self.live_gallery = LiveGallery.from_store(store, photo_lookup=self._lookup_photo)
+        if Config.DEBUG_MODE:
+            print(f"Loaded {len(self.live_gallery)} known face(s) for {len(students)} student record(s)")
+
+    def _lookup_photo(self, student_id):
+        return self._student_photos.get(student_id) or self._photo_index.get(str(student_id))
+
+    @property
+    def gallery(self):
+        """Current read-only gallery snapshot, including registrations made by
+        other workers; grab it once per frame"""
+        return self.live_gallery.refresh()
+
+    def _rank_candidates(self, gallery, face_encoding, scored=None):
+        """Score a probe against the gallery and pick the top candidates.
+
+        Returns a dict with the two best candidates by distance, the two best by
+        cosine and the row indices of the top 3 by cosine, or None if the
+        gallery is empty. Each candidate is ``{'i', 'distance', 'cosine'}``.
+        Only the ANN shortlist is scored, but with exact metrics. Students with
+        several embeddings count once (their closest embedding), so the margin
+        checks always compare two different students. ``scored`` is this
+        probe's entry from ``gallery.search_students_many``, if already computed.
+        """
+        rows, distances, cosines = scored if scored is not None else gallery.search_students(face_encoding)
+        if distances.size == 0:
+            return None
+
+        def candidate(j):
+            return {'i': int(rows[j]), 'distance': float(distances[j]), 'cosine': float(cosines[j])}
+
+        by_distance = top_k(distances, 2)
+        by_cosine = top_k(cosines, 3, largest=True)
+        ranked = {
+            'best': candidate(by_distance[0]),
+            'second': candidate(by_distance[1]) if len(by_distance) > 1 else None,
+            'best_cos': candidate(by_cosine[0]),
+            'second_cos': candidate(by_cosine[1]) if len(by_cosine) > 1 else None,
+            'top_cosine': [int(rows[j]) for j in by_cosine],
+        }
+        if Config.DEBUG_MODE:
+            for key in ('best', 'second', 'best_cos'):
+                c = ranked[key]
+                if c:
+                    print(f"Candidate {key} known[{c['i']}] name={gallery.names[c['i']]} id={gallery.student_ids[c['i']]} distance={c['distance']:.4f} cosine={c['cosine']:.4f}")
+        return ranked
+
     def get_face_encoding(self, image):
         """Get face encoding for a single image"""
         try:
@@ -131,41 +155,15 @@ class DlibFaceService:
             
             # If dlib is available use the original pipeline
             if self.dlib_available:
-                # Detect faces with multiple scale factors for better detection
-                faces = []
-                best_quality = 0
-                best_face = None
-
-                for scale in [1.0, 0.75, 1.5]:  # Try different scales
-                    test_img = cv2.resize(rgb_image, (0, 0), fx=scale, fy=scale)
-                    detected = self.detector(test_img, 1)  # Second argument is number of upsampling
-
-                    for det in detected:
-                        # Convert coordinates back to original scale
-                        scaled_rect = dlib.rectangle(
-                            int(det.left()/scale), 
-                            int(det.top()/scale),
-                            int(det.right()/scale),
-                            int(det.bottom()/scale)
-                        )
-
-                        # Calculate face quality (size and position)
-                        face_width = det.right() - det.left()
-                        face_height = det.bottom() - det.top()
-                        quality = face_width * face_height
-
-                        if quality > best_quality:
-                            best_quality = quality
-                            best_face = scaled_rect
-                            faces = [scaled_rect]  # Keep only the best face
-
-                if not faces:
+                # Try the detection scales until one finds a large enough face
+                face = self.encoding_strategy.run(rgb_image)
+                if face is None:
                     if Config.DEBUG_MODE:
                         print("No face detected in the image")
                     return None
 
                 # Get face shape and compute encoding
-                shape = self.shape_predictor(rgb_image, faces[0])
+                shape = self.shape_predictor(rgb_image, face)
                 face_encoding = self.face_rec_model.compute_face_descriptor(rgb_image, shape)
 
                 if Config.DEBUG_MODE:
@@ -182,17 +180,8 @@ class DlibFaceService:
                 return None
 
             # Create a deterministic placeholder encoding (not suitable for real recognition)
-            # Use a normalized histogram of the face region and pad/truncate to 128 dims
             x, y, w, h = rects[0]
-            face_region = gray[y:y+h, x:x+w]
-            hist = cv2.calcHist([face_region], [0], None, [64], [0, 256]).flatten()
-            hist = hist / (np.linalg.norm(hist) + 1e-6)
-            # Pad to 128
-            if hist.size < 128:
-                pad = np.zeros(128 - hist.size, dtype=float)
-                encoding = np.concatenate([hist, pad])
-            else:
-                encoding = hist[:128]
+            encoding = self._histogram_encoding(gray, (x, y, x + w, y + h))
 
             if Config.DEBUG_MODE:
                 print("Returning fallback (non-dlib) face encoding")
@@ -203,210 +192,393 @@ class DlibFaceService:
                 print(f"Error in get_face_encoding: {str(e)}")
             return None
     
-    def process_frame(self, frame):
-        """Process a video frame and return recognized faces"""
-        # Resize frame for faster face recognition
-        height, width = frame.shape[:2]
-        small_frame = cv2.resize(frame, (width//2, height//2))  # Less aggressive resize
-        
-        # Convert frame to RGB (dlib expects RGB)
-        rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-        
-        if Config.DEBUG_MODE:
-            print("Processing frame:", rgb_frame.shape)
-        
-        # Detect faces first
+    def warm_up(self):
+        """Run one dummy inference through every model so the first real
+        request does not pay for lazy initialisation"""
+        try:
+            blank = np.zeros((120, 120, 3), dtype=np.uint8)
+            gray = np.zeros((120, 120), dtype=np.uint8)
+            if self.dlib_available:
+                self.detector(blank, 0)
+                self._encode_faces(blank, gray, [(20, 20, 100, 100)])
+            model_registry.warm_up_cascade(model_registry.haar_cascade())
+        except Exception as e:
+            if Config.DEBUG_MODE:
+                print(f"Model warm-up failed: {e}")
+
+    def _scale_stage(self, scale):
+        """Detection stage running HOG (one upsample) on the image resized by ``scale``.
+
+        A hit is the largest face, in original-image coordinates, with its area
+        as the quality.
+        """
+        def detect(rgb_image):
+            test_img = rgb_image if scale == 1.0 else cv2.resize(rgb_image, (0, 0), fx=scale, fy=scale)
+            best = None
+            for det in self.detector(test_img, 1):  # Second argument is number of upsampling
+                # Convert coordinates back to original scale
+                rect = dlib.rectangle(
+                    int(det.left() / scale),
+                    int(det.top() / scale),
+                    int(det.right() / scale),
+                    int(det.bottom() / scale)
+                )
+                quality = rect.width() * rect.height()
+                if best is None or quality > best[1]:
+                    best = (rect, quality)
+            return best
+        return DetectionStage(f"hog_x{scale:g}", detect)
+
+    def detection_stats(self):
+        """Per-stage timing and hit counters of get_face_encoding"""
+        if self.encoding_strategy is None:
+            return {}
+        return self.encoding_strategy.stats()
+
+    def _detect_faces(self, rgb_frame, gray_frame):
+        """Run the detector once and return face boxes as (left, top, right, bottom)"""
         if self.dlib_available:
-            faces = self.detector(rgb_frame)
-            num_faces = len(faces)
+            upsample = getattr(Config, 'FRAME_DETECTION_UPSAMPLE', 1)
+            return [(d.left(), d.top(), d.right(), d.bottom()) for d in self.detector(rgb_frame, upsample)]
+        rects = self.detector.detectMultiScale(gray_frame, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        return [(int(x), int(y), int(x + w), int(y + h)) for (x, y, w, h) in rects]
+
+    def _encode_faces(self, rgb_frame, gray_frame, boxes):
+        """Compute one descriptor per box, reusing the detector's rectangles.
+
+        With dlib all landmarks are collected first and the ResNet descriptors
+        are computed in a single batched ``compute_face_descriptor`` call.
+        """
+        return self._encode_faces_many([(rgb_frame, gray_frame, boxes)])[0]
+
+    def _encode_faces_many(self, items):
+        """``_encode_faces`` over several ``(rgb_frame, gray_frame, boxes)`` at once.
+
+        With dlib the descriptors of every frame come from one batched
+        ``compute_face_descriptor`` call over all images. Returns one list of
+        descriptors per item.
+        """
+        results = [[] for _ in items]
+        if not self.dlib_available:
+            for n, (_, gray_frame, boxes) in enumerate(items):
+                results[n] = [self._histogram_encoding(gray_frame, box) for box in boxes]
+            return results
+        images, batch_shapes, positions = [], [], []
+        for n, (rgb_frame, _, boxes) in enumerate(items):
+            if not boxes:
+                continue
+            shapes = dlib.full_object_detections()
+            for (left, top, right, bottom) in boxes:
+                shapes.append(self.shape_predictor(rgb_frame, dlib.rectangle(left, top, right, bottom)))
+            images.append(rgb_frame)
+            batch_shapes.append(shapes)
+            positions.append(n)
+        if not images:
+            return results
+        if len(images) == 1:
+            batches = [self.face_rec_model.compute_face_descriptor(images[0], batch_shapes[0])]
         else:
-            gray = cv2.cvtColor(rgb_frame, cv2.COLOR_BGR2GRAY)
-            rects = self.detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-            num_faces = len(rects)
+            batches = self.face_rec_model.compute_face_descriptor(images, batch_shapes)
+        for n, descriptors in zip(positions, batches):
+            results[n] = [np.asarray(d, dtype=np.float32) for d in descriptors]
+        return results
+
+    @staticmethod
+    def _histogram_encoding(gray, box):
+        """Deterministic placeholder encoding used when dlib is unavailable.
+
+        A normalized 64-bin histogram of the face region padded to 128 dims; it
+        is not suitable for real recognition.
+        """
+        left, top, right, bottom = box
+        face_region = gray[max(top, 0):bottom, max(left, 0):right]
+        hist = cv2.calcHist([face_region], [0], None, [64], [0, 256]).flatten()
+        hist = hist / (np.linalg.norm(hist) + 1e-6)
+        if hist.size < 128:
+            return np.concatenate([hist, np.zeros(128 - hist.size, dtype=float)])
+        return hist[:128].astype(float)
+
+    @staticmethod
+    def _face_crop(gray, box, size=(100, 100)):
+        """Crop a face box out of a grayscale image and resize it for template matching"""
+        left, top, right, bottom = box
+        crop = gray[max(top, 0):bottom, max(left, 0):right]
+        if crop.size == 0:
+            return None
+        return cv2.resize(crop, size)
+
+    def _stored_face_crop(self, gallery, i):
+        """Return the cached 100x100 grayscale face crop of gallery row ``i``.
+
+        Crops are computed lazily from the stored photo (one imread + one
+        cascade pass) and kept in an LRU of TEMPLATE_CACHE_SIZE entries keyed by
+        student_id and photo path. Registration saves every photo under a new
+        timestamped path, so a key never goes stale; ``invalidate_template``
+        drops a student's entries on re-registration. Photos that cannot be
+        read or have no detectable face are cached as None.
+        """
+        student_id = gallery.student_ids[i]
+        photo = gallery.photos[i]
+        if not photo:
+            return None
 
-        if Config.DEBUG_MODE:
-            print(f"Number of faces detected: {num_faces}")
-
-        if num_faces == 0:
-            return []
-
-        # Get face encoding for the first face (may be a fallback)
-        face_encoding = self.get_face_encoding(rgb_frame)
-        
-        recognized_faces = []
-        
-        if face_encoding is not None:
-            # Compare with known faces
+        key = (student_id, photo)
+        with self._template_lock:
+            if key in self._template_cache:
+                self._template_cache.move_to_end(key)
+                return self._template_cache[key]
+
+        crop = None
+        try:
+            sp = cv2.imread(photo)
+            if sp is not None:
+                gray_sp = cv2.cvtColor(sp, cv2.COLOR_BGR2GRAY)
+                r = model_registry.haar_cascade().detectMultiScale(gray_sp, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+                if len(r) > 0:
+                    x, y, w, h = r[0]
+                    crop = self._face_crop(gray_sp, (x, y, x + w, y + h))
+        except Exception as e:
             if Config.DEBUG_MODE:
-                print(f"Comparing face encoding (len={len(face_encoding)}) against {len(self.known_face_encodings)} known encodings")
+                print(f"Could not build template crop for {student_id}: {e}")
+
+        with self._template_lock:
+            self._template_cache[key] = crop
+            self._template_cache.move_to_end(key)
+            while len(self._template_cache) > getattr(Config, 'TEMPLATE_CACHE_SIZE', 1024):
+                self._template_cache.popitem(last=False)
+        return crop
+
+    def _live_template(self, gray_frame, box, haar_boxes):
+        """100x100 crop of the face at ``box`` framed like the stored photos' crops.
+
+        Stored crops come from Haar boxes; dlib's HOG boxes frame a face
+        differently, so with dlib the cascade is run over the frame (once per
+        frame, kept in the ``haar_boxes`` list) and the Haar box overlapping
+        ``box`` most is cropped. None if the cascade finds no such face.
+        """
+        if not self.dlib_available:
+            return self._face_crop(gray_frame, box)  # the detector is the cascade
+        if not haar_boxes:
+            rects = model_registry.haar_cascade().detectMultiScale(gray_frame, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+            haar_boxes.append([(int(x), int(y), int(x + w), int(y + h)) for (x, y, w, h) in rects])
+        overlaps = [(box_iou(box, haar), haar) for haar in haar_boxes[0]]
+        overlap, haar = max(overlaps, default=(0.0, None))
+        return self._face_crop(gray_frame, haar) if overlap > 0 else None
+
+    def invalidate_template(self, student_id):
+        """Drop the cached template crop of a student (e.g. after re-registration)"""
+        with self._template_lock:
+            for key in [k for k in self._template_cache if k[0] == student_id]:
+                del self._template_cache[key]
+
+    def _match_encoding(self, gallery, face_encoding, live_face, scored=None):
+        """Match one descriptor against the gallery.
+
+        Distance is tried first, then cosine, then template matching of
+        ``live_face`` (a 100x100 grayscale crop, or a function returning it,
+        called only if the template fallback runs) against the stored photos
+        of the top cosine candidates. Returns ``(row, reason, is_high_conf)`` for
+        a row of ``gallery``, or None when there is no confident match.
+        """
+        # Score the probe against the whole gallery in one batched call
+        ranked = self._rank_candidates(gallery, face_encoding, scored)
+        if ranked is None:
+            return None
 
-            # Collect scores for all known encodings first, then pick the best candidate with a margin
-            candidates = []  # list of dicts: {i, distance, cosine}
-            fe = np.array(face_encoding)
-            for i, known_encoding in enumerate(self.known_face_encodings):
-                try:
-                    ke = np.array(known_encoding)
-                except Exception as ex:
+        # Decide using distance first if best distance below tolerance
+        best = ranked['best']
+        second = ranked['second']
+
+        matched_index = None
+        match_reason = None
+
+        # margin thresholds (read from Config to allow tuning)
+        DISTANCE_MARGIN = getattr(Config, 'DISTANCE_MARGIN', 0.20)
+        COSINE_MARGIN = getattr(Config, 'COSINE_MARGIN', 0.08)
+        COSINE_THRESHOLD = getattr(Config, 'COSINE_THRESHOLD', 0.65)
+        TEMPLATE_THRESHOLD = getattr(Config, 'TEMPLATE_THRESHOLD', 0.60)
+        COSINE_DISTANCE_GUARD = getattr(Config, 'COSINE_DISTANCE_GUARD', 0.90)
+
+        if best['distance'] < Config.FACE_RECOGNITION_TOLERANCE:
+            # require margin between best and second best to avoid ambiguous picks
+            if second is None or (second['distance'] - best['distance']) > DISTANCE_MARGIN:
+                matched_index = best['i']
+                match_reason = f"distance ({best['distance']:.4f})"
+            else:
+                if Config.DEBUG_MODE:
+                    print(f"Best distance {best['distance']:.4f} not sufficiently better than second {second['distance']:.4f}")
+
+        # If not matched by distance, try cosine on top cosine candidate
+        if matched_index is None:
+            best_cos = ranked['best_cos']
+            second_cos = ranked['second_cos']
+            if best_cos['cosine'] >= COSINE_THRESHOLD:
+                # additional guard: ensure that candidate's distance is not extremely large
+                cand_dist = best_cos.get('distance', 1e9)
+                if cand_dist <= COSINE_DISTANCE_GUARD and (second_cos is None or (best_cos['cosine'] - second_cos['cosine']) > COSINE_MARGIN):
+                    matched_index = best_cos['i']
+                    match_reason = f"cosine ({best_cos['cosine']:.4f})"
+                else:
                     if Config.DEBUG_MODE:
-                        print(f"Skipping known encoding #{i} due to exception: {ex}")
+                        sc = second_cos['cosine'] if second_cos else 0.0
+                        print(f"Best cosine {best_cos['cosine']:.4f} not sufficiently better than second {sc:.4f} or distance {cand_dist:.4f} too large")
+
+        # If still no confident match, use template matching on top N candidates (by cosine)
+        if matched_index is None and callable(live_face):
+            live_face = live_face()
+        if matched_index is None and live_face is not None:
+            # try top 3 by cosine
+            for i in ranked['top_cosine']:
+                sp_r = self._stored_face_crop(gallery, i)
+                if sp_r is None:
                     continue
-
-                # compute distance and cosine
                 try:
-                    distance = float(np.linalg.norm(fe - ke))
+                    res = cv2.matchTemplate(live_face, sp_r, cv2.TM_CCOEFF_NORMED)
+                    _, max_val, _, _ = cv2.minMaxLoc(res)
+                    if Config.DEBUG_MODE:
+                        print(f"Template max_val for known[{i}]: {max_val:.4f}")
+                    if max_val > TEMPLATE_THRESHOLD:
+                        matched_index = i
+                        match_reason = f"template ({max_val:.4f})"
+                        break
                 except Exception:
-                    distance = float('inf')
+                    pass
 
-                try:
-                    denom = (np.linalg.norm(fe) * np.linalg.norm(ke)) + 1e-9
-                    cosine_sim = float(np.dot(fe, ke) / denom)
-                except Exception:
-                    cosine_sim = 0.0
+        if matched_index is None:
+            return None
+
+        # Decide if we can accept immediately (high-confidence) or require consecutive frames
+        immediate_dist = getattr(Config, 'FACE_RECOGNITION_IMMEDIATE_DISTANCE', 0.35)
+        immediate_cos = getattr(Config, 'FACE_RECOGNITION_IMMEDIATE_COSINE', 0.92)
+
+        # Heuristic: accept immediately if very low distance OR very high cosine similarity
+        is_high_conf = False
+        try:
+            if best and best.get('distance', 1e9) <= immediate_dist:
+                is_high_conf = True
+            # also accept if any candidate has extremely high cosine and reasonable distance
+            top_cos = ranked['best_cos']
+            if top_cos.get('cosine', 0.0) >= immediate_cos and top_cos.get('distance', 1e9) <= COSINE_DISTANCE_GUARD:
+                is_high_conf = True
+        except Exception:
+            is_high_conf = False
+
+        return matched_index, match_reason, is_high_conf
+
+    def process_frame(self, frame, camera_id=None, prescaled=False):
+        """Process a video frame and return one entry per recognized face.
+
+        Faces are detected once on the half-size frame and associated with the
+        camera's face tracks. Descriptors are only computed (in one batch) for
+        tracks that need them; stable, confirmed tracks reuse their identity.
+        A student matched on several boxes is reported once, for the largest
+        box. Every entry carries its ``box`` in full-frame coordinates and the
+        ``track_id`` it was confirmed on. With ``prescaled`` the frame was
+        already decoded at 1/FRAME_SCALE size and is used as is.
+        """
+        return self.process_frames([(camera_id, frame)], prescaled=prescaled)[0]
+
+    def process_frames(self, frames, prescaled=False):
+        """``process_frame`` over several ``(camera_id, frame)`` pairs at once.
+
+        Detection and tracking run per frame; the descriptors of all frames are
+        then computed in one batch and scored against the gallery with one
+        matrix product. Returns one list of recognized faces per frame.
+        """
+        # A track must be assigned before the same camera's next frame moves it
+        cameras = [camera_id or 'default' for camera_id, _ in frames]
+        for i in range(1, len(cameras)):
+            if cameras[i] in cameras[:i]:
+                return self.process_frames(frames[:i], prescaled) + self.process_frames(frames[i:], prescaled)
+
+        scale = self.FRAME_SCALE
+        prepared = []
+        for camera_id, frame in frames:
+            # Resize frame for faster face recognition
+            if prescaled:
+                small_frame = frame
+            else:
+                height, width = frame.shape[:2]
+                small_frame = cv2.resize(frame, (width//scale, height//scale))  # Less aggressive resize
+
+            # Convert frame to RGB (dlib expects RGB)
+            rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+            gray_frame = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY)
+
+            if Config.DEBUG_MODE:
+                print("Processing frame:", rgb_frame.shape)
+
+            # Single detection pass; the rectangles are reused for encoding and template crops
+            boxes = self._detect_faces(rgb_frame, gray_frame)
+
+            if Config.DEBUG_MODE:
+                print(f"Number of faces detected: {len(boxes)}")
+
+            session = self.camera_sessions.get(camera_id or 'default')
+            if session.tracker is None:
+                session.tracker = FaceTracker()
 
-                candidates.append({
-                    'i': i,
-                    'distance': distance,
-                    'cosine': cosine_sim
-                })
+            live_faces = [self._face_crop(gray_frame, box) for box in boxes]
+            tracked = session.tracker.update(boxes, live_faces)
 
+            # Only the faces whose tracks need a fresh descriptor are encoded
+            to_encode = [j for j, (_, needs_encoding) in enumerate(tracked) if needs_encoding]
+            if Config.DEBUG_MODE:
+                print(f"Encoding {len(to_encode)} of {len(boxes)} tracked faces")
+            prepared.append((rgb_frame, gray_frame, boxes, live_faces, tracked, to_encode))
+
+        encoded = self._encode_faces_many([(rgb, gray, [boxes[j] for j in to_encode])
+                                           for rgb, gray, boxes, _, _, to_encode in prepared])
+        gallery = self.gallery
+        searches = iter(gallery.search_students_many([enc for encodings in encoded for enc in encodings]))
+
+        results = []
+        min_frames = getattr(Config, 'MIN_CONSECUTIVE_FRAMES', 1)
+        for (_, gray_frame, boxes, _, tracked, to_encode), encodings in zip(prepared, encoded):
+            haar_boxes = []
+            for j, face_encoding in zip(to_encode, encodings):
+                track = tracked[j][0]
+                live_face = lambda box=boxes[j], gray=gray_frame: self._live_template(gray, box, haar_boxes)
+                match = self._match_encoding(gallery, face_encoding, live_face, scored=next(searches))
+                if match is None:
+                    track.assign(None)
+                    continue
+                matched_index, match_reason, is_high_conf = match
+                track.assign({
+                    'student_id': gallery.student_ids[matched_index],
+                    'name': gallery.names[matched_index],
+                    'photo_path': gallery.photos[matched_index],
+                }, high_conf=is_high_conf)
                 if Config.DEBUG_MODE:
-                    print(f"Candidate known[{i}] name={self.known_face_names[i]} id={self.known_student_ids[i]} distance={distance:.4f} cosine={cosine_sim:.4f}")
-
-            if not candidates:
-                return recognized_faces
-
-            # Sort by distance (ascending) and by cosine (descending) for tie-breaks
-            candidates_by_distance = sorted(candidates, key=lambda c: c['distance'])
-            candidates_by_cosine = sorted(candidates, key=lambda c: c['cosine'], reverse=True)
-
-            # Decide using distance first if best distance below tolerance
-            best = candidates_by_distance[0]
-            second = candidates_by_distance[1] if len(candidates_by_distance) > 1 else None
-
-            matched_index = None
-            match_reason = None
-
-            # margin thresholds (read from Config to allow tuning)
-            DISTANCE_MARGIN = getattr(Config, 'DISTANCE_MARGIN', 0.20)
-            COSINE_MARGIN = getattr(Config, 'COSINE_MARGIN', 0.08)
-            COSINE_THRESHOLD = getattr(Config, 'COSINE_THRESHOLD', 0.65)
-            TEMPLATE_THRESHOLD = getattr(Config, 'TEMPLATE_THRESHOLD', 0.60)
-            COSINE_DISTANCE_GUARD = getattr(Config, 'COSINE_DISTANCE_GUARD', 0.90)
-
-            if best['distance'] < Config.FACE_RECOGNITION_TOLERANCE:
-                # require margin between best and second best to avoid ambiguous picks
-                if second is None or (second['distance'] - best['distance']) > DISTANCE_MARGIN:
-                    matched_index = best['i']
-                    match_reason = f"distance ({best['distance']:.4f})"
-                else:
-                    if Config.DEBUG_MODE:
-                        print(f"Best distance {best['distance']:.4f} not sufficiently better than second {second['distance']:.4f}")
-
-            # If not matched by distance, try cosine on top cosine candidate
-            if matched_index is None:
-                best_cos = candidates_by_cosine[0]
-                second_cos = candidates_by_cosine[1] if len(candidates_by_cosine) > 1 else None
-                if best_cos['cosine'] >= COSINE_THRESHOLD:
-                    # additional guard: ensure that candidate's distance is not extremely large
-                    cand_dist = best_cos.get('distance', 1e9)
-                    if cand_dist <= COSINE_DISTANCE_GUARD and (second_cos is None or (best_cos['cosine'] - second_cos['cosine']) > COSINE_MARGIN):
-                        matched_index = best_cos['i']
-                        match_reason = f"cosine ({best_cos['cosine']:.4f})"
-                    else:
-                        if Config.DEBUG_MODE:
-                            sc = second_cos['cosine'] if second_cos else 0.0
-                            print(f"Best cosine {best_cos['cosine']:.4f} not sufficiently better than second {sc:.4f} or distance {cand_dist:.4f} too large")
-
-            # If still no confident match, use template matching on top N candidates (by cosine)
-            if matched_index is None and self.known_face_photos:
-                # try top 3 by cosine
-                for cand in candidates_by_cosine[:3]:
-                    i = cand['i']
-                    stored_photo = self.known_face_photos[i]
-                    try:
-                        if stored_photo and os.path.exists(stored_photo):
-                            sp = cv2.imread(stored_photo)
-                            if sp is not None:
-                                gray_sp = cv2.cvtColor(sp, cv2.COLOR_BGR2GRAY)
-                                r = self.detector.detectMultiScale(gray_sp, scaleFactor=1.1, minNeighbors=5, minSize=(30,30))
-                                if len(r) > 0:
-                                    x,y,w,h = r[0]
-                                    sp_face = gray_sp[y:y+h, x:x+w]
-                                    gray_live = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY)
-                                    r2 = self.detector.detectMultiScale(gray_live, scaleFactor=1.1, minNeighbors=5, minSize=(30,30))
-                                    if len(r2) > 0:
-                                        x2,y2,w2,h2 = r2[0]
-                                        live_face = gray_live[y2:y2+h2, x2:x2+w2]
-                                        try:
-                                            sp_r = cv2.resize(sp_face, (100,100))
-                                            live_r = cv2.resize(live_face, (100,100))
-                                            res = cv2.matchTemplate(live_r, sp_r, cv2.TM_CCOEFF_NORMED)
-                                            _, max_val, _, _ = cv2.minMaxLoc(res)
-                                            if Config.DEBUG_MODE:
-                                                print(f"Template max_val for known[{i}]: {max_val:.4f}")
-                                            if max_val > TEMPLATE_THRESHOLD:
-                                                matched_index = i
-                                                match_reason = f"template ({max_val:.4f})"
-                                                break
-                                        except Exception:
-                                            pass
-                    except Exception:
-                        pass
-
-            # If we have a confident match, require consecutive-frame confirmation before returning
-            if matched_index is not None:
-                name = self.known_face_names[matched_index]
-                student_id = self.known_student_ids[matched_index]
-                face_entry = {'student_id': student_id, 'name': name}
+                    print(f"Track {track.track_id} matched {track.identity_key} by {match_reason} (streak {track.streak})")
+            for j, (track, needs_encoding) in enumerate(tracked):
+                if not needs_encoding:
+                    track.carry()
+
+            by_student = {}
+            for box, (track, _) in zip(boxes, tracked):
+                # Confirmation counts consecutive frames per track (high-confidence matches are immediate)
+                if not track.is_confirmed(min_frames):
+                    continue
+                left, top, right, bottom = box
+                # One entry per student and frame: the largest of their boxes
+                area = (right - left) * (bottom - top)
+                student_id = track.identity['student_id']
+                if student_id in by_student and by_student[student_id][0] >= area:
+                    continue
+                face_entry = {
+                    'student_id': student_id,
+                    'name': track.identity['name'],
+                    'box': {'left': left * scale, 'top': top * scale, 'right': right * scale, 'bottom': bottom * scale},
+                    'track_id': track.track_id,
+                }
                 # attach photo path if available
-                try:
-                    photo = self.known_face_photos[matched_index]
-                except Exception:
-                    photo = None
-                if photo:
-                    face_entry['photo_path'] = photo
+                if track.identity.get('photo_path'):
+                    face_entry['photo_path'] = track.identity['photo_path']
+                by_student[student_id] = (area, face_entry)
+            results.append([face_entry for _, face_entry in by_student.values()])
 
-                # Decide if we can accept immediately (high-confidence) or require consecutive frames
-                immediate_dist = getattr(Config, 'FACE_RECOGNITION_IMMEDIATE_DISTANCE', 0.35)
-                immediate_cos = getattr(Config, 'FACE_RECOGNITION_IMMEDIATE_COSINE', 0.92)
-
-                # Heuristic: accept immediately if very low distance OR very high cosine similarity
-                is_high_conf = False
-                try:
-                    if best and best.get('distance', 1e9) <= immediate_dist:
-                        is_high_conf = True
-                    # also accept if any candidate has extremely high cosine and reasonable distance
-                    top_cos = candidates_by_cosine[0]
-                    if top_cos.get('cosine', 0.0) >= immediate_cos and top_cos.get('distance', 1e9) <= COSINE_DISTANCE_GUARD:
-                        is_high_conf = True
-                except Exception:
-                    is_high_conf = False
-
-                match_key = f"{student_id}_{name}"
-                # reset other counters
-                for k in list(self.consecutive_frames.keys()):
-                    if k != match_key:
-                        self.consecutive_frames[k] = 0
-
-                if is_high_conf:
-                    # Immediately accept high-confidence matches
-                    recognized_faces.append(face_entry)
-                    # also set counter so subsequent logic knows this was recently seen
-                    self.consecutive_frames[match_key] = getattr(self.consecutive_frames, match_key, 0) + 1
-                    if Config.DEBUG_MODE:
-                        print(f"Selected (IMMEDIATE) match: {name} (id={student_id}) by {match_reason} (high-confidence)")
-                else:
-                    # Normal consecutive-frame logic
-                    self.consecutive_frames[match_key] = self.consecutive_frames.get(match_key, 0) + 1
-                    if Config.DEBUG_MODE:
-                        print(f"Consecutive frames for {match_key}: {self.consecutive_frames[match_key]}")
-
-                    if self.consecutive_frames.get(match_key, 0) >= getattr(Config, 'MIN_CONSECUTIVE_FRAMES', 1):
-                        recognized_faces.append(face_entry)
-                        if Config.DEBUG_MODE:
-                            print(f"Selected match: {name} (id={student_id}) by {match_reason} after {self.consecutive_frames[match_key]} frames")
-        
-        return recognized_faces
+        return results
     
     def register_new_student(self, student_id, name, image_path):
         """Register a new student with their face encoding"""
@@ -421,24 +593,20 @@ class DlibFaceService:
             if encoding is None:
                 raise ValueError("No face found in the image")
             
-            # Load existing students
-            students = load_json(Config.STUDENTS_JSON)
-            
-            # Add new student
+            # Add new student; a re-registration replaces the previous record
+            # (the encoding itself goes to the binary store)
             student_data = {
                 "student_id": student_id,
                 "name": name,
-                "encoding": encoding,  # encoding is already a list from get_face_encoding
                 "photo_path": image_path
             }
             
-            students.append(student_data)
-            
-            # Save updated students list
-            from utils.helpers import save_json
-            if save_json(Config.STUDENTS_JSON, students):
-                # Update in-memory encodings
-                self.load_known_faces()
+            if get_storage().upsert_student(student_data):
+                # Update the in-memory gallery in place instead of reloading everything;
+                # a re-registration must not reuse the old template crop
+                self.invalidate_template(student_id)
+                self._student_photos[student_id] = image_path
+                self.live_gallery.enroll(student_id, name, encoding, image_path)
                 return True
                 
             return False
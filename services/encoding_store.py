@@ -0,0 +1,357 @@
+"""Binary face-encoding store kept next to students.json.
+
+Encodings live in a raw little-endian float32 matrix (``ENCODINGS_FILE``) that
+is opened with ``np.memmap``, so loading a gallery is zero-copy. A small JSON
+Lines index (``ENCODINGS_INDEX``) maps rows to students::
+
+    {"format": 1, "dim": 128}                         header, first line
+    {"row": 0, "student_id": "101", "name": "Ann", "photo_path": "..."}
+    {"row": 1, "student_id": "101", "name": "Ann", "extra": true}
+    {"row": 0, "deleted": true}                       row 0 retired
+
+Both files are append-only: a new encoding for an existing student supersedes
+its previous rows, unless it is marked ``extra`` (another enrollment photo of
+the same student). The matrix row is written before its index line, so a crash
+in between leaves an orphan row that is simply ignored. ``students.json`` keeps
+only metadata (name, photo path).
+
+Several processes (gunicorn workers) can share one store. Writes are
+serialised with a file lock, and every write bumps a generation counter kept
+in a tiny memory-mapped file (``<matrix>.gen``: generation and compaction
+epoch as two little-endian uint64). Readers compare the counter with the one
+they last synced at, which costs a single shared-memory read per frame.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import Config
+from services.gallery import _max_embeddings
+from utils.helpers import load_json, save_json, file_lock
+
+FORMAT_VERSION = 1
+_GENERATION = struct.Struct('<QQ')  # generation, compaction epoch
+
+
+class EncodingStore:
+    """Append-only float32 encoding matrix plus a JSONL row index."""
+
+    def __init__(self, matrix_path=None, index_path=None):
+        self.matrix_path = matrix_path or Config.ENCODINGS_FILE
+        self.index_path = index_path or Config.ENCODINGS_INDEX
+        self.generation_path = self.matrix_path + '.gen'
+        self._lock = threading.RLock()
+        self._dim = None
+        self._generation_map = None
+
+    def exists(self):
+        return os.path.exists(self.index_path) and os.path.exists(self.matrix_path)
+
+    @property
+    def dim(self):
+        if self._dim is None and os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                header = json.loads(f.readline() or '{}')
+            self._dim = int(header.get('dim', 0)) or None
+        return self._dim
+
+    @contextmanager
+    def _writing(self):
+        # Thread lock for this process, file lock against the other workers
+        with self._lock, file_lock(self.matrix_path + '.lock'):
+            yield
+
+    def generation(self):
+        """Return ``(generation, epoch)`` as last published by any process.
+
+        ``generation`` changes on every write; ``epoch`` changes when
+        ``compact`` renumbered the rows.
+        """
+        if self._generation_map is None:
+            if not os.path.exists(self.generation_path):
+                return (0, 0)
+            self._open_generation()
+        return _GENERATION.unpack_from(self._generation_map, 0)
+
+    def _open_generation(self):
+        with open(self.generation_path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size < _GENERATION.size:
+                f.truncate(_GENERATION.size)
+            self._generation_map = mmap.mmap(f.fileno(), _GENERATION.size)
+
+    def _bump_generation(self, compacted=False):
+        # Called with the write lock held. The epoch is stored first, so a
+        # reader never sees a new generation paired with a stale epoch.
+        if self._generation_map is None:
+            self._open_generation()
+        generation, epoch = _GENERATION.unpack_from(self._generation_map, 0)
+        if compacted:
+            struct.pack_into('<Q', self._generation_map, 8, epoch + 1)
+        struct.pack_into('<Q', self._generation_map, 0, generation + 1)
+
+    def create(self, dim=128):
+        """Create empty store files (no-op if the store already exists)"""
+        with self._writing():
+            self._create(dim)
+
+    def _create(self, dim):
+        if self.exists():
+            return
+        with open(self.matrix_path, 'wb'):
+            pass
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'format': FORMAT_VERSION, 'dim': int(dim)}) + '\n')
+        os.replace(tmp, self.index_path)
+        self._dim = int(dim)
+        self._bump_generation()
+
+    def row_count(self):
+        """Number of complete rows in the matrix file"""
+        if not self.dim:
+            return 0
+        return os.path.getsize(self.matrix_path) // (self.dim * 4)
+
+    def open_matrix(self, rows=None):
+        """Return the first ``rows`` rows as a read-only (rows, dim) memmap"""
+        if rows is None:
+            rows = self.row_count()
+        if rows == 0 or not self.dim:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self.matrix_path, dtype='<f4', mode='r', shape=(rows, self.dim))
+
+    def read_index(self, offset=0):
+        """Read index events starting at byte ``offset``.
+
+        Returns ``(events, new_offset)`` where each event is
+        ``('add', row, student_id, name, photo_path, extra)`` or
+        ``('delete', row)``. A trailing
+        partial line (a write in progress) is left for the next call.
+        """
+        events = []
+        with open(self.index_path, 'rb') as f:
+            f.seek(offset)
+            if offset == 0:
+                offset += len(f.readline())  # header
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('deleted'):
+                    events.append(('delete', int(entry['row'])))
+                elif 'row' in entry:
+                    events.append(('add', int(entry['row']), entry.get('student_id'), entry.get('name'),
+                                   entry.get('photo_path'), bool(entry.get('extra'))))
+        return events, offset
+
+    def append(self, student_id, name, encoding, photo_path=None, extra=False):
+        """Append one encoding for ``student_id`` and return its row number.
+
+        With ``extra`` the student's previous rows stay live.
+        """
+        row = np.asarray(encoding, dtype='<f4').reshape(-1)
+        with self._writing():
+            if not self.exists():
+                self._create(row.shape[0])
+            if row.shape[0] != self.dim:
+                raise ValueError(f"encoding has {row.shape[0]} values, store expects {self.dim}")
+            with open(self.matrix_path, 'r+b') as f:
+                # Truncate any orphan partial row left by an interrupted write
+                size = os.fstat(f.fileno()).st_size
+                index = size // (self.dim * 4)
+                f.truncate(index * self.dim * 4)
+                f.seek(0, os.SEEK_END)
+                f.write(row.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            entry = {'row': int(index), 'student_id': student_id, 'name': name}
+            if photo_path:
+                entry['photo_path'] = photo_path
+            if extra:
+                entry['extra'] = True
+            self._append_index(entry)
+            self._bump_generation()
+            return int(index)
+
+    def delete(self, row):
+        """Retire a row (its bytes stay in the file until ``compact``)"""
+        with self._writing():
+            self._append_index({'row': int(row), 'deleted': True})
+            self._bump_generation()
+
+    def _append_index(self, entry):
+        with open(self.index_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def live_rows(self):
+        """Return ``{student_id: (row, name)}`` for the newest row of every student"""
+        return {sid: entries[-1][:2] for sid, entries in self._current_entries().items()}
+
+    def _current_entries(self):
+        # student_id -> [(row, name, photo_path), ...] of its live rows, oldest first
+        events, _ = self.read_index()
+        rows = self.row_count()
+        current = {}
+        owner = {}
+        for event in events:
+            if event[0] == 'add':
+                row, student_id, name, photo_path, extra = event[1:]
+                if row >= rows:
+                    continue
+                if not extra:
+                    current.pop(student_id, None)
+                current.setdefault(student_id, []).append((row, name, photo_path))
+                owner[row] = student_id
+            else:
+                student_id = owner.pop(event[1], None)
+                entries = current.get(student_id)
+                if entries:
+                    entries[:] = [e for e in entries if e[0] != event[1]]
+                    if not entries:
+                        del current[student_id]
+        return current
+
+    def compact(self):
+        """Rewrite both files keeping only each student's live rows.
+
+        Other processes notice the new epoch and remap the store from scratch.
+        """
+        with self._writing():
+            current = self._current_entries()
+            matrix = self.open_matrix()
+            items = sorted((entry[0], student_id, entry[1], entry[2], i > 0)
+                           for student_id, entries in current.items() for i, entry in enumerate(entries))
+            tmp_matrix = self.matrix_path + '.tmp'
+            tmp_index = self.index_path + '.tmp'
+            with open(tmp_matrix, 'wb') as f:
+                for row, *_ in items:
+                    f.write(np.asarray(matrix[row], dtype='<f4').tobytes())
+            with open(tmp_index, 'w') as f:
+                f.write(json.dumps({'format': FORMAT_VERSION, 'dim': int(self.dim)}) + '\n')
+                for new_row, (_, student_id, name, photo_path, extra) in enumerate(items):
+                    entry = {'row': new_row, 'student_id': student_id, 'name': name}
+                    if photo_path:
+                        entry['photo_path'] = photo_path
+                    if extra:
+                        entry['extra'] = True
+                    f.write(json.dumps(entry) + '\n')
+            del matrix
+            os.replace(tmp_matrix, self.matrix_path)
+            os.replace(tmp_index, self.index_path)
+            self._bump_generation(compacted=True)
+        return len(items)
+
+    def check_consistency(self, students):
+        """Compare the store with students.json metadata; return a list of problems"""
+        problems = []
+        if not self.exists():
+            return ['encoding store files are missing']
+        if self.dim and os.path.getsize(self.matrix_path) % (self.dim * 4):
+            problems.append('matrix file ends with a partial row')
+        current = self.live_rows()
+        records = {s.get('student_id'): s for s in students}
+        for student_id, record in records.items():
+            if student_id not in current:
+                problems.append(f"student {student_id} has no encoding")
+            elif current[student_id][1] != record.get('name'):
+                problems.append(f"student {student_id} name differs: {record.get('name')!r} vs {current[student_id][1]!r}")
+            if 'encoding' in record or 'encodings' in record:
+                problems.append(f"student {student_id} still has an inline encoding in students.json")
+        for student_id in current:
+            if student_id not in records:
+                problems.append(f"encoding row {current[student_id][0]} belongs to unknown student {student_id}")
+        return problems
+
+
+def open_gallery_store(students):
+    """Return the store for ``students``, converting an inline-encoding layout first.
+
+    ``students`` is the list of student records; it is reloaded from the
+    storage (and returned) if the conversion rewrote students.json.
+    Consistency problems are reported in debug mode.
+    """
+    store = EncodingStore()
+    # Student records from the storage carry no encodings, so check the file itself (startup only)
+    if not store.exists() or any('encoding' in s or 'encodings' in s for s in load_json(Config.STUDENTS_JSON)):
+        moved = convert_students_json(store)
+        from services.storage import get_storage
+        students = get_storage().list_students()
+        if moved:
+            print(f"Moved {moved} inline encoding(s) from students.json into {store.matrix_path}")
+    if Config.DEBUG_MODE:
+        problems = store.check_consistency(students)
+        for problem in problems[:10]:
+            print(f"Encoding store: {problem}")
+        if len(problems) > 10:
+            print(f"Encoding store: ... {len(problems) - 10} more problem(s)")
+    return store, students
+
+
+def convert_students_json(store=None, students_path=None):
+    """One-shot conversion of inline ``encoding`` lists into the binary store.
+
+    Every student with an encoding gets a row in the store and the encoding is
+    removed from students.json. Additional embeddings under ``encodings`` are
+    moved as extra rows, keeping the newest MAX_EMBEDDINGS_PER_STUDENT in all
+    (older ones are dropped, as the gallery would). An encoding the store
+    rejects stays inline. Returns the number of encodings moved.
+    """
+    store = store or EncodingStore()
+    students_path = students_path or Config.STUDENTS_JSON
+    # Several workers may start at once; only one of them converts
+    with file_lock(store.index_path + '.lock'):
+        return _convert_locked(store, students_path)
+
+
+def _convert_locked(store, students_path):
+    students = load_json(students_path)
+    stored = set(store.live_rows()) if store.exists() else set()
+    cap = _max_embeddings()
+    moved = 0
+    changed = False
+    for student in students:
+        if 'encoding' not in student and 'encodings' not in student:
+            continue
+        student_id = student.get('student_id')
+        # Same order and cap as LiveGallery.from_students: the newest embeddings win
+        queue = [('encoding', student['encoding'])] if 'encoding' in student else []
+        queue += [('encodings', e) for e in student.get('encodings') or []]
+        kept = queue[-cap:]
+        rejected = []
+        for key, encoding in kept:
+            try:
+                store.append(student_id, student.get('name'), encoding, student.get('photo_path'),
+                             extra=key == 'encodings' and student_id in stored)
+            except Exception as e:
+                # Left inline so a later start retries it
+                print(f"Skipping encoding of student {student_id}: {e}")
+                rejected.append((key, encoding))
+                continue
+            stored.add(student_id)
+            moved += 1
+        if queue and len(rejected) == len(queue):
+            continue
+        student.pop('encoding', None)
+        student.pop('encodings', None)
+        for key, encoding in rejected:
+            if key == 'encoding':
+                student['encoding'] = encoding
+            else:
+                student.setdefault('encodings', []).append(encoding)
+        changed = True
+    if not store.exists():
+        store.create()
+    if changed:
+        save_json(students_path, students)
+    return moved
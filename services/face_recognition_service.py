@@ -2,75 +2,153 @@ import face_recognition
 import cv2
 import numpy as np
 from config import Config
-from utils.helpers import load_json
+from services.gallery import LiveGallery
+from services.encoding_store import open_gallery_store
+from services.storage import get_storage
+from services.camera_sessions import CameraSessionStore
+from services.face_tracker import FaceTracker
+from services.detection_strategy import DetectionStage, DetectionStrategy
+from services import model_registry
 import os
 
 class FaceRecognitionService:
-    def __init__(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_student_ids = []
-        self.consecutive_frames = {}  # Track consecutive matches
-        self.attendance_cache = {}  # Cache to prevent multiple attendance marks
-        self.load_known_faces()
+    FRAME_SCALE = 4  # process_frame works on quarter-size frames
+
+    def __init__(self, preload=True):
+        """With ``preload=False`` the gallery is loaded on first use and the
+        models are not warmed up (a process that hands frames to recognition
+        workers only registers students and checks photos)."""
+        self.live_gallery = None
+        self.camera_sessions = CameraSessionStore()  # Per-camera face tracks
+        self.encoding_strategy = self._build_encoding_strategy()
+        if preload:
+            self.load_known_faces()
+            if getattr(Config, 'MODEL_WARM_UP', True):
+                self.warm_up()
     
     def load_known_faces(self):
-        """Load known face encodings from students.json"""
-        students = load_json(Config.STUDENTS_JSON)
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_student_ids = []
-        
-        for student in students:
-            self.known_face_encodings.append(np.array(student['encoding']))
-            self.known_face_names.append(student['name'])
-            self.known_student_ids.append(student['student_id'])
+        """Load known face encodings from the binary encoding store.
+
+        A legacy students.json with inline encodings is converted first. The
+        new gallery is built completely before it replaces the old one, and
+        is returned.
+        """
+        store, _ = open_gallery_store(get_storage().list_students())
+        self.live_gallery = LiveGallery.from_store(store)
+        return self.live_gallery
+
+    def _known_faces(self):
+        return self.live_gallery if self.live_gallery is not None else self.load_known_faces()
+
+    @property
+    def gallery(self):
+        """Current read-only gallery snapshot, including registrations made by
+        other workers; grab it once per frame"""
+        return self._known_faces().refresh()
     
-    def process_frame(self, frame):
-        """Process a video frame and return recognized faces"""
-        # Resize frame for faster face recognition
-        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-        
-        # Convert BGR to RGB
-        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-        
-        # Find faces in frame
-        face_locations = face_recognition.face_locations(rgb_small_frame)
-        face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-        
-        recognized_faces = []
-        
-        for face_encoding in face_encodings:
-            # Calculate face distances for all known faces
-            face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-            
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                best_match_distance = face_distances[best_match_index]
-                
-                if best_match_distance <= Config.FACE_RECOGNITION_TOLERANCE:
-                    name = self.known_face_names[best_match_index]
-                    student_id = self.known_student_ids[best_match_index]
-                    
-                    # Track consecutive matches
-                    match_key = f"{student_id}_{name}"
-                    self.consecutive_frames[match_key] = self.consecutive_frames.get(match_key, 0) + 1
-                    
-                    # Only recognize after MIN_CONSECUTIVE_FRAMES matches
-                    if self.consecutive_frames[match_key] >= Config.MIN_CONSECUTIVE_FRAMES:
-                        if Config.DEBUG_MODE:
-                            print(f"Recognized {name} (ID: {student_id}) with confidence: {1 - best_match_distance:.2f}")
-                        student_id = self.known_student_ids[best_match_index]
-                        attendance_marked = self.mark_attendance(student_id)
-                        
-                        recognized_faces.append({
-                            'name': self.known_face_names[best_match_index],
-                            'student_id': student_id,
-                            'distance': float(best_match_distance),
-                            'attendance_marked': attendance_marked
-                        })
-        
-        return recognized_faces
+    def process_frame(self, frame, camera_id=None, prescaled=False):
+        """Process a video frame and return recognized faces.
+
+        Faces are followed across the frames of each ``camera_id`` by a
+        ``FaceTracker``, so cameras do not confirm or reset each other's
+        detections. With ``prescaled`` the frame was already decoded at
+        1/FRAME_SCALE size and is used as is.
+        """
+        return self.process_frames([(camera_id, frame)], prescaled=prescaled)[0]
+
+    def process_frames(self, frames, prescaled=False):
+        """Recognize faces in several ``(camera_id, frame)`` pairs at once.
+
+        Faces are located frame by frame and associated with the camera's face
+        tracks. Descriptors are only computed for tracks that need them (new,
+        unconfirmed, due for re-encoding or changed in appearance); a stable,
+        confirmed track keeps its identity without an encoding or gallery
+        search. The new encodings of the batch are scored against the gallery
+        in one matrix product. A face is reported once its track carried the
+        same student for MIN_CONSECUTIVE_FRAMES frames, and a student only
+        once per frame. Returns one list of recognized faces per frame.
+        """
+        # A track must be assigned before the same camera's next frame moves it
+        cameras = [camera_id or 'default' for camera_id, _ in frames]
+        for i in range(1, len(cameras)):
+            if cameras[i] in cameras[:i]:
+                return self.process_frames(frames[:i], prescaled) + self.process_frames(frames[i:], prescaled)
+
+        prepared = []
+        for camera_id, frame in frames:
+            # Resize frame for faster face recognition
+            if prescaled:
+                small_frame = frame
+            else:
+                small_frame = cv2.resize(frame, (0, 0), fx=1.0 / self.FRAME_SCALE, fy=1.0 / self.FRAME_SCALE)
+
+            # Convert BGR to RGB
+            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+            gray = cv2.cvtColor(small_frame, cv2.COLOR_BGR2GRAY)
+
+            # Find faces in frame; face_recognition boxes are (top, right, bottom, left)
+            face_locations = face_recognition.face_locations(rgb_small_frame)
+            boxes = [(left, top, right, bottom) for (top, right, bottom, left) in face_locations]
+
+            session = self.camera_sessions.get(camera_id or 'default')
+            if session.tracker is None:
+                session.tracker = FaceTracker()
+            crops = [gray[max(top, 0):bottom, max(left, 0):right] for (left, top, right, bottom) in boxes]
+            tracked = session.tracker.update(boxes, [crop if crop.size else None for crop in crops])
+
+            # Only the faces whose tracks need a fresh descriptor are encoded
+            to_encode = [j for j, (_, needs_encoding) in enumerate(tracked) if needs_encoding]
+            encodings = face_recognition.face_encodings(
+                rgb_small_frame, [face_locations[j] for j in to_encode]) if to_encode else []
+            prepared.append((boxes, tracked, to_encode, encodings))
+
+        gallery = self.gallery
+        # Exact distances over the ANN shortlist (the whole gallery when small)
+        searches = iter(gallery.search_students_many([enc for *_, encodings in prepared for enc in encodings]))
+
+        results = []
+        min_frames = Config.MIN_CONSECUTIVE_FRAMES
+        scale = self.FRAME_SCALE
+        for boxes, tracked, to_encode, encodings in prepared:
+            for j, _ in zip(to_encode, encodings):
+                track = tracked[j][0]
+                rows, face_distances, _ = next(searches)
+                if len(face_distances) == 0 or float(face_distances.min()) > Config.FACE_RECOGNITION_TOLERANCE:
+                    track.assign(None)
+                    continue
+                best_match_index = int(rows[np.argmin(face_distances)])
+                track.assign({
+                    'student_id': gallery.student_ids[best_match_index],
+                    'name': gallery.names[best_match_index],
+                    'distance': float(face_distances.min()),
+                })
+            for track, needs_encoding in tracked:
+                if not needs_encoding:
+                    track.carry()
+
+            by_student = {}
+            for (left, top, right, bottom), (track, _) in zip(boxes, tracked):
+                # Only recognize after MIN_CONSECUTIVE_FRAMES frames on the same track
+                if not track.is_confirmed(min_frames):
+                    continue
+                identity = track.identity
+                student_id = identity['student_id']
+                area = (right - left) * (bottom - top)
+                if student_id in by_student and by_student[student_id][0] >= area:
+                    continue
+                if Config.DEBUG_MODE:
+                    print(f"Recognized {identity['name']} (ID: {student_id}) on track {track.track_id}")
+                # Attendance is recorded by the caller (AttendanceService.record_appearances)
+                by_student[student_id] = (area, {
+                    'name': identity['name'],
+                    'student_id': student_id,
+                    'distance': identity['distance'],
+                    'box': {'left': left * scale, 'top': top * scale, 'right': right * scale, 'bottom': bottom * scale},
+                    'track_id': track.track_id,
+                })
+            results.append([face for _, face in by_student.values()])
+
+        return results
 
     def get_face_encoding(self, cv_image):
         """Return a single face encoding for a given OpenCV BGR image or None.
@@ -90,81 +168,77 @@ class FaceRecognitionService:
                 scale = 1600.0 / max(h, w)
                 rgb = cv2.resize(rgb, (int(w * scale), int(h * scale)))
 
-            # Try several strategies to improve detection on difficult images.
-            # 1) Default HOG detector on the original image
-            locations = face_recognition.face_locations(rgb)
+            # Try the detection stages (HOG, CLAHE, upscales, CNN, Haar) until one
+            # finds a face; None if nothing was found
+            return self.encoding_strategy.run(rgb)
+        except Exception as e:
+            print('Error in get_face_encoding:', e)
+            return None
+    
+    def _build_encoding_strategy(self):
+        """Detection stages for get_face_encoding; any face found ends the search.
+
+        The cheap HOG variants are reordered by their success rate; CNN and the
+        Haar cascade stay last.
+        """
+        def first_encoding(rgb, **kwargs):
+            locations = face_recognition.face_locations(rgb, **kwargs)
             encodings = face_recognition.face_encodings(rgb, locations)
-            if encodings:
-                return encodings[0]
+            return (encodings[0], 1.0) if encodings else None
 
-            # 2) Try simple contrast-limited adaptive histogram equalization (CLAHE)
-            try:
-                ycrcb = cv2.cvtColor(rgb, cv2.COLOR_RGB2YCrCb)
-                y, cr, cb = cv2.split(ycrcb)
-                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-                y2 = clahe.apply(y)
-                ycrcb2 = cv2.merge((y2, cr, cb))
-                rgb_clahe = cv2.cvtColor(ycrcb2, cv2.COLOR_YCrCb2RGB)
-                locations = face_recognition.face_locations(rgb_clahe)
-                encodings = face_recognition.face_encodings(rgb_clahe, locations)
-                if encodings:
-                    return encodings[0]
-            except Exception:
-                # Non-fatal; continue to other fallbacks
-                pass
+        def clahe(rgb):
+            # Contrast-limited adaptive histogram equalization of the luma channel
+            ycrcb = cv2.cvtColor(rgb, cv2.COLOR_RGB2YCrCb)
+            y, cr, cb = cv2.split(ycrcb)
+            y2 = model_registry.clahe(2.0, (8, 8)).apply(y)
+            return first_encoding(cv2.cvtColor(cv2.merge((y2, cr, cb)), cv2.COLOR_YCrCb2RGB))
 
-            # 3) Try upscaling the image progressively (helps small or low-res faces)
-            try:
+        def upscale(scale):
+            # Helps small or low-res faces
+            def detect(rgb):
                 h, w = rgb.shape[:2]
-                for scale in (1.25, 1.5, 2.0):
-                    nh = int(h * scale)
-                    nw = int(w * scale)
-                    rgb_up = cv2.resize(rgb, (nw, nh), interpolation=cv2.INTER_LINEAR)
-                    locations = face_recognition.face_locations(rgb_up)
-                    encodings = face_recognition.face_encodings(rgb_up, locations)
-                    if encodings:
-                        # Convert coordinates back to original scale if needed by caller
-                        return encodings[0]
-            except Exception:
-                pass
+                return first_encoding(cv2.resize(rgb, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_LINEAR))
+            return detect
 
-            # 4) Try CNN model if dlib/face_recognition was built with it. This is
-            # slower but can detect faces missed by HOG. Wrapped in try/except
-            # because some installations may not include the CNN model files.
-            try:
-                locations = face_recognition.face_locations(rgb, model='cnn')
-                encodings = face_recognition.face_encodings(rgb, locations)
-                if encodings:
-                    return encodings[0]
-            except Exception:
-                pass
+        def haar(rgb):
+            # Take the first cascade box and compute an encoding on the crop
+            gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+            faces = model_registry.haar_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+            if len(faces) == 0:
+                return None
+            (x, y, w, h) = faces[0]
+            encs = face_recognition.face_encodings(rgb[y:y+h, x:x+w])
+            return (encs[0], 1.0) if encs else None
 
-            # 5) As a final fallback, try OpenCV's Haar cascade to get a bbox and
-            # compute an encoding from that region.
-            try:
-                cascade_path = os.path.join(Config.MODEL_DIR, 'haarcascade_frontalface_default.xml')
-                if os.path.exists(cascade_path):
-                    cascade = cv2.CascadeClassifier(cascade_path)
-                else:
-                    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-                gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
-                faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-                if len(faces) > 0:
-                    # Take first detected face region and compute encoding on the crop
-                    (x, y, w, h) = faces[0]
-                    crop = rgb[y:y+h, x:x+w]
-                    encs = face_recognition.face_encodings(crop)
-                    if encs:
-                        return encs[0]
-            except Exception:
-                pass
+        stages = [
+            DetectionStage('hog', first_encoding),
+            DetectionStage('clahe_hog', clahe),
+            DetectionStage('hog_x1.25', upscale(1.25)),
+            DetectionStage('hog_x1.5', upscale(1.5)),
+            DetectionStage('hog_x2', upscale(2.0)),
+            # Slower, and not available in every dlib build
+            DetectionStage('cnn', lambda rgb: first_encoding(rgb, model='cnn'), tier=1),
+            DetectionStage('haar', haar, tier=2),
+        ]
+        return DetectionStrategy(stages)
 
-            # Nothing found
-            return None
+    def detection_stats(self):
+        """Per-stage timing and hit counters of get_face_encoding"""
+        return self.encoding_strategy.stats()
+
+    def warm_up(self):
+        """Run one dummy inference through every model so the first real
+        request does not pay for lazy initialisation"""
+        try:
+            blank = np.zeros((120, 120, 3), dtype=np.uint8)
+            face_recognition.face_locations(blank)
+            face_recognition.face_encodings(blank, [(20, 100, 100, 20)])
+            model_registry.clahe(2.0, (8, 8)).apply(blank[:, :, 0])
+            model_registry.warm_up_cascade(model_registry.haar_cascade())
         except Exception as e:
-            print('Error in get_face_encoding:', e)
-            return None
-    
+            if Config.DEBUG_MODE:
+                print(f"Model warm-up failed: {e}")
+
     def register_new_student(self, student_id, name, image_path):
         """Register a new student with their face encoding"""
         try:
@@ -177,23 +251,18 @@ class FaceRecognitionService:
             if encoding is None:
                 raise ValueError("No face found in the image")
             
-            # Load existing students
-            students = load_json(Config.STUDENTS_JSON)
-            
-            # Add new student
+            # Add new student; a re-registration replaces the previous record
+            # (the encoding itself goes to the binary store)
             student_data = {
                 "student_id": student_id,
                 "name": name,
-                "encoding": encoding.tolist()
+                "photo_path": image_path
             }
             
-            students.append(student_data)
-            
-            # Save updated students list
-            from utils.helpers import save_json
-            if save_json(Config.STUDENTS_JSON, students):
-                # Update in-memory encodings
-                self.load_known_faces()
+            if get_storage().upsert_student(student_data):
+                # Update the in-memory gallery in place instead of reloading everything;
+                # another photo of the same student is kept as an extra embedding
+                self._known_faces().enroll(student_id, name, encoding, image_path)
                 return True
                 
             return False
@@ -201,75 +270,3 @@ class FaceRecognitionService:
         except Exception as e:
             print(f"Error registering student: {str(e)}")
             return False
-            
-    def mark_attendance(self, student_id):
-        """Mark attendance for a student"""
-        try:
-            from datetime import datetime
-            import json
-            import time
-            
-            # Check if attendance was already marked in the last hour
-            current_time = time.time()
-            if student_id in self.attendance_cache:
-                if current_time - self.attendance_cache[student_id] < 3600:  # 1 hour = 3600 seconds
-                    return False
-            
-            # Load current attendance
-            attendance_data = load_json(Config.ATTENDANCE_JSON)
-            
-            # Get today's date
-            today = datetime.now().strftime('%Y-%m-%d')
-            
-            # Create attendance entry
-            attendance_entry = {
-                'student_id': student_id,
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            
-            # Add today's attendance if not exists
-            if today not in attendance_data:
-                attendance_data[today] = []
-                
-            # Check if student already has an entry today
-            current_entry = None
-            for entry in attendance_data[today]:
-                if entry['student_id'] == student_id:
-                    current_entry = entry
-                    break
-
-            current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            if not current_entry:
-                # First entry of the day
-                attendance_entry = {
-                    'student_id': student_id,
-                    'first_timestamp': current_timestamp,
-                    'last_timestamp': current_timestamp,
-                    'work_hours': 0.0
-                }
-                attendance_data[today].append(attendance_entry)
-                updated = True
-            else:
-                # Update last timestamp and calculate work hours
-                from datetime import datetime
-                first_time = datetime.strptime(current_entry['first_timestamp'], '%Y-%m-%d %H:%M:%S')
-                current_time = datetime.strptime(current_timestamp, '%Y-%m-%d %H:%M:%S')
-                work_hours = (current_time - first_time).total_seconds() / 3600  # Convert to hours
-                
-                current_entry['last_timestamp'] = current_timestamp
-                current_entry['work_hours'] = round(work_hours, 2)
-                updated = True
-            
-            # Save attendance data
-            from utils.helpers import save_json
-            if updated and save_json(Config.ATTENDANCE_JSON, attendance_data):
-                # Update cache
-                self.attendance_cache[student_id] = time.time()
-                return True
-            
-            return False
-            
-        except Exception as e:
-            print(f"Error marking attendance: {str(e)}")
-            return False
\ No newline at end of file
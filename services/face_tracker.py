@@ -0,0 +1,154 @@
+import itertools
+
+import cv2
+import numpy as np
+
+from config import Config
+
+
+def box_iou(a, b):
+    """Intersection-over-union of two (left, top, right, bottom) boxes"""
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / float(union) if union > 0 else 0.0
+
+
+def appearance_thumb(face_crop, size=(16, 16)):
+    """Tiny grayscale thumbnail used to notice when a tracked face changes"""
+    if face_crop is None:
+        return None
+    return cv2.resize(face_crop, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+class Track:
+    """A face followed across frames of one camera.
+
+    The identity found by the last descriptor match is attached to the track
+    and reused on the following frames; ``streak`` counts the consecutive
+    frames the track has carried that identity.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, box):
+        self.track_id = next(Track._ids)
+        self.box = box
+        self.identity = None      # {'student_id', 'name', 'photo_path'} of the last match
+        self.high_conf = False
+        self.streak = 0
+        self.misses = 0
+        self.frames_since_encode = 0
+        self.thumb = None         # appearance when the descriptor was last computed
+        self.current_thumb = None
+
+    @property
+    def identity_key(self):
+        if self.identity is None:
+            return None
+        return f"{self.identity['student_id']}_{self.identity['name']}"
+
+    def is_confirmed(self, min_frames):
+        return self.identity is not None and (self.high_conf or self.streak >= min_frames)
+
+    def assign(self, identity, high_conf=False):
+        """Record the result of a fresh descriptor match for this frame"""
+        previous = self.identity_key
+        self.identity = identity
+        self.high_conf = bool(identity) and high_conf
+        if identity is None:
+            self.streak = 0
+        elif self.identity_key == previous:
+            self.streak += 1
+        else:
+            self.streak = 1
+        self.frames_since_encode = 0
+        self.thumb = self.current_thumb
+
+    def carry(self):
+        """Keep the current identity for a frame that was not re-encoded"""
+        if self.identity is not None:
+            self.streak += 1
+        self.frames_since_encode += 1
+
+
+class FaceTracker:
+    """Greedy IoU association of detected boxes to tracks for one camera.
+
+    ``update`` returns one track per box together with whether that face needs
+    a fresh descriptor. Confirmed tracks are only re-encoded every
+    ``reencode_interval`` frames or when their thumbnail drifts by more than
+    ``appearance_threshold`` (mean absolute gray-level difference); new,
+    unknown or not yet confirmed tracks are encoded on every frame.
+    """
+
+    def __init__(self, iou_threshold=None, reencode_interval=None, appearance_threshold=None, max_misses=None):
+        self.iou_threshold = iou_threshold if iou_threshold is not None else getattr(Config, 'FACE_TRACK_IOU_THRESHOLD', 0.3)
+        self.reencode_interval = reencode_interval if reencode_interval is not None else getattr(Config, 'FACE_TRACK_REENCODE_INTERVAL', 10)
+        self.appearance_threshold = appearance_threshold if appearance_threshold is not None else getattr(Config, 'FACE_TRACK_APPEARANCE_THRESHOLD', 12.0)
+        self.max_misses = max_misses if max_misses is not None else getattr(Config, 'FACE_TRACK_MAX_MISSES', 2)
+        self.tracks = []
+
+    def update(self, boxes, face_crops=None):
+        """Associate this frame's boxes with tracks.
+
+        Returns a list of ``(track, needs_encoding)`` aligned with ``boxes``.
+        Tracks that were not matched for more than ``max_misses`` frames are
+        dropped.
+        """
+        if face_crops is None:
+            face_crops = [None] * len(boxes)
+
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            for bi, box in enumerate(boxes):
+                overlap = box_iou(track.box, box)
+                if overlap >= self.iou_threshold:
+                    pairs.append((overlap, ti, bi))
+        pairs.sort(reverse=True)
+
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for _, ti, bi in pairs:
+            if ti in used_tracks or assigned[bi] is not None:
+                continue
+            used_tracks.add(ti)
+            assigned[bi] = self.tracks[ti]
+
+        survivors = []
+        for ti, track in enumerate(self.tracks):
+            if ti in used_tracks:
+                track.misses = 0
+                survivors.append(track)
+            else:
+                track.misses += 1
+                if track.misses <= self.max_misses:
+                    survivors.append(track)
+
+        results = []
+        min_frames = getattr(Config, 'MIN_CONSECUTIVE_FRAMES', 1)
+        for bi, box in enumerate(boxes):
+            track = assigned[bi]
+            if track is None:
+                track = Track(box)
+                survivors.append(track)
+            track.box = box
+            track.current_thumb = appearance_thumb(face_crops[bi])
+            results.append((track, self._needs_encoding(track, min_frames)))
+
+        self.tracks = survivors
+        return results
+
+    def _needs_encoding(self, track, min_frames):
+        if not track.is_confirmed(min_frames):
+            return True
+        if track.frames_since_encode + 1 >= self.reencode_interval:
+            return True
+        if track.thumb is not None and track.current_thumb is not None:
+            drift = float(np.mean(np.abs(track.current_thumb - track.thumb)))
+            if drift > self.appearance_threshold:
+                return True
+        return False
@@ -0,0 +1,353 @@
+"""Runs /api/process-frame recognition off the request thread.
+
+Frames are sharded by camera onto RECOGNITION_WORKERS single-process
+executors (at most 4 by default), so the CPU-bound detection and encoding of
+different cameras runs in parallel while each camera's tracks and
+consecutive-frame counters stay in one process. Every camera has a bounded queue: one frame in flight and at most
+FRAME_QUEUE_DEPTH waiting. When a newer frame arrives for a full queue the
+oldest waiting frame is dropped and its request returns straight away.
+Responses carry a ``queue_depth`` / ``retry_after_ms`` hint so clients back
+off under load instead of piling up requests. ``dispatch_batch`` handles the
+multi-camera /api/process-frames endpoint: it takes each camera's slot like a
+single frame, then each shard recognizes its share of the frames in one pass.
+"""
+import math
+import multiprocessing
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from config import Config
+
+_worker_service = None
+
+
+def _init_worker(service_cls):
+    global _worker_service
+    _worker_service = service_cls()
+
+
+_REDUCED_DECODE = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def decode_frame(frame_bytes, reduce=1):
+    """Decode an encoded image, downscaled by ``reduce`` (1, 2, 4 or 8) while decoding.
+
+    For JPEG the reduction happens inside the decoder (DCT scaling), so the
+    full-size image is never materialised. Returns None for undecodable data.
+    """
+    flag = _REDUCED_DECODE.get(reduce, cv2.IMREAD_COLOR)
+    return cv2.imdecode(np.frombuffer(frame_bytes, np.uint8), flag)
+
+
+def recognize(service, camera_id, frame_bytes):
+    """Decode an encoded image and run ``service.process_frame`` on it.
+
+    Services that declare a ``FRAME_SCALE`` get the frame already decoded at
+    that reduction. Returns None if the bytes are not a decodable image.
+    """
+    scale = getattr(service, 'FRAME_SCALE', 1)
+    frame = decode_frame(frame_bytes, scale)
+    if frame is None:
+        return None
+    if scale > 1:
+        return service.process_frame(frame, camera_id=camera_id, prescaled=True)
+    return service.process_frame(frame, camera_id=camera_id)
+
+
+def prescale(service, frame):
+    """Shrink an already decoded BGR frame to the size ``service.process_frame`` works on"""
+    scale = getattr(service, 'FRAME_SCALE', 1)
+    if scale <= 1:
+        return frame
+    height, width = frame.shape[:2]
+    return cv2.resize(frame, (width // scale, height // scale), interpolation=cv2.INTER_AREA)
+
+
+def recognize_prescaled(service, camera_id, frame):
+    """Run ``service.process_frame`` on a frame already passed through ``prescale``"""
+    if getattr(service, 'FRAME_SCALE', 1) > 1:
+        return service.process_frame(frame, camera_id=camera_id, prescaled=True)
+    return service.process_frame(frame, camera_id=camera_id)
+
+
+def recognize_batch(service, frames):
+    """Decode ``[(camera_id, frame_bytes), ...]`` and recognize them together.
+
+    Services with ``process_frames`` get every decodable frame in one call, so
+    descriptors and the gallery search are batched across frames. Returns one
+    entry per input frame: its recognized faces, or None if it did not decode.
+    """
+    if not hasattr(service, 'process_frames'):
+        return [recognize(service, camera_id, frame_bytes) for camera_id, frame_bytes in frames]
+    scale = getattr(service, 'FRAME_SCALE', 1)
+    decoded = [(i, camera_id, decode_frame(frame_bytes, scale)) for i, (camera_id, frame_bytes) in enumerate(frames)]
+    decoded = [item for item in decoded if item[2] is not None]
+    results = [None] * len(frames)
+    batch = [(camera_id, frame) for _, camera_id, frame in decoded]
+    for (i, _, _), faces in zip(decoded, service.process_frames(batch, prescaled=scale > 1)):
+        results[i] = faces
+    return results
+
+
+def _worker_recognize(camera_id, frame_bytes):
+    return recognize(_worker_service, camera_id, frame_bytes)
+
+
+def _worker_recognize_prescaled(camera_id, frame):
+    return recognize_prescaled(_worker_service, camera_id, frame)
+
+
+def _worker_recognize_batch(frames):
+    return recognize_batch(_worker_service, frames)
+
+
+class FrameDropped(Exception):
+    """The frame was not processed (superseded by a newer one, or timed out)"""
+
+    def __init__(self, reason, load):
+        super().__init__(f"frame dropped: {reason}")
+        self.reason = reason
+        self.load = load
+
+
+class _Waiter:
+    def __init__(self, frames=1, droppable=True):
+        self.event = threading.Event()
+        self.state = 'waiting'  # -> 'run' or 'dropped'
+        self.frames = frames
+        self.droppable = droppable  # batch frames are never superseded
+
+
+class _CameraQueue:
+    def __init__(self, shard):
+        self.shard = shard
+        self.in_flight = False
+        self.waiting = deque()
+
+
+class FrameDispatcher:
+    """Per-camera latest-wins queues in front of a sharded process pool.
+
+    With ``workers=0`` frames are processed in the request thread by
+    ``service`` (same queueing, no extra processes).
+    """
+
+    def __init__(self, service, workers=None, queue_depth=None, timeout=None, start_method=None):
+        self.service = service
+        self.workers = workers if workers is not None else getattr(Config, 'RECOGNITION_WORKERS', 0)
+        self.queue_depth = queue_depth if queue_depth is not None else getattr(Config, 'FRAME_QUEUE_DEPTH', 1)
+        self.timeout = timeout if timeout is not None else getattr(Config, 'RECOGNITION_TIMEOUT_S', 10)
+        self.start_method = start_method or getattr(Config, 'RECOGNITION_START_METHOD', None)
+        shards = max(1, self.workers)
+        self._executors = [None] * shards
+        self._load = [0] * shards         # frames in flight or waiting, per shard
+        self._frame_ms = [0.0] * shards   # moving average of processing time, per shard
+        self._cameras = {}
+        self._lock = threading.Lock()
+
+    def dispatch(self, camera_id, frame_bytes):
+        """Process one frame for ``camera_id``.
+
+        Returns ``(recognized_faces, load)`` where ``load`` is the back-off hint
+        ``{'queue_depth', 'retry_after_ms'}``; ``recognized_faces`` is None if
+        the frame could not be decoded. Raises ``FrameDropped`` if a newer
+        frame from the same camera replaced this one while it waited.
+        """
+        return self._dispatch(camera_id, recognize, _worker_recognize, frame_bytes)
+
+    def dispatch_frame(self, camera_id, frame):
+        """``dispatch`` for an already decoded BGR frame (server-side video sources).
+
+        The frame is shrunk to the service's working size here, so only the
+        small frame is sent to the worker process.
+        """
+        return self._dispatch(camera_id, recognize_prescaled, _worker_recognize_prescaled,
+                              prescale(self.service, frame))
+
+    def _dispatch(self, camera_id, inline_task, worker_task, payload):
+        queue = self._enter(camera_id)
+        start = time.monotonic()
+        try:
+            faces = self._run(queue.shard, camera_id, inline_task, worker_task, payload)
+        finally:
+            self._record_time(queue.shard, (time.monotonic() - start) * 1000.0)
+            self._leave(camera_id, queue)
+        return faces, self.load_hint(camera_id)
+
+    def _enter(self, camera_id, frames=1, droppable=True):
+        """Take ``camera_id``'s slot, waiting behind the frame in flight; returns the camera's queue.
+
+        Raises ``FrameDropped`` if a newer frame superseded this one (only when
+        ``droppable``) or the slot did not free up within the timeout.
+        """
+        waiter = None
+        with self._lock:
+            queue = self._cameras.get(camera_id)
+            if queue is None:
+                queue = self._cameras[camera_id] = _CameraQueue(self._shard(camera_id))
+            self._load[queue.shard] += frames
+            if queue.in_flight:
+                waiter = _Waiter(frames, droppable)
+                queue.waiting.append(waiter)
+                stale = [w for w in queue.waiting if w.droppable]
+                for old in stale[:max(0, len(stale) - self.queue_depth)]:
+                    queue.waiting.remove(old)
+                    old.state = 'dropped'
+                    self._load[queue.shard] -= old.frames
+                    old.event.set()
+            else:
+                queue.in_flight = True
+
+        if waiter is not None:
+            waiter.event.wait(self.timeout)
+            with self._lock:
+                if waiter.state == 'waiting':
+                    # Gave up waiting for the frame ahead of us
+                    queue.waiting.remove(waiter)
+                    self._load[queue.shard] -= frames
+                    waiter.state = 'dropped'
+                    reason = 'timeout'
+                else:
+                    reason = 'superseded'
+            if waiter.state == 'dropped':
+                raise FrameDropped(reason, self.load_hint(camera_id))
+        return queue
+
+    def _leave(self, camera_id, queue, frames=1):
+        """Release ``camera_id``'s slot to the next waiting frame"""
+        with self._lock:
+            self._load[queue.shard] -= frames
+            if queue.waiting:
+                successor = queue.waiting.popleft()
+                successor.state = 'run'
+                successor.event.set()
+            else:
+                queue.in_flight = False
+                del self._cameras[camera_id]
+
+    def _record_time(self, shard, frame_ms):
+        with self._lock:
+            previous = self._frame_ms[shard]
+            self._frame_ms[shard] = frame_ms if previous == 0 else 0.8 * previous + 0.2 * frame_ms
+
+    def dispatch_batch(self, frames):
+        """Process ``[(camera_id, frame_bytes), ...]`` in one pass per shard.
+
+        Frames are grouped by their camera's shard and each group is recognized
+        as one batch (``recognize_batch``); the groups run in parallel. The batch
+        first takes the slot of every camera in it, so a camera is never
+        recognized twice at once, but its frames are never dropped for newer
+        ones. Returns ``(results, load)`` with one entry per frame (None if it
+        could not be decoded) and the back-off hint of the busiest shard
+        involved. Raises ``FrameDropped`` if a camera's slot or a shard does
+        not free up within the timeout.
+        """
+        cameras = {}
+        groups = {}
+        for i, (camera_id, frame_bytes) in enumerate(frames):
+            cameras.setdefault(camera_id, []).append(i)
+            groups.setdefault(self._shard(camera_id), []).append(i)
+
+        results = [None] * len(frames)
+        entered = []
+        try:
+            # Always in the same order, so two batches cannot wait on each other
+            for camera_id in sorted(cameras, key=str):
+                entered.append((camera_id, self._enter(camera_id, len(cameras[camera_id]), droppable=False)))
+            start = time.monotonic()
+            try:
+                if self.workers <= 0:
+                    pending = {shard: recognize_batch(self.service, [frames[i] for i in positions])
+                               for shard, positions in groups.items()}
+                else:
+                    pending = {shard: self._executor(shard).submit(_worker_recognize_batch,
+                                                                   [frames[i] for i in positions])
+                               for shard, positions in groups.items()}
+                for shard, positions in groups.items():
+                    outcome = pending[shard]
+                    if self.workers > 0:
+                        outcome = self._result(shard, outcome, self._shard_hint(shard))
+                    for i, faces in zip(positions, outcome):
+                        results[i] = faces
+            finally:
+                elapsed_ms = (time.monotonic() - start) * 1000.0
+                for shard, positions in groups.items():
+                    # Per-frame cost, so retry hints stay comparable with single frames
+                    self._record_time(shard, elapsed_ms / len(positions))
+        finally:
+            for camera_id, queue in entered:
+                self._leave(camera_id, queue, len(cameras[camera_id]))
+        hints = [self._shard_hint(shard) for shard in groups] or [{'queue_depth': 0, 'retry_after_ms': 0}]
+        return results, max(hints, key=lambda hint: hint['retry_after_ms'])
+
+    def load_hint(self, camera_id):
+        """Frames queued on ``camera_id``'s shard and how long a client should wait"""
+        return self._shard_hint(self._shard(camera_id))
+
+    def _shard_hint(self, shard):
+        with self._lock:
+            depth = self._load[shard]
+            frame_ms = self._frame_ms[shard]
+        return {'queue_depth': depth, 'retry_after_ms': int(math.ceil(frame_ms * depth))}
+
+    def _shard(self, camera_id):
+        # crc32 rather than hash(): stable across restarts and processes
+        return zlib.crc32(str(camera_id).encode('utf-8')) % len(self._executors)
+
+    def _run(self, shard, camera_id, inline_task, worker_task, payload):
+        if self.workers <= 0:
+            return inline_task(self.service, camera_id, payload)
+        future = self._executor(shard).submit(worker_task, camera_id, payload)
+        return self._result(shard, future, self.load_hint(camera_id))
+
+    def _result(self, shard, future, load):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise FrameDropped('timeout', load)
+        except BrokenProcessPool:
+            # The worker died (e.g. out of memory); start a fresh one next time
+            with self._lock:
+                self._executors[shard] = None
+            raise
+
+    def _executor(self, shard):
+        executor = self._executors[shard]
+        if executor is None:
+            with self._lock:
+                executor = self._executors[shard]
+                if executor is None:
+                    # Created lazily, so it belongs to the process serving requests
+                    # (not the gunicorn master when the app is preloaded)
+                    executor = ProcessPoolExecutor(
+                        max_workers=1, mp_context=self._context(),
+                        initializer=_init_worker, initargs=(type(self.service),),
+                    )
+                    self._executors[shard] = executor
+        return executor
+
+    def _context(self):
+        method = self.start_method
+        if not method:
+            # Forking a threaded server process is unsafe; forkserver forks from a clean process
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        return multiprocessing.get_context(method)
+
+    def close(self):
+        with self._lock:
+            executors, self._executors = self._executors, [None] * len(self._executors)
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=False)
@@ -0,0 +1,71 @@
+"""Streaming recognition over a WebSocket (``/ws/process-frame`` in app.py).
+
+Protocol, one connection per camera:
+
+- client -> server: binary messages are encoded frames (JPEG); a text message
+  is JSON control, currently only ``{"camera_id": "..."}``.
+- server -> client: one JSON text message per processed frame,
+  ``{"type": "recognition", "success", "recognized_faces", "queue_depth",
+  "retry_after_ms", "skipped"}``.
+
+The server works through the frames at its own pace: when several frames
+have arrived while one was being recognized, only the newest is processed
+and ``skipped`` counts the others.
+"""
+import json
+
+from services.frame_dispatcher import FrameDropped
+
+
+def _latest_message(ws, message):
+    """Drain messages already buffered on ``ws``; return the newest frame and the number skipped.
+
+    Control messages are returned as soon as they are met so they are never lost.
+    """
+    skipped = 0
+    while isinstance(message, (bytes, bytearray)):
+        newer = ws.receive(timeout=0)
+        if newer is None:
+            break
+        if not isinstance(newer, (bytes, bytearray)):
+            # Process the frame we have first; the control message comes next time
+            return message, skipped, newer
+        message = newer
+        skipped += 1
+    return message, skipped, None
+
+
+def stream_frames(ws, camera_id, dispatch, enrich=None):
+    """Serve one connection until the client closes it.
+
+    ``dispatch(camera_id, frame_bytes)`` is ``FrameDispatcher.dispatch``;
+    ``enrich(recognized_faces)`` adds attendance details before sending.
+    """
+    pending = None
+    while True:
+        if pending is not None:
+            message, pending = pending, None
+        else:
+            message = ws.receive()
+        if message is None:
+            return
+        if not isinstance(message, (bytes, bytearray)):
+            try:
+                control = json.loads(message)
+                camera_id = control.get('camera_id') or camera_id
+            except (ValueError, AttributeError):
+                ws.send(json.dumps({'type': 'error', 'error': 'Expected a binary frame or a JSON control message'}))
+            continue
+
+        frame_bytes, skipped, pending = _latest_message(ws, message)
+        reply = {'type': 'recognition', 'skipped': skipped}
+        try:
+            faces, load = dispatch(camera_id, bytes(frame_bytes))
+        except FrameDropped as fd:
+            reply.update(success=False, dropped=True, error=str(fd), recognized_faces=[], **fd.load)
+        else:
+            if faces is None:
+                reply.update(success=False, error='Could not decode frame', recognized_faces=[], **load)
+            else:
+                reply.update(success=True, recognized_faces=enrich(faces) if enrich else faces, **load)
+        ws.send(json.dumps(reply))
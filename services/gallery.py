@@ -0,0 +1,626 @@
+import threading
+from collections.abc import Sequence
+
+import numpy as np
+from config import Config
+
+
+def top_k(values, k, largest=False):
+    """Return the indices of the k smallest (or largest) values, best first.
+
+    Uses a partial selection (argpartition) instead of a full sort. Ties are
+    broken by index so the result matches a stable ``sorted`` over the list.
+    """
+    values = np.asarray(values)
+    n = values.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.intp)
+    keys = -values if largest else values
+    k = min(k, n)
+    if k < n:
+        idx = np.argpartition(keys, k - 1)[:k]
+        # Pull in any ties with the k-th value so the index tie-break is exact
+        kth = keys[idx].max()
+        idx = np.flatnonzero(keys <= kth)
+    else:
+        idx = np.arange(n)
+    order = np.lexsort((idx, keys[idx]))
+    return idx[order][:k]
+
+
+class FaceGallery:
+    """Known face encodings kept as one contiguous float32 matrix.
+
+    Row norms are precomputed at build time (or passed in) so a probe can be scored against
+    the whole gallery with a single matrix-vector product. Each row may carry
+    the student's id, name and photo path. A gallery handed out by
+    ``LiveGallery.current`` is a read-only snapshot: rows marked dead in
+    ``alive`` are never returned by ``search``. Rows sharing a ``labels``
+    value belong to the same student.
+    """
+
+    def __init__(self, matrix=None, sq_norms=None, alive=None, student_ids=None, names=None, photos=None, index=None,
+                 labels=None, norms=None):
+        if matrix is None:
+            matrix = np.empty((0, 0), dtype=np.float32)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self.sq_norms = sq_norms
+        self.norms = norms if norms is not None else np.sqrt(self.sq_norms)
+        self.alive = alive
+        self.student_ids = student_ids if student_ids is not None else []
+        self.names = names if names is not None else []
+        self.photos = photos if photos is not None else []
+        self.index = index
+        self.labels = labels
+
+    @classmethod
+    def from_encodings(cls, encodings):
+        """Build a gallery from a list of encodings.
+
+        Returns ``(gallery, kept)`` where ``kept`` lists the positions of the
+        encodings that made it into the matrix; malformed entries (wrong
+        length, non-numeric) are skipped.
+        """
+        rows = []
+        kept = []
+        dim = None
+        for i, enc in enumerate(encodings):
+            row = _as_row(enc, dim)
+            if row is None:
+                continue
+            dim = row.shape[0]
+            rows.append(row)
+            kept.append(i)
+        if not rows:
+            return cls(), kept
+        return cls(np.vstack(rows)), kept
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def build_index(self, kind=None, **params):
+        """Attach an ANN index (see ``services.ann_index.build_index``).
+
+        Unspecified settings are read from the ``ANN_*`` values in Config.
+        """
+        self.index = _build_configured_index(self.matrix, kind, **params)
+        return self.index
+
+    def search(self, probe):
+        """Score ``probe`` against the index shortlist with exact metrics.
+
+        Returns ``(rows, distances, cosines)``; without an index the shortlist
+        is every row of the gallery. Rows appended after the index was built
+        are always scanned, and dead rows are filtered out.
+        """
+        if self.index is None or self.index.kind == 'brute' or len(self) == 0:
+            # Full scan: score the contiguous matrix directly, no gather copy
+            distances, cosines = self.score(probe)
+            rows = np.arange(distances.shape[0])
+        else:
+            rows = self.index.search(probe)
+            if self.index.size < len(self):
+                rows = np.concatenate([rows, np.arange(self.index.size, len(self))])
+            distances, cosines = self.score(probe, rows)
+        if self.alive is not None and rows.size:
+            keep = self.alive[rows]
+            if not keep.all():
+                rows, distances, cosines = rows[keep], distances[keep], cosines[keep]
+        return rows, distances, cosines
+
+    def search_students(self, probe):
+        """Like ``search`` but with one entry per student.
+
+        A student's distance is the minimum over their embeddings and their
+        cosine the maximum; the returned row is their closest embedding. The
+        grouping is a single lexsort over the shortlist.
+        """
+        return self._per_student(*self.search(probe))
+
+    def search_students_many(self, probes):
+        """``search_students`` for several probes at once; returns one
+        ``(rows, distances, cosines)`` tuple per probe.
+
+        Without an ANN index all probes are scored with a single
+        matrix-matrix product; with one, each probe is searched on its own
+        shortlist.
+        """
+        probes = np.asarray(probes, dtype=np.float32)
+        if probes.ndim != 2 or probes.shape[0] == 0:
+            return []
+        if self.index is not None and self.index.kind != 'brute' and len(self):
+            return [self.search_students(probe) for probe in probes]
+        distances, cosines = self.score_many(probes)
+        rows = np.arange(distances.shape[1])
+        if self.alive is not None and rows.size:
+            keep = self.alive
+            if not keep.all():
+                rows, distances, cosines = rows[keep], distances[:, keep], cosines[:, keep]
+        return [self._per_student(rows, d, c) for d, c in zip(distances, cosines)]
+
+    def _per_student(self, rows, distances, cosines):
+        if self.labels is None or rows.size < 2:
+            return rows, distances, cosines
+        labels = self.labels[rows]
+        order = np.lexsort((rows, distances, labels))
+        sorted_labels = labels[order]
+        first = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+        if first.size == rows.size:
+            return rows, distances, cosines
+        best = order[first]
+        return rows[best], distances[best], np.maximum.reduceat(cosines[order], first)
+
+    def score(self, probe, rows=None):
+        """Return ``(distances, cosines)`` of ``probe`` against every row
+        (or only against ``rows`` when given).
+
+        Both come from one ``matrix @ probe`` product: the euclidean distance
+        is expanded as ``|a|^2 + |b|^2 - 2ab`` and the cosine reuses the same
+        dot products with the precomputed norms.
+        """
+        probe = np.asarray(probe, dtype=np.float32).reshape(-1)
+        if len(self) == 0 or probe.shape[0] != self.dim:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+        matrix, sq_norms, norms = self.matrix, self.sq_norms, self.norms
+        if rows is not None:
+            matrix, sq_norms, norms = matrix[rows], sq_norms[rows], norms[rows]
+        dots = matrix @ probe
+        probe_sq = float(probe @ probe)
+        sq = sq_norms + probe_sq - 2.0 * dots
+        np.maximum(sq, 0.0, out=sq)
+        distances = np.sqrt(sq)
+        cosines = dots / (norms * np.sqrt(probe_sq) + 1e-9)
+        return distances, cosines
+
+    def score_many(self, probes):
+        """Return ``(distances, cosines)`` of shape (probes, rows) from one
+        ``probes @ matrix.T`` product"""
+        probes = np.asarray(probes, dtype=np.float32)
+        if len(self) == 0 or probes.ndim != 2 or probes.shape[1] != self.dim:
+            empty = np.empty((probes.shape[0] if probes.ndim == 2 else 0, 0), dtype=np.float32)
+            return empty, empty.copy()
+        dots = probes @ self.matrix.T
+        probe_sq = np.einsum('ij,ij->i', probes, probes)
+        sq = self.sq_norms[None, :] + probe_sq[:, None] - 2.0 * dots
+        np.maximum(sq, 0.0, out=sq)
+        distances = np.sqrt(sq)
+        cosines = dots / (self.norms[None, :] * np.sqrt(probe_sq)[:, None] + 1e-9)
+        return distances, cosines
+
+
+def _as_row(encoding, dim=None):
+    """Return ``encoding`` as a flat float32 row, or None if it is malformed"""
+    try:
+        row = np.asarray(encoding, dtype=np.float32).reshape(-1)
+    except Exception:
+        return None
+    if row.size == 0 or (dim is not None and row.shape[0] != dim) or not np.all(np.isfinite(row)):
+        return None
+    return row
+
+
+def _build_configured_index(matrix, kind=None, **params):
+    from services.ann_index import build_index
+    if kind is None:
+        kind = getattr(Config, 'ANN_INDEX', 'auto')
+    params.setdefault('min_size', getattr(Config, 'ANN_MIN_GALLERY_SIZE', 5000))
+    params.setdefault('nlist', getattr(Config, 'ANN_NLIST', 0))
+    params.setdefault('nprobe', getattr(Config, 'ANN_NPROBE', 8))
+    return build_index(matrix, kind=kind, **params)
+
+
+class _Column(Sequence):
+    """Read-only view of the first ``n`` entries of one of LiveGallery's row lists.
+
+    The lists only grow at the end; an entry a published view can see is
+    never changed in place (LiveGallery copies the lists first), so a
+    snapshot's ids, names and photos stay fixed without copying on publish.
+    """
+
+    __slots__ = ('_items', '_n')
+
+    def __init__(self, items, n):
+        self._items = items
+        self._n = n
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._items[:self._n][i]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError('gallery row out of range')
+        return self._items[i]
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, _Column)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class LiveGallery:
+    """Mutable gallery with O(1) add, update and remove of a single student.
+
+    Rows live in capacity-doubling buffers. Appending writes past the end of
+    every published snapshot, and removal only flips the row's ``alive`` flag,
+    so a new ``FaceGallery`` snapshot is published by a single reference
+    assignment and concurrent readers never see a half-built state. Updates
+    append the new row before retiring the old one. Snapshots share the
+    buffers and row lists up to their own length, so publishing costs O(1).
+    Dead rows are compacted
+    away once they make up half the buffer, and the ANN index is rebuilt when
+    the rows it does not cover grow past ANN_REBUILD_FRACTION of it.
+
+    A student may own several rows (one per enrollment photo, at most
+    MAX_EMBEDDINGS_PER_STUDENT); every row carries the student's label so
+    ``FaceGallery.search_students`` can aggregate them.
+
+    A gallery built with ``from_store`` maps its rows straight from an
+    ``EncodingStore`` memmap instead; writes go to the store first and the
+    gallery then replays the store's new rows and index events. ``refresh``
+    does the same for writes made by other processes sharing the store.
+    """
+
+    def __init__(self, dim=128, capacity=1024):
+        self._lock = threading.Lock()
+        self._store = None
+        self._photo_lookup = None
+        self._index_offset = 0
+        self._generation = None
+        self._reset(dim, capacity)
+        self.current = FaceGallery(np.empty((0, dim), dtype=np.float32))
+
+    def _reset(self, dim, capacity):
+        self.dim = dim
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.zeros(capacity, dtype=np.float32)
+        self._norms = np.zeros(capacity, dtype=np.float32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._labels = np.zeros(capacity, dtype=np.int32)
+        self._student_ids = []
+        self._names = []
+        self._photos = []
+        self._shared = 0   # rows of the lists visible to published snapshots
+        self._rows = {}    # student_id -> live rows, oldest first
+        self._label_of = {}  # student_id -> label shared by all of the student's rows
+        self._size = 0
+        self._dead = 0
+        self._index = None
+
+    @classmethod
+    def from_students(cls, students, photo_lookup=None):
+        """Build a gallery from student records (``encoding`` key, plus any
+        additional embeddings under ``encodings``).
+
+        ``photo_lookup(student_id)`` supplies a photo path for records without
+        ``photo_path``. Malformed encodings are skipped; if a student_id occurs
+        more than once the last record wins.
+        """
+        gallery = cls()
+        for student in students:
+            student_id, name = student.get('student_id'), student.get('name')
+            photo = student.get('photo_path')
+            if not photo and photo_lookup is not None:
+                photo = photo_lookup(student_id)
+            gallery.upsert(student_id, name, student.get('encoding'), photo, publish=False)
+            for encoding in student.get('encodings') or []:
+                gallery.add_embedding(student_id, name, encoding, photo, publish=False)
+        with gallery._lock:
+            gallery._rebuild_index()
+            gallery._publish()
+        return gallery
+
+    @classmethod
+    def from_store(cls, store, photo_lookup=None):
+        """Build a gallery backed by an ``EncodingStore`` (zero-copy rows).
+
+        ``photo_lookup(student_id)`` supplies the photo path of rows whose
+        index entry has none.
+        """
+        gallery = cls()
+        gallery._store = store
+        gallery._photo_lookup = photo_lookup
+        with gallery._lock:
+            gallery._generation = store.generation()
+            retired = gallery._sync_store()
+            gallery._retire(retired)
+            gallery._rebuild_index()
+            gallery._publish()
+        return gallery
+
+    def refresh(self):
+        """Return the current snapshot, first picking up writes from other processes.
+
+        When the store's generation is unchanged this is a single read of the
+        shared counter. A new compaction epoch means row numbers changed, so
+        the store is remapped from scratch.
+        """
+        if self._store is None or self._store.generation() == self._generation:
+            return self.current
+        with self._lock:
+            self._catch_up()
+            return self.current
+
+    def _catch_up(self):
+        # Caller holds the lock and the gallery is store-backed
+        generation = self._store.generation()
+        if generation == self._generation:
+            return
+        if self._generation is None or generation[1] != self._generation[1]:
+            self._reset(self.dim, 1024)
+            self._index_offset = 0
+            retired = self._sync_store()
+            self._rebuild_index()
+        else:
+            retired = self._sync_store()
+            self._maybe_rebuild_index()
+        self._generation = generation
+        self._publish()
+        self._retire(retired)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, student_id):
+        return student_id in self._rows
+
+    def embedding_count(self, student_id):
+        return len(self._rows.get(student_id, ()))
+
+    def upsert(self, student_id, name, encoding, photo_path=None, publish=True):
+        """Add a student, or replace all of their embeddings with ``encoding``.
+
+        Returns False (and changes nothing) if the encoding is malformed.
+        """
+        return self._add(student_id, name, encoding, photo_path, publish, replace=True)
+
+    def add_embedding(self, student_id, name, encoding, photo_path=None, publish=True):
+        """Add another embedding for a student, keeping their existing ones.
+
+        Once a student has MAX_EMBEDDINGS_PER_STUDENT rows the oldest is retired.
+        """
+        return self._add(student_id, name, encoding, photo_path, publish, replace=False)
+
+    def enroll(self, student_id, name, encoding, photo_path=None):
+        """Register an encoding from a new photo.
+
+        A photo of an already known student with the same name becomes an
+        additional embedding; a new student, a changed name, or
+        MAX_EMBEDDINGS_PER_STUDENT = 1 replaces whatever was stored before.
+        """
+        return self._add(student_id, name, encoding, photo_path, True, replace=None)
+
+    def _add(self, student_id, name, encoding, photo_path, publish, replace):
+        # replace=None is enroll: decided here, under the lock and after catching up
+        with self._lock:
+            row = _as_row(encoding, self.dim if self._size else None)
+            if row is None:
+                return False
+
+            if self._store is not None:
+                self._catch_up()
+            if replace is None:
+                rows = self._rows.get(student_id)
+                replace = not (rows and _max_embeddings() > 1 and self._names[rows[-1]] == name)
+
+            if self._store is not None:
+                self._store.append(student_id, name, row, photo_path, extra=not replace)
+                if not replace:
+                    rows = self._rows.get(student_id, [])
+                    for old in rows[:max(0, len(rows) + 1 - _max_embeddings())]:
+                        self._store.delete(old)
+                retired = self._sync_store()
+                if publish:
+                    self._maybe_rebuild_index()
+                    self._publish()
+                self._retire(retired)
+                return True
+
+            if self._size == 0 and row.shape[0] != self.dim:
+                self._reset(row.shape[0], self._matrix.shape[0])
+
+            self._ensure_capacity(self._size + 1)
+            new = self._size
+            self._matrix[new] = row
+            self._sq_norms[new] = float(row @ row)
+            self._norms[new] = np.sqrt(self._sq_norms[new])
+            self._alive[new] = True
+            self._labels[new] = self._label(student_id)
+            self._student_ids.append(student_id)
+            self._names.append(name)
+            self._photos.append(photo_path)
+            self._size += 1
+
+            rows = self._rows.get(student_id, [])
+            if replace:
+                retired, rows = rows, [new]
+            else:
+                rows = rows + [new]
+                retired, rows = rows[:-_max_embeddings()], rows[-_max_embeddings():]
+            self._rows[student_id] = rows
+            if publish:
+                self._maybe_rebuild_index()
+                self._publish()
+            if retired:
+                self._retire(retired)
+                self._maybe_compact(publish)
+            return True
+
+    def remove(self, student_id):
+        """Remove a student; returns False if they were not in the gallery"""
+        with self._lock:
+            if self._store is not None:
+                self._catch_up()  # row numbers may have changed under a compaction
+            rows = self._rows.pop(student_id, None)
+            if rows is None:
+                return False
+            if self._store is not None:
+                for row in rows:
+                    self._store.delete(row)
+                self._retire(self._sync_store() + rows)
+                return True
+            self._retire(rows)
+            self._maybe_compact(True)
+            return True
+
+    def _label(self, student_id):
+        return self._label_of.setdefault(student_id, len(self._label_of))
+
+    def _retire(self, rows):
+        # Flipping a flag is the only in-place change published snapshots can observe
+        for row in rows:
+            if self._alive[row]:
+                self._alive[row] = False
+                self._dead += 1
+
+    def _sync_store(self):
+        """Pick up rows and index events written to the store since the last sync.
+
+        New rows are mapped and activated; the rows they supersede (or that
+        were deleted) are returned so the caller can retire them after
+        publishing, keeping every student visible throughout.
+        """
+        if not self._store.exists():
+            return []
+        events, self._index_offset = self._store.read_index(self._index_offset)
+        n = self._store.row_count()
+        if n > self._size:
+            self.dim = self._store.dim
+            self._ensure_capacity(n)
+            self._matrix = self._store.open_matrix(n)
+            new = np.asarray(self._matrix[self._size:n], dtype=np.float32)
+            self._sq_norms[self._size:n] = np.einsum('ij,ij->i', new, new)
+            self._norms[self._size:n] = np.sqrt(self._sq_norms[self._size:n])
+            pad = n - self._size
+            self._student_ids.extend([None] * pad)
+            self._names.extend([None] * pad)
+            self._photos.extend([None] * pad)
+            self._size = n
+
+        retired = []
+        for event in events:
+            row = event[1]
+            if row >= self._size:
+                continue
+            if event[0] == 'add':
+                student_id, name, photo, extra = event[2:]
+                rows = self._rows.get(student_id, [])
+                if not extra:
+                    retired.extend(r for r in rows if r != row)
+                    rows = []
+                if row not in rows:
+                    rows = rows + [row]
+                self._rows[student_id] = rows
+                if row < self._shared:
+                    self._unshare()
+                self._student_ids[row] = student_id
+                self._names[row] = name
+                if not photo and self._photo_lookup is not None:
+                    photo = self._photo_lookup(student_id)
+                self._photos[row] = photo
+                self._labels[row] = self._label(student_id)
+                self._alive[row] = True
+            else:
+                student_id = self._student_ids[row]
+                rows = self._rows.get(student_id)
+                if rows and row in rows:
+                    rows = [r for r in rows if r != row]
+                    if rows:
+                        self._rows[student_id] = rows
+                    else:
+                        del self._rows[student_id]
+                retired.append(row)
+        return retired
+
+    def _ensure_capacity(self, n):
+        if n <= self._alive.shape[0]:
+            return
+        capacity = max(n, self._alive.shape[0] * 2, 1024)
+        names = ('_sq_norms', '_norms', '_alive', '_labels')
+        if self._store is None:
+            names = ('_matrix',) + names
+        for name in names:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _maybe_compact(self, publish):
+        # Store-backed rows must keep their file positions; see EncodingStore.compact
+        if self._store is not None or self._dead < 64 or self._dead * 2 < self._size:
+            return
+        keep = np.flatnonzero(self._alive[:self._size])
+        capacity = max(1024, 2 * keep.size)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:keep.size] = self._matrix[keep]
+        sq_norms = np.zeros(capacity, dtype=np.float32)
+        sq_norms[:keep.size] = self._sq_norms[keep]
+        norms = np.zeros(capacity, dtype=np.float32)
+        norms[:keep.size] = self._norms[keep]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:keep.size] = True
+        labels = np.zeros(capacity, dtype=np.int32)
+        labels[:keep.size] = self._labels[keep]
+        self._matrix, self._sq_norms, self._norms = matrix, sq_norms, norms
+        self._alive, self._labels = alive, labels
+        self._student_ids = [self._student_ids[i] for i in keep]
+        self._names = [self._names[i] for i in keep]
+        self._photos = [self._photos[i] for i in keep]
+        self._shared = 0
+        self._rows = {}
+        for i, student_id in enumerate(self._student_ids):
+            self._rows.setdefault(student_id, []).append(i)
+        self._size = keep.size
+        self._dead = 0
+        self._rebuild_index()
+        if publish:
+            self._publish()
+
+    def _rebuild_index(self):
+        self._index = _build_configured_index(self._matrix[:self._size])
+
+    def _maybe_rebuild_index(self):
+        if self._index is None:
+            self._rebuild_index()
+            return
+        covered = self._index.size
+        if self._index.kind == 'brute':
+            # A linear scan already covers new rows; only switch once 'auto' would pick IVF
+            if getattr(Config, 'ANN_INDEX', 'auto') != 'brute' and self._size >= getattr(Config, 'ANN_MIN_GALLERY_SIZE', 5000):
+                self._rebuild_index()
+            return
+        if self._size - covered > getattr(Config, 'ANN_REBUILD_FRACTION', 0.1) * covered:
+            self._rebuild_index()
+
+    def _unshare(self):
+        # Copy-on-write before changing an entry a published snapshot can see
+        self._student_ids = list(self._student_ids)
+        self._names = list(self._names)
+        self._photos = list(self._photos)
+        self._shared = 0
+
+    def _publish(self):
+        # Views only: nothing here is proportional to the gallery size
+        n = self._size
+        self.current = FaceGallery(
+            self._matrix[:n], sq_norms=self._sq_norms[:n], norms=self._norms[:n], alive=self._alive[:n],
+            student_ids=_Column(self._student_ids, n), names=_Column(self._names, n),
+            photos=_Column(self._photos, n), index=self._index, labels=self._labels[:n],
+        )
+        self._shared = n
+
+
+def _max_embeddings():
+    return max(1, int(getattr(Config, 'MAX_EMBEDDINGS_PER_STUDENT', 5)))
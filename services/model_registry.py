@@ -0,0 +1,112 @@
+"""Process-wide cache of detectors, models and preprocessing objects.
+
+Each object is built once per process on first use (thread-safely) and then
+shared by every service and request, so a frame that falls through to a slow
+fallback does not also pay for parsing a cascade XML or loading a model.
+Under ``gunicorn --preload`` objects loaded in the master are inherited by
+the workers.
+"""
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from config import Config
+
+try:
+    import dlib
+except Exception:
+    dlib = None
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def get(key, factory):
+    """Return the object cached under ``key``, building it with ``factory()`` once"""
+    obj = _cache.get(key)
+    if obj is None:
+        with _lock:
+            obj = _cache.get(key)
+            if obj is None:
+                obj = factory()
+                _cache[key] = obj
+    return obj
+
+
+def clear():
+    """Forget every cached object (tests, model file replaced on disk)"""
+    with _lock:
+        _cache.clear()
+
+
+def loaded():
+    """Keys of the objects loaded so far"""
+    return sorted(str(key) for key in _cache)
+
+
+def haar_cascade_path():
+    """Locate haarcascade_frontalface_default.xml (models dir first, then OpenCV data)"""
+    model_dir = getattr(Config, 'MODEL_DIR', os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', 'models'))
+    cascade_path = os.path.join(model_dir, 'haarcascade_frontalface_default.xml')
+    if os.path.exists(cascade_path):
+        return cascade_path
+    # cv2.data can be a string path or a module with attribute `haarcascades`
+    cv2_data = getattr(cv2, 'data', None)
+    try:
+        if isinstance(cv2_data, str):
+            return os.path.join(cv2_data, 'haarcascade_frontalface_default.xml')
+        if cv2_data and hasattr(cv2_data, 'haarcascades'):
+            return os.path.join(cv2_data.haarcascades, 'haarcascade_frontalface_default.xml')
+    except Exception:
+        pass
+    return ''
+
+
+def haar_cascade(path=None):
+    """Shared frontal-face ``cv2.CascadeClassifier`` (detectMultiScale is reentrant)"""
+    path = path or haar_cascade_path()
+
+    def load():
+        if Config.DEBUG_MODE:
+            print(f"Using cascade at: {path}")
+        return cv2.CascadeClassifier(path)
+    return get(('haar', path), load)
+
+
+class SharedClahe:
+    """A CLAHE instance guarded by a lock: ``apply`` reuses internal buffers,
+    so concurrent calls on one instance are not safe."""
+
+    def __init__(self, clip_limit, tile_grid_size):
+        self._clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+        self._lock = threading.Lock()
+
+    def apply(self, image):
+        with self._lock:
+            return self._clahe.apply(image)
+
+
+def clahe(clip_limit=2.0, tile_grid_size=(8, 8)):
+    """Shared CLAHE preprocessor for the given settings"""
+    tile_grid_size = tuple(tile_grid_size)
+    return get(('clahe', clip_limit, tile_grid_size), lambda: SharedClahe(clip_limit, tile_grid_size))
+
+
+def dlib_detector():
+    """dlib's HOG frontal face detector"""
+    return get('dlib_hog', dlib.get_frontal_face_detector)
+
+
+def dlib_shape_predictor(path):
+    return get(('dlib_shape', path), lambda: dlib.shape_predictor(path))
+
+
+def dlib_face_rec_model(path):
+    return get(('dlib_rec', path), lambda: dlib.face_recognition_model_v1(path))
+
+
+def warm_up_cascade(cascade):
+    """Run one detection on a blank image so lazy OpenCV initialisation happens now"""
+    cascade.detectMultiScale(np.zeros((64, 64), dtype=np.uint8), scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
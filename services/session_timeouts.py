@@ -0,0 +1,109 @@
+"""Session timeouts driven by a min-heap of deadlines.
+
+A student's session expires ``timeout`` seconds (FACE_TIMEOUT) after their
+last sighting. The heap holds at most one deadline per student: a sighting
+only updates the student's current deadline, and when an older heap entry
+surfaces it is pushed again with the current one. A discarded session keeps a
+marker until its entry surfaces, so a new session reuses that entry. Touching
+a session is O(1) (O(log n) for a new one) and the thread sleeps until the
+earliest deadline instead of polling. All sessions found expired on a wake-up are handed to
+``on_expire`` together, so they are closed with one write.
+
+The thread starts with the first session in the process that records
+attendance. Under ``gunicorn --preload`` that is the worker that owns the
+sessions, not the master (threads do not survive the fork); a forked copy of
+a running scheduler starts over empty.
+"""
+import heapq
+import os
+import threading
+import time
+
+from config import Config
+
+
+class SessionTimeoutScheduler:
+    def __init__(self, on_expire, timeout=None, clock=time.monotonic):
+        self.on_expire = on_expire  # called with the list of expired student ids
+        self.timeout = timeout if timeout is not None else Config.FACE_TIMEOUT.total_seconds()
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._heap = []       # (deadline, student_id), at most one entry per student
+        self._deadlines = {}  # student_id -> current deadline, None once discarded (entry still in the heap)
+        self._active = 0
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+
+    def touch(self, student_id):
+        """Restart ``student_id``'s timeout (a sighting)"""
+        with self._cond:
+            self._ensure_thread()
+            deadline = self.clock() + self.timeout
+            known = student_id in self._deadlines
+            if self._deadlines.get(student_id) is None:
+                self._active += 1
+            self._deadlines[student_id] = deadline
+            if not known:
+                heapq.heappush(self._heap, (deadline, student_id))
+                if self._heap[0][1] == student_id:
+                    self._cond.notify()
+
+    def discard(self, student_id):
+        """Forget a session that was closed otherwise (its heap entry is dropped when it surfaces)"""
+        with self._cond:
+            if self._deadlines.get(student_id) is not None:
+                self._deadlines[student_id] = None
+                self._active -= 1
+
+    def pop_expired(self, now=None):
+        """Remove and return the ids of all sessions expired at ``now``"""
+        now = self.clock() if now is None else now
+        expired = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, student_id = heapq.heappop(self._heap)
+                current = self._deadlines[student_id]
+                if current is None:
+                    del self._deadlines[student_id]  # discarded
+                elif current > now:
+                    heapq.heappush(self._heap, (current, student_id))  # seen again since
+                else:
+                    del self._deadlines[student_id]
+                    self._active -= 1
+                    expired.append(student_id)
+        return expired
+
+    def __len__(self):
+        return self._active
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _ensure_thread(self):
+        # Called with _cond held
+        if self._stopped or (self._thread is not None and self._pid == os.getpid()):
+            return
+        if self._pid is not None:
+            # Forked from a process with a running scheduler: its sessions are not ours
+            self._heap, self._deadlines, self._active = [], {}, 0
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='session-timeouts', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    expired = self.pop_expired()
+                    if expired:
+                        break
+                    self._cond.wait(self._heap[0][0] - self.clock() if self._heap else None)
+            try:
+                self.on_expire(expired)
+            except Exception as e:
+                print(f"Error closing timed-out sessions: {e}")
@@ -0,0 +1,790 @@
+"""Persistence of student metadata and attendance records.
+
+Interchangeable backends, selected by ``Config.STORAGE_BACKEND``:
+
+- ``json`` (default): ``students.json`` and ``attendance.json``, read and
+  rewritten whole through ``load_json`` / ``save_json``.
+- ``partitioned``: students.json as above; attendance in one file per day
+  (``Config.ATTENDANCE_DIR``) with a manifest, today's day kept in memory
+  and other days loaded lazily, so a date lookup reads only that day.
+- ``eventlog``: students.json as above; attendance is appended to a JSONL
+  event log (``Config.ATTENDANCE_LOG_DIR``) and served from an in-memory
+  view. A background compaction folds the log into per-day snapshots, so
+  a write costs the size of the change rather than of the whole history.
+- ``sqlite``: one SQLite database (``Config.SQLITE_PATH``) in WAL mode.
+  Attendance is keyed on ``(student_id, date)`` with a second index on
+  ``date``, so lookups are indexed queries and recording a sighting is a
+  single-row upsert. On first use the existing JSON files are imported.
+
+Attendance records are plain dicts with the same keys in every backend
+(``student_id``, ``name``, ``login_time``, ``logout_time``, ``duration``,
+``date``, plus any legacy fields). Sightings are merged, never overwritten:
+a record's login is the earliest and its logout the latest time seen, so
+several processes can record into the same storage.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytz
+
+from config import Config
+from utils.helpers import load_json, save_json, file_lock, calculate_duration, get_current_time
+
+_storages = {}
+_registries = {}
+_lock = threading.Lock()
+
+
+def get_storage(backend=None):
+    """Return the process-wide storage for ``backend`` (default ``Config.STORAGE_BACKEND``)"""
+    backend = backend or getattr(Config, 'STORAGE_BACKEND', 'json')
+    if backend == 'json':
+        return JsonStorage()
+    if backend == 'sqlite':
+        key, factory = Config.SQLITE_PATH, SqliteStorage
+    elif backend == 'eventlog':
+        key, factory = Config.ATTENDANCE_LOG_DIR, EventLogStorage
+    elif backend == 'partitioned':
+        key, factory = Config.ATTENDANCE_DIR, PartitionedStorage
+    else:
+        raise ValueError(f"unknown STORAGE_BACKEND {backend!r} "
+                         "(expected 'json', 'partitioned', 'eventlog' or 'sqlite')")
+    storage = _storages.get((backend, key))
+    if storage is None:
+        with _lock:
+            storage = _storages.get((backend, key))
+            if storage is None:
+                storage = _storages[(backend, key)] = factory(key)
+    return storage
+
+
+def parse_time(value):
+    """Parse an ISO timestamp; naive (legacy) values are taken to be in ``Config.TIMEZONE``"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = pytz.timezone(Config.TIMEZONE).localize(moment)
+    return moment
+
+
+class StudentRegistry:
+    """students.json as a dict by student_id, metadata only (inline encodings are dropped).
+
+    The file is parsed again only when its inode, mtime or size changed, so
+    a lookup costs one ``stat`` and registrations written by any process are
+    seen on the next call.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._by_id = {}
+
+    def students(self):
+        """The current ``{student_id: record}`` (shared: copy records before changing them)"""
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        with self._lock:
+            if stamp != self._stamp:
+                records = load_json(self.path) if stamp else []
+                by_id = {}
+                for rec in records:
+                    by_id.setdefault(rec.get('student_id'), {k: v for k, v in rec.items() if k != 'encoding'})
+                self._by_id, self._stamp = by_id, stamp
+            return self._by_id
+
+
+def student_registry(path=None):
+    """The process-wide registry of ``path`` (default ``Config.STUDENTS_JSON``)"""
+    path = path or Config.STUDENTS_JSON
+    registry = _registries.get(path)
+    if registry is None:
+        with _lock:
+            registry = _registries.setdefault(path, StudentRegistry(path))
+    return registry
+
+
+class JsonStorage:
+    """Students and attendance in the JSON files (stateless: paths are read from Config on every call)"""
+
+    kind = 'json'
+
+    # Students
+
+    def list_students(self):
+        return [dict(s) for s in student_registry().students().values()]
+
+    def get_student(self, student_id):
+        student = student_registry().students().get(student_id)
+        return dict(student) if student is not None else None
+
+    def upsert_student(self, record):
+        """Add a student record, replacing any previous record with the same id"""
+        with file_lock(Config.STUDENTS_JSON + '.lock'):
+            students = [s for s in load_json(Config.STUDENTS_JSON) if s.get('student_id') != record.get('student_id')]
+            students.append(record)
+            return save_json(Config.STUDENTS_JSON, students)
+
+    # Attendance
+
+    def all_attendance(self):
+        records = load_json(Config.ATTENDANCE_JSON)
+        return records if isinstance(records, list) else []
+
+    def attendance_on(self, date):
+        return [r for r in self.all_attendance() if r.get('date') == date]
+
+    def attendance_between(self, start, end):
+        """Records dated ``start`` to ``end`` (inclusive ISO dates)"""
+        return [r for r in self.all_attendance() if start <= (r.get('date') or '') <= end]
+
+    def student_attendance(self, student_id):
+        return [r for r in self.all_attendance() if r.get('student_id') == student_id]
+
+    def get_attendance(self, student_id, date):
+        return next((r for r in self.all_attendance()
+                     if r.get('student_id') == student_id and r.get('date') == date), None)
+
+    def extend_attendance(self, spans, event='appearance'):
+        """Merge ``(student_id, name, first_seen, last_seen)`` spans into the records.
+
+        A span extends the record of ``first_seen``'s day to cover it, creating
+        the record if needed. ``event`` (appearance, login, logout, video) is
+        only kept by the event log. Returns the resulting records, or None if
+        they could not be saved.
+        """
+        with file_lock(Config.ATTENDANCE_JSON + '.lock'):
+            records = self.all_attendance()
+            by_key = _index_records(records)
+            merged = [_extend_record(records, by_key, *span) for span in spans]
+            if merged and not save_json(Config.ATTENDANCE_JSON, records):
+                return None
+        return [dict(r) for r in merged]
+
+
+class PartitionedStorage(JsonStorage):
+    """Attendance in one JSON file per day plus a manifest; students stay in students.json.
+
+    ``<directory>/<date>.json`` holds the records of one day and
+    ``manifest.json`` maps each date to its record count, so listing the days
+    needs no directory scan. Today's partition stays in memory; other days are
+    loaded on demand and kept in an LRU of ``ATTENDANCE_DAY_CACHE`` days. A
+    cached day is re-read when its file changed (another process wrote it).
+    """
+
+    kind = 'partitioned'
+
+    def __init__(self, directory=None, cache_days=None):
+        self.directory = directory or Config.ATTENDANCE_DIR
+        self.manifest_path = os.path.join(self.directory, 'manifest.json')
+        self.lock_path = self.directory + '.lock'
+        self.cache_days = cache_days or getattr(Config, 'ATTENDANCE_DAY_CACHE', 32)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # date -> (file stamp, records), most recently used last
+        with file_lock(self.lock_path):
+            if not os.path.isdir(self.directory):
+                split_attendance_json(self.directory)
+
+    def _path(self, date):
+        return os.path.join(self.directory, f'{date}.json')
+
+    def _dates(self):
+        manifest = load_json(self.manifest_path)
+        return sorted(manifest.get('days', {})) if isinstance(manifest, dict) else []
+
+    def _day(self, date, cache=True):
+        """Records of one day (shared with the cache: copy before changing them)"""
+        try:
+            st = os.stat(self._path(date))
+            stamp = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        with self._lock:
+            cached = self._cache.get(date)
+            if cached is not None and cached[0] == stamp:
+                self._cache.move_to_end(date)
+                return cached[1]
+        records = load_json(self._path(date)) if stamp else []
+        if cache or date in self._cache:
+            self._remember(date, stamp, records)
+        return records
+
+    def _remember(self, date, stamp, records):
+        today = get_current_time().date().isoformat()
+        with self._lock:
+            self._cache[date] = (stamp, records)
+            self._cache.move_to_end(date)
+            # Today is never evicted
+            others = [d for d in self._cache if d != today]
+            for old in others[:max(0, len(others) - self.cache_days)]:
+                del self._cache[old]
+
+    # Attendance
+
+    def all_attendance(self):
+        return [dict(r) for date in self._dates() for r in self._day(date, cache=False)]
+
+    def attendance_on(self, date):
+        if not _is_date(date):
+            return []
+        return [dict(r) for r in self._day(date)]
+
+    def attendance_between(self, start, end):
+        return [dict(r) for date in self._dates() if start <= date <= end for r in self._day(date)]
+
+    def student_attendance(self, student_id):
+        return [dict(r) for date in self._dates() for r in self._day(date, cache=False)
+                if r.get('student_id') == student_id]
+
+    def get_attendance(self, student_id, date):
+        if not _is_date(date):
+            return None
+        rec = next((r for r in self._day(date) if r.get('student_id') == student_id), None)
+        return dict(rec) if rec is not None else None
+
+    def extend_attendance(self, spans, event='appearance'):
+        """Merge the spans into the partitions of their days; only those files and the manifest are written"""
+        spans = list(spans)
+        by_day = {}
+        for i, span in enumerate(spans):
+            by_day.setdefault(span[2].date().isoformat(), []).append(i)
+        merged = [None] * len(spans)
+        with file_lock(self.lock_path):
+            manifest = load_json(self.manifest_path)
+            days = manifest.get('days', {}) if isinstance(manifest, dict) else {}
+            for day, indexes in by_day.items():
+                records = [dict(r) for r in self._day(day)]
+                by_key = _index_records(records)
+                for i in indexes:
+                    merged[i] = dict(_extend_record(records, by_key, *spans[i]))
+                if not save_json(self._path(day), records):
+                    return None
+                st = os.stat(self._path(day))
+                self._remember(day, (st.st_mtime_ns, st.st_size), records)
+                days[day] = len(records)
+            if by_day and not save_json(self.manifest_path, {'days': days}):
+                return None
+        return merged
+
+
+def split_attendance_json(directory, source=None, manifest=True):
+    """One-time split of a monolithic attendance.json into ``<directory>/<date>.json`` files.
+
+    The directory is built next to its final place and renamed into it, so a
+    crash leaves either no partitions or all of them. Returns the number of
+    records split.
+    """
+    source = source or Config.ATTENDANCE_JSON
+    records = load_json(source) if os.path.exists(source) else []
+    by_day = {}
+    for rec in records if isinstance(records, list) else []:
+        if rec.get('date'):
+            by_day.setdefault(rec['date'], []).append(rec)
+    staging = directory + '.tmp'
+    os.makedirs(staging, exist_ok=True)
+    for day, day_records in by_day.items():
+        save_json(os.path.join(staging, f'{day}.json'), day_records)
+    if manifest:
+        save_json(os.path.join(staging, 'manifest.json'),
+                  {'days': {day: len(day_records) for day, day_records in sorted(by_day.items())}})
+    os.replace(staging, directory)
+    count = sum(map(len, by_day.values()))
+    if count:
+        print(f"Split {count} attendance record(s) from {source} into {len(by_day)} day(s) in {directory}")
+    return count
+
+
+def _is_date(value):
+    # Dates come from query strings and become file names
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class EventLogStorage(JsonStorage):
+    """Attendance as an append-only event log plus per-day snapshots; students stay in students.json.
+
+    Layout of ``directory``: ``events.jsonl`` holds one line per merged span,
+    ``days/<date>.json`` the records of each day as of the last compaction.
+    The log is the only file written when attendance is recorded; all reads
+    are served from an in-memory view (snapshots plus the log, tailed for
+    lines appended by other processes). Compaction folds the log into the
+    snapshots of the days it touches and starts an empty log.
+    """
+
+    kind = 'eventlog'
+
+    def __init__(self, directory=None, compact_interval=None):
+        self.directory = directory or Config.ATTENDANCE_LOG_DIR
+        self.log_path = os.path.join(self.directory, 'events.jsonl')
+        self.days_dir = os.path.join(self.directory, 'days')
+        self.lock_path = os.path.join(self.directory, 'events.lock')
+        self._lock = threading.RLock()       # view, offsets and the append fd
+        self._sync_lock = threading.Lock()   # group commit
+        self._view = {}     # (student_id, date) -> record
+        self._days = {}     # date -> {student_id: record}
+        self._inode = None  # inode of the log the view has read
+        self._offset = 0    # bytes of it applied to the view
+        self._torn = False  # log ends in a partial line (a writer crashed mid-append)
+        self._fd = None
+        self._written = 0   # appends done / fsynced (group commit counters)
+        self._synced = 0
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, file_lock(self.lock_path):
+            if not os.path.isdir(self.days_dir):
+                # First open: attendance.json becomes the initial day snapshots
+                split_attendance_json(self.days_dir, manifest=False)
+            self._rebuild()
+        self._compact_interval = (compact_interval if compact_interval is not None
+                                  else getattr(Config, 'ATTENDANCE_COMPACT_S', 600))
+        self._compactor_pid = None
+
+    def _ensure_compactor(self):
+        # Started by the first append in each process: under gunicorn --preload the
+        # storage is opened in the master, whose threads do not survive the fork
+        if not self._compact_interval or self._compactor_pid == os.getpid():
+            return
+        with self._lock:
+            if self._compactor_pid != os.getpid():
+                self._compactor_pid = os.getpid()
+                threading.Thread(target=self._compact_loop, args=(self._compact_interval,),
+                                 name='attendance-compactor', daemon=True).start()
+
+    def _rebuild(self):
+        # Called with both locks held
+        self._view, self._days = {}, {}
+        for name in sorted(os.listdir(self.days_dir)):
+            if name.endswith('.json'):
+                for rec in load_json(os.path.join(self.days_dir, name)):
+                    key = (rec.get('student_id'), rec.get('date'))
+                    self._view.setdefault(key, rec)
+                    self._days.setdefault(key[1], {}).setdefault(key[0], rec)
+        self._inode, self._offset, self._torn = None, 0, False
+        self._catch_up(locked=True)
+
+    def _catch_up(self, locked=False):
+        """Apply log lines appended since the last read (by any process); called with ``_lock`` held.
+
+        ``locked`` tells that the caller also holds the cross-process file lock.
+        """
+        try:
+            f = open(self.log_path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            if self._inode is not None and st.st_ino != self._inode:
+                # Another process compacted: the events we had not read yet are in the snapshots now
+                f.close()
+                if locked:
+                    self._rebuild()
+                else:
+                    with file_lock(self.lock_path):
+                        self._rebuild()
+                return
+            self._inode = st.st_ino
+            if st.st_size <= self._offset:
+                return
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                event = json.loads(line)
+                self._apply(event['student_id'], event.get('name'),
+                            parse_time(event['first_seen']), parse_time(event['last_seen']))
+            except (ValueError, KeyError):
+                print(f"Skipping unreadable attendance event in {self.log_path}")
+        self._offset += end
+        self._torn = end < len(data)
+
+    def _apply(self, student_id, name, first_seen, last_seen):
+        rec = _extend_record(None, self._view, student_id, name, first_seen, last_seen)
+        self._days.setdefault(rec['date'], {}).setdefault(student_id, rec)
+        return rec
+
+    def _append_fd(self):
+        # The log is replaced by compaction, so reopen when it is no longer the file we hold
+        try:
+            current = os.stat(self.log_path).st_ino
+        except FileNotFoundError:
+            current = None
+        if self._fd is None or os.fstat(self._fd).st_ino != current:
+            with self._sync_lock:
+                if self._fd is not None:
+                    os.fsync(self._fd)
+                    os.close(self._fd)
+                    self._synced = self._written
+                self._fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._fd
+
+    def _sync(self, seq):
+        """fsync until append ``seq`` is durable; one fsync covers every append made before it"""
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            target = self._written
+            os.fsync(self._fd)
+            self._synced = target
+
+    # Attendance
+
+    def all_attendance(self):
+        with self._lock:
+            self._catch_up()
+            return [dict(r) for r in self._view.values()]
+
+    def attendance_on(self, date):
+        with self._lock:
+            self._catch_up()
+            return [dict(r) for r in self._days.get(date, {}).values()]
+
+    def attendance_between(self, start, end):
+        with self._lock:
+            self._catch_up()
+            return [dict(r) for date in sorted(self._days) if start <= date <= end
+                    for r in self._days[date].values()]
+
+    def student_attendance(self, student_id):
+        with self._lock:
+            self._catch_up()
+            return [dict(r) for (sid, _), r in self._view.items() if sid == student_id]
+
+    def get_attendance(self, student_id, date):
+        with self._lock:
+            self._catch_up()
+            rec = self._view.get((student_id, date))
+            return dict(rec) if rec is not None else None
+
+    def extend_attendance(self, spans, event='appearance'):
+        """Append the spans to the log (one write, group-committed fsync) and apply them to the view"""
+        spans = list(spans)
+        if not spans:
+            return []
+        self._ensure_compactor()
+        data = ''.join(json.dumps({'event': event, 'student_id': sid, 'name': name, 'first_seen': first.isoformat(),
+                                   'last_seen': last.isoformat()}) + '\n'
+                       for sid, name, first, last in spans).encode()
+        try:
+            with self._lock:
+                with file_lock(self.lock_path):
+                    self._catch_up(locked=True)
+                    fd = self._append_fd()
+                    # Terminate a line torn by a crashed writer so ours parse
+                    os.write(fd, b'\n' + data if self._torn else data)
+                    self._inode, self._offset, self._torn = os.fstat(fd).st_ino, os.fstat(fd).st_size, False
+                merged = [dict(self._apply(*span)) for span in spans]
+                self._written += 1
+                seq = self._written
+            self._sync(seq)
+        except OSError as e:
+            print(f"Error appending to attendance log {self.log_path}: {e}")
+            return None
+        return merged
+
+    # Compaction
+
+    def compact(self):
+        """Fold the log into the snapshots of the days it touches; returns the number of events folded"""
+        with self._lock, file_lock(self.lock_path):
+            self._catch_up(locked=True)
+            if not os.path.exists(self.log_path):
+                return 0
+            days, events = set(), 0
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    try:
+                        days.add(parse_time(json.loads(line)['first_seen']).date().isoformat())
+                        events += 1
+                    except (ValueError, KeyError):
+                        continue
+            # The view already holds snapshot + log, so it is the new snapshot
+            for day in sorted(days):
+                if not save_json(os.path.join(self.days_dir, f'{day}.json'), list(self._days.get(day, {}).values())):
+                    return 0
+            tmp = self.log_path + '.tmp'
+            open(tmp, 'wb').close()
+            os.replace(tmp, self.log_path)
+            self._inode, self._offset, self._torn = os.stat(self.log_path).st_ino, 0, False
+        return events
+
+    def _compact_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                if os.path.exists(self.log_path) and os.path.getsize(self.log_path):
+                    folded = self.compact()
+                    if folded and Config.DEBUG_MODE:
+                        print(f"Compacted {folded} attendance event(s) into {self.days_dir}")
+            except Exception as e:
+                print(f"Error compacting attendance log: {e}")
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS students (
+    student_id TEXT PRIMARY KEY,
+    name TEXT,
+    photo_path TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS attendance (
+    student_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    name TEXT,
+    login_time TEXT,
+    logout_time TEXT,
+    login_at REAL,
+    logout_at REAL,
+    duration TEXT,
+    extra TEXT,
+    PRIMARY KEY (student_id, date)
+);
+CREATE INDEX IF NOT EXISTS attendance_date ON attendance (date);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# login_at / logout_at are epoch seconds, so min/max compare instants rather than strings.
+# In an UPSERT every expression sees the row's old values.
+_EXTEND_SQL = '''
+INSERT INTO attendance (student_id, date, name, login_time, logout_time, login_at, logout_at, duration, extra)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (student_id, date) DO UPDATE SET
+    name = coalesce(attendance.name, excluded.name),
+    login_time = CASE WHEN attendance.login_at IS NULL OR excluded.login_at < attendance.login_at
+                      THEN excluded.login_time ELSE attendance.login_time END,
+    logout_time = CASE WHEN attendance.logout_at IS NULL OR excluded.logout_at > attendance.logout_at
+                       THEN excluded.logout_time ELSE attendance.logout_time END,
+    login_at = min(coalesce(attendance.login_at, excluded.login_at), excluded.login_at),
+    logout_at = max(coalesce(attendance.logout_at, excluded.logout_at), excluded.logout_at),
+    duration = printf('%.2f hours', (max(coalesce(attendance.logout_at, excluded.logout_at), excluded.logout_at)
+                                     - min(coalesce(attendance.login_at, excluded.login_at), excluded.login_at)) / 3600.0),
+    extra = coalesce(attendance.extra, excluded.extra)
+'''
+
+_ATTENDANCE_COLUMNS = 'student_id, name, login_time, logout_time, duration, date, extra'
+_CANONICAL = ('student_id', 'name', 'login_time', 'logout_time', 'duration', 'date')
+
+
+class SqliteStorage:
+    """Students and attendance in an SQLite database (WAL mode, one connection per thread)"""
+
+    kind = 'sqlite'
+
+    def __init__(self, path=None, migrate=True):
+        self.path = path or Config.SQLITE_PATH
+        self._local = threading.local()
+        # executescript() would commit on its own, so run the statements inside the transaction
+        with self._transaction() as conn:
+            for statement in _SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+        if migrate:
+            self.migrate_from_json()
+
+    def _connect(self):
+        # Connections must not cross a fork (gunicorn --preload), hence the pid check
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so concurrent writers queue instead of deadlocking
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    # Students
+
+    def list_students(self):
+        rows = self._connect().execute('SELECT student_id, name, photo_path, extra FROM students ORDER BY rowid')
+        return [_student_record(row) for row in rows]
+
+    def get_student(self, student_id):
+        row = self._connect().execute('SELECT student_id, name, photo_path, extra FROM students WHERE student_id = ?',
+                                      (student_id,)).fetchone()
+        return _student_record(row) if row else None
+
+    def upsert_student(self, record):
+        """Add a student record, replacing any previous record with the same id"""
+        with self._transaction() as conn:
+            self._upsert_student(conn, record)
+        return True
+
+    def _upsert_student(self, conn, record):
+        extra = {k: v for k, v in record.items() if k not in ('student_id', 'name', 'photo_path', 'encoding')}
+        conn.execute(
+            'INSERT INTO students (student_id, name, photo_path, extra) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (student_id) DO UPDATE SET name = excluded.name, photo_path = excluded.photo_path, '
+            'extra = excluded.extra',
+            (record.get('student_id'), record.get('name'), record.get('photo_path'),
+             json.dumps(extra) if extra else None))
+
+    # Attendance
+
+    def all_attendance(self):
+        rows = self._connect().execute(f'SELECT {_ATTENDANCE_COLUMNS} FROM attendance ORDER BY rowid')
+        return [_attendance_record(row) for row in rows]
+
+    def attendance_on(self, date):
+        rows = self._connect().execute(f'SELECT {_ATTENDANCE_COLUMNS} FROM attendance WHERE date = ? ORDER BY rowid',
+                                       (date,))
+        return [_attendance_record(row) for row in rows]
+
+    def attendance_between(self, start, end):
+        rows = self._connect().execute(
+            f'SELECT {_ATTENDANCE_COLUMNS} FROM attendance WHERE date BETWEEN ? AND ? ORDER BY date, rowid',
+            (start, end))
+        return [_attendance_record(row) for row in rows]
+
+    def student_attendance(self, student_id):
+        rows = self._connect().execute(
+            f'SELECT {_ATTENDANCE_COLUMNS} FROM attendance WHERE student_id = ? ORDER BY date', (student_id,))
+        return [_attendance_record(row) for row in rows]
+
+    def get_attendance(self, student_id, date):
+        row = self._connect().execute(
+            f'SELECT {_ATTENDANCE_COLUMNS} FROM attendance WHERE student_id = ? AND date = ?',
+            (student_id, date)).fetchone()
+        return _attendance_record(row) if row else None
+
+    def extend_attendance(self, spans, event='appearance'):
+        """Merge ``(student_id, name, first_seen, last_seen)`` spans, one upsert each (see ``JsonStorage``)"""
+        spans = list(spans)
+        if not spans:
+            return []
+        try:
+            with self._transaction() as conn:
+                keys = [self._extend(conn, *span) for span in spans]
+                return [_attendance_record(conn.execute(
+                    f'SELECT {_ATTENDANCE_COLUMNS} FROM attendance WHERE student_id = ? AND date = ?', key).fetchone())
+                    for key in keys]
+        except sqlite3.Error as e:
+            print(f"Error saving attendance to {self.path}: {e}")
+            return None
+
+    def _extend(self, conn, student_id, name, first_seen, last_seen, extra=None):
+        day = first_seen.date().isoformat()
+        conn.execute(_EXTEND_SQL, (
+            student_id, day, name, first_seen.isoformat(), last_seen.isoformat(),
+            first_seen.timestamp(), last_seen.timestamp(),
+            calculate_duration(first_seen.isoformat(), last_seen.isoformat()),
+            json.dumps(extra) if extra else None))
+        return student_id, day
+
+    # Migration
+
+    def migrate_from_json(self):
+        """Import students.json and attendance.json once; returns the number of records imported.
+
+        Inline face encodings are moved to the encoding store first. Later
+        calls (from any process) are no-ops.
+        """
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                return 0
+            students = load_json(Config.STUDENTS_JSON) if os.path.exists(Config.STUDENTS_JSON) else []
+            if any('encoding' in s for s in students):
+                from services.encoding_store import convert_students_json
+                convert_students_json()
+                students = load_json(Config.STUDENTS_JSON)
+            for student in students:
+                self._upsert_student(conn, student)
+
+            records = load_json(Config.ATTENDANCE_JSON) if os.path.exists(Config.ATTENDANCE_JSON) else []
+            imported = 0
+            for rec in records if isinstance(records, list) else []:
+                login = rec.get('login_time') or rec.get('first_timestamp')
+                if not rec.get('student_id') or not login:
+                    continue
+                logout = rec.get('logout_time') or rec.get('last_timestamp') or login
+                try:
+                    first_seen, last_seen = parse_time(login), parse_time(logout)
+                except ValueError:
+                    print(f"Skipping attendance record with unreadable times: {rec}")
+                    continue
+                extra = {k: v for k, v in rec.items() if k not in _CANONICAL}
+                self._extend(conn, rec['student_id'], rec.get('name'), first_seen, last_seen, extra)
+                imported += 1
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)", (datetime.now().isoformat(),))
+        if students or imported:
+            print(f"Imported {len(students)} student(s) and {imported} attendance record(s) into {self.path}")
+        return len(students) + imported
+
+
+def _student_record(row):
+    record = {'student_id': row['student_id'], 'name': row['name']}
+    if row['photo_path']:
+        record['photo_path'] = row['photo_path']
+    if row['extra']:
+        record.update(json.loads(row['extra']))
+    return record
+
+
+def _attendance_record(row):
+    record = {key: row[key] for key in _CANONICAL}
+    if row['extra']:
+        for key, value in json.loads(row['extra']).items():
+            record.setdefault(key, value)
+    return record
+
+
+def _index_records(records):
+    # (student_id, date) -> record, first record wins like a linear scan would
+    by_key = {}
+    for rec in records:
+        by_key.setdefault((rec.get('student_id'), rec.get('date')), rec)
+    return by_key
+
+
+def _extend_record(records, by_key, student_id, name, first_seen, last_seen):
+    """Make the record of ``first_seen``'s day cover ``first_seen``..``last_seen``; returns it
+
+    New records are added to ``by_key`` and appended to ``records`` (unless None).
+    """
+    day = first_seen.date().isoformat()
+    existing = by_key.get((student_id, day))
+    if existing is None:
+        existing = {
+            "student_id": student_id,
+            "name": name,
+            "login_time": first_seen.isoformat(),
+            "logout_time": last_seen.isoformat(),
+            "date": day
+        }
+        if records is not None:
+            records.append(existing)
+        by_key[(student_id, day)] = existing
+    else:
+        login = existing.get('login_time')
+        logout = existing.get('logout_time')
+        if not login or parse_time(login) > first_seen:
+            existing['login_time'] = first_seen.isoformat()
+        if not logout or parse_time(logout) < last_seen:
+            existing['logout_time'] = last_seen.isoformat()
+    existing['duration'] = calculate_duration(existing['login_time'], existing['logout_time'])
+    return existing
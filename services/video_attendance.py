@@ -0,0 +1,166 @@
+"""Attendance from recorded videos (see tools/process_video_attendance.py).
+
+Each video is split into chunks of consecutive frames and the chunks are
+processed in parallel by a pool of worker processes. A worker opens the video
+itself, seeks to its chunk and stream-decodes it, so only one frame per worker
+is ever in memory and decoding is spread over the cores as well. Every
+``stride``-th frame goes through ``process_frame`` with a camera id of its own
+per chunk, so tracking and consecutive-frame confirmation work as for a live
+camera. Workers return only per-student first and last sightings, which are
+merged per video.
+"""
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+
+from services.frame_dispatcher import prescale, recognize_prescaled
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.webm', '.m4v', '.mpg', '.mpeg')
+
+_worker_service = None
+
+
+def _init_worker(service_cls):
+    global _worker_service
+    _worker_service = service_cls()
+
+
+def find_videos(paths):
+    """Expand files and directories (searched recursively) into a sorted list of video files"""
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                videos.extend(os.path.join(root, f) for f in files if f.lower().endswith(VIDEO_EXTENSIONS))
+        else:
+            videos.append(path)
+    return sorted(videos)
+
+
+def video_info(path):
+    """Return ``(frame_count, fps)`` of a video, or None if it cannot be opened.
+
+    ``frame_count`` is 0 for containers that do not record it.
+    """
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return None
+        return int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), float(capture.get(cv2.CAP_PROP_FPS) or 0.0)
+    finally:
+        capture.release()
+
+
+def plan_chunks(frame_count, chunk_frames):
+    """Split ``frame_count`` frames into ``[(start, end), ...]`` ranges of at most ``chunk_frames``"""
+    chunk_frames = max(1, int(chunk_frames))
+    return [(start, min(start + chunk_frames, frame_count)) for start in range(0, frame_count, chunk_frames)]
+
+
+def scan_chunk(service, path, start, end, stride=1):
+    """Recognize faces in frames ``start`` to ``end`` (exclusive) of a video.
+
+    Every ``stride``-th frame of the video is processed. Returns ``(sightings, frames_read)``
+    where ``sightings`` maps student_id to ``[name, first_frame, last_frame, count]``.
+    """
+    sightings = {}
+    frames_read = 0
+    camera_id = f"{path}#{start}"
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return sightings, frames_read
+        if start:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        for index in range(start, end):
+            # grab() advances without converting the frames we skip
+            if not capture.grab():
+                break
+            frames_read += 1
+            # Aligned to the whole video, so the result does not depend on chunking
+            if index % stride:
+                continue
+            ok, frame = capture.retrieve()
+            if not ok or frame is None:
+                continue
+            for face in recognize_prescaled(service, camera_id, prescale(service, frame)) or []:
+                seen = sightings.get(face['student_id'])
+                if seen is None:
+                    sightings[face['student_id']] = [face['name'], index, index, 1]
+                else:
+                    seen[2] = index
+                    seen[3] += 1
+    finally:
+        capture.release()
+    return sightings, frames_read
+
+
+def _worker_scan(path, start, end, stride):
+    return scan_chunk(_worker_service, path, start, end, stride)
+
+
+def merge_sightings(into, sightings):
+    """Fold one chunk's sightings into ``into`` (same layout as ``scan_chunk``)"""
+    for student_id, (name, first, last, count) in sightings.items():
+        seen = into.get(student_id)
+        if seen is None:
+            into[student_id] = [name, first, last, count]
+        else:
+            seen[1] = min(seen[1], first)
+            seen[2] = max(seen[2], last)
+            seen[3] += count
+    return into
+
+
+def process_videos(videos, service_cls, stride=5, workers=None, chunk_seconds=60, progress=None, mp_context=None):
+    """Scan ``videos`` in parallel and return ``{path: (sightings, fps)}``.
+
+    ``sightings`` is the merged ``scan_chunk`` result of the whole video.
+    ``progress(frames_done, frames_total, elapsed_s)`` is called whenever a
+    chunk finishes (``frames_total`` leaves out videos of unknown length). At
+    most two chunks per worker are queued at a time.
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = []
+    results = {}
+    total = 0
+    for path in videos:
+        info = video_info(path)
+        if info is None:
+            print(f"Skipping {path}: not a readable video")
+            continue
+        frame_count, fps = info
+        results[path] = ({}, fps)
+        if frame_count <= 0:
+            # Unknown length: one worker reads the whole video
+            jobs.append((path, 0, sys.maxsize))
+            continue
+        total += frame_count
+        chunk_frames = chunk_seconds * (fps or 25.0)
+        jobs.extend((path, start, end) for start, end in plan_chunks(frame_count, chunk_frames))
+
+    started = time.monotonic()
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                             initializer=_init_worker, initargs=(service_cls,)) as pool:
+        pending = {}
+        queue = iter(jobs)
+        while True:
+            for path, start, end in queue:
+                pending[pool.submit(_worker_scan, path, start, end, stride)] = path
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = pending.pop(future)
+                sightings, frames_read = future.result()
+                merge_sightings(results[path][0], sightings)
+                done += frames_read
+                if progress is not None:
+                    progress(done, total, time.monotonic() - started)
+    return results
@@ -0,0 +1,287 @@
+"""Server-side ingestion of camera streams and video files.
+
+Every source runs on two threads of its own. The reader decodes the stream
+with ``cv2.VideoCapture`` at whatever rate it produces frames and samples one
+every 1/INGEST_SAMPLE_FPS seconds; the recognizer sends the newest sample
+through ``FrameDispatcher.dispatch_frame`` and records attendance for the
+faces it returns. The hand-over slot holds a single frame, so when
+recognition falls behind the waiting frame is replaced (and counted as
+skipped) instead of queueing, and a slow source only ever delays itself.
+Sources are sharded by their id like browser cameras, so recognition of
+different sources runs in parallel.
+
+A source is a camera index (``"0"``), a stream URL (``rtsp://...``) or a
+local video file, which is paced at its own frame rate unless
+INGEST_REALTIME_FILES is off.
+"""
+import os
+import threading
+import time
+
+import cv2
+
+from config import Config
+from services.frame_dispatcher import FrameDropped
+
+
+def parse_sources(spec):
+    """Parse ``"id=uri;id2=uri2"`` (INGEST_SOURCES) into ``[(id, uri), ...]``.
+
+    An entry without ``id=`` uses the uri as its id.
+    """
+    sources = []
+    for entry in (spec or '').split(';'):
+        entry = entry.strip()
+        if not entry:
+            continue
+        source_id, sep, uri = entry.partition('=')
+        if not sep or '://' in source_id:
+            source_id, uri = entry, entry
+        sources.append((source_id.strip(), uri.strip()))
+    return sources
+
+
+def _open_capture(uri):
+    # A bare number is a local camera index
+    return cv2.VideoCapture(int(uri) if str(uri).isdigit() else uri)
+
+
+class VideoSource:
+    """Reader and recognizer threads of one video source, with their counters.
+
+    ``dispatch_frame(source_id, frame)`` returns ``(recognized_faces, load)``;
+    ``handle_faces(source_id, faces)`` is called for every non-empty result.
+    """
+
+    def __init__(self, source_id, uri, dispatch_frame, handle_faces=None, sample_fps=None, realtime=None,
+                 reconnect_s=None, loop=False, open_capture=_open_capture, clock=time.monotonic):
+        self.source_id = source_id
+        self.uri = uri
+        self.is_file = os.path.isfile(str(uri))
+        self.sample_fps = sample_fps or getattr(Config, 'INGEST_SAMPLE_FPS', 2.0)
+        self.realtime = realtime if realtime is not None else getattr(Config, 'INGEST_REALTIME_FILES', True)
+        self.reconnect_s = reconnect_s if reconnect_s is not None else getattr(Config, 'INGEST_RECONNECT_S', 5)
+        self.loop = loop
+        self._dispatch_frame = dispatch_frame
+        self._handle_faces = handle_faces
+        self._open_capture = open_capture
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._slot = None           # (frame, sampled_at) waiting for the recognizer
+        self._reader_done = False
+        self._stop = threading.Event()
+        self._threads = []
+
+        self.started_at = None
+        self.frames_read = 0
+        self.frames_sampled = 0
+        self.frames_skipped = 0
+        self.frames_processed = 0
+        self.faces_recognized = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+
+    def start(self):
+        self.started_at = self._clock()
+        self._threads = [
+            threading.Thread(target=self._read_loop, name=f'ingest-read-{self.source_id}', daemon=True),
+            threading.Thread(target=self._recognize_loop, name=f'ingest-recognize-{self.source_id}', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def join(self, timeout=None):
+        """Wait until the source is exhausted (end of a file that is not looped)"""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _read_loop(self):
+        try:
+            while not self._stop.is_set():
+                capture = self._open_capture(self.uri)
+                if capture is not None and capture.isOpened():
+                    try:
+                        self._read_capture(capture)
+                    finally:
+                        capture.release()
+                elif Config.DEBUG_MODE:
+                    print(f"Ingest {self.source_id}: could not open {self.uri}")
+                if self.is_file and not self.loop:
+                    break
+                # A stream ended or failed to open: reconnect after a pause
+                if self._stop.wait(0 if self.is_file else self.reconnect_s):
+                    break
+                self.reconnects += 1
+        finally:
+            with self._cond:
+                self._reader_done = True
+                self._cond.notify_all()
+
+    def _read_capture(self, capture):
+        interval = 1.0 / self.sample_fps
+        start = self._clock()
+        next_sample = 0.0
+        while not self._stop.is_set():
+            # grab() only advances the stream; frames that are not sampled are never converted
+            if not capture.grab():
+                return
+            self.frames_read += 1
+            if self.is_file:
+                position = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                if self.realtime:
+                    ahead = position - (self._clock() - start)
+                    if ahead > 0 and self._stop.wait(ahead):
+                        return
+            else:
+                position = self._clock() - start
+            if position < next_sample - 1e-6:
+                continue
+            next_sample += interval
+            if next_sample <= position:
+                next_sample = position + interval
+            ok, frame = capture.retrieve()
+            if ok and frame is not None:
+                self._offer(frame)
+
+    def _offer(self, frame):
+        with self._cond:
+            if self._slot is not None:
+                # Recognition is behind: the newer frame replaces the waiting one
+                self.frames_skipped += 1
+            self._slot = (frame, self._clock())
+            self.frames_sampled += 1
+            self._cond.notify()
+
+    def _recognize_loop(self):
+        while True:
+            with self._cond:
+                while self._slot is None and not self._reader_done and not self._stop.is_set():
+                    self._cond.wait()
+                if self._stop.is_set() or self._slot is None:
+                    return
+                frame, sampled_at = self._slot
+                self._slot = None
+
+            try:
+                faces, _ = self._dispatch_frame(self.source_id, frame)
+            except FrameDropped:
+                self.frames_skipped += 1
+                continue
+            except Exception as e:
+                self.errors += 1
+                print(f"Ingest {self.source_id}: recognition failed: {e}")
+                continue
+
+            lag = self._clock() - sampled_at
+            self.frames_processed += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._total_lag += lag
+            if faces:
+                self.faces_recognized += len(faces)
+                if self._handle_faces is not None:
+                    try:
+                        self._handle_faces(self.source_id, faces)
+                    except Exception as e:
+                        self.errors += 1
+                        print(f"Ingest {self.source_id}: could not record attendance: {e}")
+
+    def stats(self):
+        """Throughput and lag counters; lag is the time from sampling a frame to its result"""
+        elapsed = max(self._clock() - self.started_at, 1e-9) if self.started_at is not None else None
+        processed = self.frames_processed
+        return {
+            'uri': self.uri,
+            'running': self.running,
+            'frames_read': self.frames_read,
+            'frames_sampled': self.frames_sampled,
+            'frames_skipped': self.frames_skipped,
+            'frames_processed': processed,
+            'faces_recognized': self.faces_recognized,
+            'errors': self.errors,
+            'reconnects': self.reconnects,
+            'read_fps': round(self.frames_read / elapsed, 2) if elapsed else None,
+            'processed_fps': round(processed / elapsed, 2) if elapsed else None,
+            'lag_ms': round(1000.0 * self.last_lag, 1) if self.last_lag is not None else None,
+            'avg_lag_ms': round(1000.0 * self._total_lag / processed, 1) if processed else None,
+            'max_lag_ms': round(1000.0 * self.max_lag, 1),
+        }
+
+
+class VideoIngestWorker:
+    """Runs any number of ``VideoSource``s and records attendance for what they see.
+
+    ``dispatcher`` is a ``FrameDispatcher``; recognized faces of each frame are
+    passed to ``attendance_service.record_appearances`` in one write.
+    """
+
+    def __init__(self, dispatcher, attendance_service, **source_options):
+        self.dispatcher = dispatcher
+        self.attendance_service = attendance_service
+        self.source_options = source_options
+        self.sources = {}
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def ensure_started(self, sources):
+        """Start ``[(source_id, uri), ...]`` once in the calling process.
+
+        Reader threads do not survive a fork: under gunicorn --preload the
+        worker object is built in the master, so the process that serves
+        requests calls this (gunicorn post_fork hook, or its first request).
+        """
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            # Sources copied from the parent process have no threads here
+            self.sources = {}
+        for source_id, uri in sources:
+            self.add_source(source_id, uri)
+
+    def add_source(self, source_id, uri, **options):
+        """Start ingesting ``uri`` under ``source_id`` (its camera id); replaces a source with the same id"""
+        self.remove_source(source_id)
+        source = VideoSource(source_id, uri, self.dispatcher.dispatch_frame, self._record,
+                             **{**self.source_options, **options})
+        with self._lock:
+            self.sources[source_id] = source
+        return source.start()
+
+    def remove_source(self, source_id):
+        with self._lock:
+            source = self.sources.pop(source_id, None)
+        if source is not None:
+            source.stop(timeout=5)
+        return source is not None
+
+    def _record(self, source_id, faces):
+        self.attendance_service.record_appearances([(face['student_id'], face['name']) for face in faces])
+
+    def stats(self):
+        with self._lock:
+            sources = dict(self.sources)
+        return {source_id: source.stats() for source_id, source in sources.items()}
+
+    def stop(self):
+        with self._lock:
+            sources, self.sources = self.sources, {}
+        for source in sources.values():
+            source.stop(timeout=5)
@@ -8,6 +8,20 @@ let lastRecognitionTime = Date.now();
 let RECOGNITION_COOLDOWN_MS = 2000; // 2s cooldown after a detection
 let processingFrame = false;          // true while a frame request is in-flight
 let recognitionCooldownUntil = 0;     // timestamp until which we skip captures
+let serverRetryAfterMs = 0;          // back-off hint from the last /api/process-frame response
+let FRAME_STREAMING = false;          // server offers /ws/process-frame (set from FACEATTEND_CONFIG)
+let frameSocket = null;               // open WebSocket for streaming frames
+let frameSocketWaiter = null;         // {resolve, reject} of the frame awaiting its result
+
+// Stable per-tab camera id so the server keeps separate recognition state per kiosk
+function getCameraId() {
+    let id = sessionStorage.getItem('faceattend_camera_id');
+    if (!id) {
+        id = 'cam-' + Math.random().toString(36).slice(2) + Date.now().toString(36);
+        sessionStorage.setItem('faceattend_camera_id', id);
+    }
+    return id;
+}
 
 // Sound effects
 // Helper to read the configured API base from the page without creating a global
@@ -65,6 +79,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const c = window.FACEATTEND_CONFIG;
             if (typeof c.RECOGNITION_COOLDOWN_MS === 'number') RECOGNITION_COOLDOWN_MS = c.RECOGNITION_COOLDOWN_MS;
             if (typeof c.SOUND_COOLDOWN_MS === 'number') SOUND_COOLDOWN_MS = c.SOUND_COOLDOWN_MS;
+            if (c.FRAME_STREAMING && typeof WebSocket !== 'undefined') FRAME_STREAMING = true;
             // other server-side tuning variables are consumed server-side; we keep client-focused ones
             console.debug('FACEATTEND_CONFIG loaded', c);
         }
@@ -163,17 +178,16 @@ async function processVideoFrame() {
             processingFrame = true;
 
             // Send frame to server (throttled)
-            const response = await fetch(`${getApiBase()}/api/process-frame`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ frame: await blobToBase64(blob) })
-            });
+            const data = await sendFrame(blob);
 
-            const data = await response.json();
+            // Back off while the server is busy (it sends a hint based on its queue)
+            serverRetryAfterMs = (data && data.retry_after_ms) || 0;
 
             // If server processed the frame successfully, handle recognized faces.
             // If server returned an error (success:false), treat it as "no faces detected"
-            if (data && data.success) {
+            if (data && data.dropped) {
+                // A newer frame from this camera replaced it; nothing to show
+            } else if (data && data.success) {
                 handleRecognizedFaces(Array.isArray(data.recognized_faces) ? data.recognized_faces : []);
             } else {
                 console.warn('Frame processing failed on server:', data && data.error);
@@ -189,19 +203,74 @@ async function processVideoFrame() {
         
     } catch (err) {
         console.error('Error processing frame:', err);
+        processingFrame = false;
     }
     
-    // Continue processing frames at ~4 FPS (250ms)
-    setTimeout(processVideoFrame, 250);
+    // Continue processing frames at ~4 FPS (250ms), slower if the server asked us to back off
+    setTimeout(processVideoFrame, Math.max(250, Math.min(serverRetryAfterMs, 5000)));
+}
+
+// Send one frame and resolve with the server's JSON result. Uses the WebSocket
+// stream when the server offers it (binary JPEG, no base64 or per-frame HTTP
+// request) and falls back to POST /api/process-frame otherwise.
+async function sendFrame(blob) {
+    const ws = FRAME_STREAMING ? await getFrameSocket() : null;
+    if (ws) {
+        return new Promise((resolve, reject) => {
+            frameSocketWaiter = { resolve, reject };
+            ws.send(blob);
+        });
+    }
+    // Raw JPEG body: no base64 inflation, and the server can decode it at reduced size
+    const response = await fetch(`${getApiBase()}/api/process-frame?camera_id=${encodeURIComponent(getCameraId())}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'image/jpeg' },
+        body: blob
+    });
+    return response.json();
 }
 
-// Convert blob to base64
-function blobToBase64(blob) {
-    return new Promise((resolve, reject) => {
-        const reader = new FileReader();
-        reader.onload = () => resolve(reader.result.split(',')[1]);
-        reader.onerror = reject;
-        reader.readAsDataURL(blob);
+// Open (or reuse) the frame stream; resolves with null if it cannot be opened,
+// in which case this page keeps using HTTP
+function getFrameSocket() {
+    if (frameSocket && frameSocket.readyState === WebSocket.OPEN) return Promise.resolve(frameSocket);
+    return new Promise(resolve => {
+        const base = getApiBase() || window.location.origin;
+        const url = base.replace(/^http/, 'ws') + '/ws/process-frame?camera_id=' + encodeURIComponent(getCameraId());
+        let ws;
+        try {
+            ws = new WebSocket(url);
+        } catch (e) {
+            FRAME_STREAMING = false;
+            resolve(null);
+            return;
+        }
+        ws.onopen = () => {
+            frameSocket = ws;
+            resolve(ws);
+        };
+        ws.onmessage = (event) => {
+            const waiter = frameSocketWaiter;
+            frameSocketWaiter = null;
+            if (!waiter) return;
+            try {
+                waiter.resolve(JSON.parse(event.data));
+            } catch (e) {
+                waiter.reject(e);
+            }
+        };
+        ws.onclose = () => {
+            if (frameSocket !== ws) {
+                // Never opened: fall back to HTTP
+                FRAME_STREAMING = false;
+                resolve(null);
+            }
+            frameSocket = null;
+            if (frameSocketWaiter) {
+                frameSocketWaiter.reject(new Error('Frame stream closed'));
+                frameSocketWaiter = null;
+            }
+        };
     });
 }
 
@@ -0,0 +1,43 @@
+import numpy as np
+
+from services.ann_index import BruteForceIndex, IVFFlatIndex, build_index, recall_at_k
+from services.gallery import FaceGallery
+
+
+def _clustered_gallery(n=4000, dim=128, people=400, seed=1):
+    """Synthetic encodings: a few noisy samples around each 'person'."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(scale=0.1, size=(people, dim))
+    labels = rng.integers(0, people, size=n)
+    return (centres[labels] + rng.normal(scale=0.02, size=(n, dim))).astype(np.float32), rng
+
+
+def test_ivf_recall_against_brute_force():
+    matrix, rng = _clustered_gallery()
+    queries = matrix[rng.choice(len(matrix), 100, replace=False)] + rng.normal(scale=0.01, size=(100, 128))
+
+    index = IVFFlatIndex(matrix, nprobe=8)
+    assert recall_at_k(index, matrix, queries, k=2) >= 0.95
+    # Scanning every list is exhaustive
+    exhaustive = IVFFlatIndex(matrix, nlist=index.nlist, nprobe=index.nlist)
+    assert recall_at_k(exhaustive, matrix, queries, k=5) == 1.0
+    assert recall_at_k(BruteForceIndex(matrix), matrix, queries, k=5) == 1.0
+
+
+def test_gallery_search_reranks_shortlist_exactly():
+    matrix, rng = _clustered_gallery(n=2000)
+    gallery = FaceGallery(matrix)
+    gallery.build_index(kind='ivf', nprobe=4)
+    probe = matrix[10] + rng.normal(scale=0.005, size=128)
+
+    rows, distances, cosines = gallery.search(probe)
+    full_distances, full_cosines = gallery.score(probe)
+    np.testing.assert_allclose(distances, full_distances[rows], rtol=1e-6)
+    np.testing.assert_allclose(cosines, full_cosines[rows], rtol=1e-6)
+    assert rows[np.argmin(distances)] == np.argmin(full_distances)
+
+
+def test_auto_index_uses_brute_force_for_small_galleries():
+    matrix, _ = _clustered_gallery(n=300)
+    assert build_index(matrix, kind='auto', min_size=5000).kind == 'brute'
+    assert build_index(matrix, kind='auto', min_size=100).kind == 'ivf'
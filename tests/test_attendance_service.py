@@ -0,0 +1,145 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from config import Config
+from services.attendance_service import AttendanceService
+from utils.helpers import get_current_time, load_json
+
+
+@pytest.fixture
+def attendance_file(tmp_path, monkeypatch):
+    path = tmp_path / 'attendance.json'
+    path.write_text('[]')
+    monkeypatch.setattr(Config, 'ATTENDANCE_JSON', str(path))
+    monkeypatch.setattr(Config, 'ATTENDANCE_JOURNAL_S', 3600)
+    return path
+
+
+def _service():
+    # Keep the background flusher from starting (a first sighting would start and wake it);
+    # the tests flush explicitly
+    service = AttendanceService()
+    service._stop.set()
+    return service
+
+
+def test_appearances_stay_in_memory_until_flushed(attendance_file):
+    service = _service()
+    before = attendance_file.stat().st_mtime_ns
+    todays = service.record_appearances([('1', 'Ann'), ('2', 'Bo'), ('1', 'Ann')])
+    assert set(todays) == {'1', '2'}
+    assert service.get_today_attendance('1')['name'] == 'Ann'
+    assert attendance_file.stat().st_mtime_ns == before and load_json(str(attendance_file)) == []
+
+    assert service.flush()
+    records = load_json(str(attendance_file))
+    assert sorted(r['student_id'] for r in records) == ['1', '2']
+    assert not os.path.exists(service.journal_path)
+    service.close()
+
+
+def test_journal_is_replayed_after_a_crash(attendance_file):
+    crashed = _service()
+    crashed.record_appearance('1', 'Ann')
+    crashed._write_journal()
+    assert os.path.exists(crashed.journal_path)
+    # The process dies: its in-memory state is gone and it never flushes
+    crashed._stop.set()
+    crashed._dirty.clear()
+
+    restarted = AttendanceService()
+    records = load_json(str(attendance_file))
+    assert [r['student_id'] for r in records] == ['1']
+    assert restarted.get_today_attendance('1')['login_time'] == records[0]['login_time']
+    assert not os.path.exists(restarted.journal_path)
+    restarted.close()
+
+
+def test_flushes_from_two_services_merge(attendance_file):
+    first, second = _service(), _service()
+    first.record_appearance('1', 'Ann')
+    second.record_appearances([('1', 'Ann'), ('2', 'Bo')])
+    assert first.flush() and second.flush()
+    records = {r['student_id']: r for r in load_json(str(attendance_file))}
+    assert set(records) == {'1', '2'}
+    assert records['1']['login_time'] == first.get_today_attendance('1')['login_time']
+    assert records['1']['logout_time'] == second.get_today_attendance('1')['logout_time']
+    first.close()
+    second.close()
+
+
+def test_repeated_sightings_are_coalesced(attendance_file, monkeypatch):
+    monkeypatch.setattr(Config, 'ATTENDANCE_COALESCE_S', 3600)
+    service = _service()
+    service.record_appearance('1', 'Ann')
+    assert service.flush()
+    for _ in range(20):
+        service.record_appearance('1', 'Ann')
+    # Within the interval nothing is queued for the journal or the storage
+    assert not service._events and not service._dirty
+    assert service.flush()
+    stored = load_json(str(attendance_file))[0]
+    assert stored['logout_time'] == stored['login_time']
+
+    # Shutdown writes the last sighting
+    latest = service.get_today_attendance('1')['logout_time']
+    service.close()
+    assert load_json(str(attendance_file))[0]['logout_time'] == latest
+
+
+def test_first_sighting_wakes_the_flusher(attendance_file):
+    service = AttendanceService()
+    service.record_appearance('1', 'Ann')
+    for _ in range(100):
+        if load_json(str(attendance_file)):
+            break
+        time.sleep(0.01)
+    assert [r['student_id'] for r in load_json(str(attendance_file))] == ['1']
+    service.close()
+
+
+def test_flusher_runs_in_a_process_forked_after_construction(attendance_file):
+    # gunicorn --preload builds the service in the master and forks the workers
+    service = AttendanceService()
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            service.record_appearance('1', 'Ann')
+            for _ in range(200):
+                if load_json(str(attendance_file)):
+                    break
+                time.sleep(0.01)
+            ok = (service._flusher.is_alive() and service.journal_path.endswith(f'.{os.getpid()}.journal')
+                  and [r['student_id'] for r in load_json(str(attendance_file))] == ['1'])
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert service._flusher is None
+    service.close()
+
+
+def test_journals_of_live_processes_are_not_replayed(attendance_file):
+    live = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    try:
+        seen = get_current_time().isoformat()
+        for pid, student_id in ((live.pid, '1'), (dead.pid, '2')):
+            with open(f'{attendance_file}.{pid}.journal', 'w') as f:
+                f.write(json.dumps({'student_id': student_id, 'name': 'S', 'time': seen}) + '\n')
+
+        service = _service()
+        assert [r['student_id'] for r in load_json(str(attendance_file))] == ['2']
+        assert os.path.exists(f'{attendance_file}.{live.pid}.journal')
+        assert not os.path.exists(f'{attendance_file}.{dead.pid}.journal')
+        service.close()
+    finally:
+        live.kill()
+        live.wait()
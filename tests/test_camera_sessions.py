@@ -0,0 +1,39 @@
+from services.camera_sessions import CameraSessionStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_sessions_are_isolated_per_camera():
+    store = CameraSessionStore(ttl=60, max_sessions=10, clock=FakeClock())
+    store.get('cam-a').consecutive_frames['1_Alice'] = 3
+    assert store.get('cam-b').consecutive_frames == {}
+    assert store.get('cam-a').consecutive_frames == {'1_Alice': 3}
+
+
+def test_idle_sessions_expire():
+    clock = FakeClock()
+    store = CameraSessionStore(ttl=60, max_sessions=10, clock=clock)
+    store.get('cam-a').consecutive_frames['1_Alice'] = 3
+    clock.now = 50
+    store.get('cam-b')
+    clock.now = 100
+    # cam-a idle for 100s: a fresh session, and the stale one was evicted
+    assert store.get('cam-a').consecutive_frames == {}
+    assert 'cam-b' in store
+    clock.now = 200
+    store.get('cam-c')
+    assert len(store) == 1
+
+
+def test_store_is_bounded():
+    store = CameraSessionStore(ttl=60, max_sessions=3, clock=FakeClock())
+    for cam in ('a', 'b', 'c', 'd'):
+        store.get(cam)
+    assert len(store) == 3
+    assert 'a' not in store
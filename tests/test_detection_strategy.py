@@ -0,0 +1,65 @@
+from services.detection_strategy import DetectionStage, DetectionStrategy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _stage(name, clock, hit=None, cost=0.01, tier=0, log=None):
+    def detect(image):
+        if log is not None:
+            log.append(name)
+        clock.now += cost
+        return hit
+    return DetectionStage(name, detect, tier)
+
+
+def test_stops_at_first_confident_hit_and_keeps_best_weak_hit():
+    clock = FakeClock()
+    log = []
+    strategy = DetectionStrategy([
+        _stage('small', clock, ('small-face', 10), log=log),
+        _stage('large', clock, ('large-face', 100), log=log),
+        _stage('never', clock, ('other', 500), log=log),
+    ], confident_quality=50, budget_ms=0, adaptive=False, clock=clock)
+    assert strategy.run(None) == 'large-face'
+    assert log == ['small', 'large']
+
+    weak = DetectionStrategy([
+        _stage('a', clock, ('a', 10)), _stage('b', clock, None), _stage('c', clock, ('c', 20)),
+    ], confident_quality=50, budget_ms=0, adaptive=False, clock=clock)
+    assert weak.run(None) == 'c'
+    assert weak.stats()['stages']['b']['hits'] == 0
+
+
+def test_reorders_by_success_rate_within_tier():
+    clock = FakeClock()
+    strategy = DetectionStrategy([
+        _stage('rarely', clock, None),
+        _stage('often', clock, ('face', 1.0)),
+        _stage('last_resort', clock, ('face', 1.0), tier=1),
+    ], adaptive=True, budget_ms=0, clock=clock)
+    for _ in range(5):
+        assert strategy.run(None) == 'face'
+    stats = strategy.stats()
+    assert stats['order'] == ['often', 'rarely', 'last_resort']
+    assert stats['stages']['rarely']['calls'] == 1
+    assert stats['stages']['often']['hit_rate'] == 1.0
+    assert stats['stages']['last_resort']['calls'] == 0
+
+
+def test_time_budget_skips_remaining_stages():
+    clock = FakeClock()
+    strategy = DetectionStrategy([
+        _stage('slow', clock, None, cost=0.2),
+        _stage('skipped', clock, ('face', 1.0)),
+    ], budget_ms=100, adaptive=False, clock=clock)
+    assert strategy.run(None) is None
+    stats = strategy.stats()
+    assert stats['budget_exhausted'] == 1 and stats['misses'] == 1
+    assert stats['stages']['skipped']['skipped'] == 1
+    assert stats['stages']['slow']['avg_ms'] == 200.0
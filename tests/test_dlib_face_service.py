@@ -0,0 +1,142 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from config import Config
+from services import model_registry
+from services.camera_sessions import CameraSessionStore
+from services.dlib_face_service import DlibFaceService
+from services.gallery import LiveGallery
+
+
+class WholeImageCascade:
+    """Stands in for the Haar cascade: the whole photo is the face"""
+
+    def detectMultiScale(self, gray, **kwargs):
+        return [(0, 0, gray.shape[1], gray.shape[0])]
+
+
+def _service():
+    # No models are loaded: the tests drive the matching and frame logic directly
+    service = DlibFaceService.__new__(DlibFaceService)
+    service._template_cache = OrderedDict()
+    service._template_lock = threading.Lock()
+    return service
+
+
+def _texture(seed):
+    return np.random.default_rng(seed).integers(0, 256, size=(120, 120), dtype=np.uint8)
+
+
+def _live_face(seed):
+    return DlibFaceService._face_crop(_texture(seed), (0, 0, 120, 120))
+
+
+def _unit(i):
+    encoding = np.zeros(128, dtype=np.float32)
+    encoding[i] = 1.0
+    return encoding
+
+
+def test_template_fallback_accepts_only_a_matching_photo(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, 'haar_cascade', lambda path=None: WholeImageCascade())
+    gallery = LiveGallery()
+    for i, (student_id, name) in enumerate([('1', 'Ann'), ('2', 'Bo')]):
+        photo = tmp_path / f'{student_id}.png'
+        cv2.imwrite(str(photo), _texture(i))
+        gallery.upsert(student_id, name, _unit(i), str(photo))
+    service = _service()
+    snapshot = gallery.current
+    # Too far for the distance and cosine checks, so only the template can match
+    probe = _unit(5)
+
+    row, reason, high_conf = service._match_encoding(snapshot, probe, _live_face(1))
+    assert snapshot.student_ids[row] == '2' and reason.startswith('template') and not high_conf
+    assert service._match_encoding(snapshot, probe, _live_face(7)) is None
+
+    # Crops are cached per photo path: no file access once built, until invalidated
+    (tmp_path / '2.png').unlink()
+    assert service._stored_face_crop(snapshot, row) is not None
+    service.invalidate_template('2')
+    assert service._stored_face_crop(snapshot, row) is None
+
+
+def _frame_service(boxes_by_camera, encoding_of_box):
+    """A service whose detector and encoder are stubbed: boxes per camera, one encoding per box"""
+    service = _service()
+    service.dlib_available = False
+    service.camera_sessions = CameraSessionStore()
+    service.live_gallery = LiveGallery()
+    service.live_gallery.upsert('1', 'Ann', _unit(0), 'ann.jpg')
+    service.live_gallery.upsert('2', 'Bo', _unit(1), 'bo.jpg')
+    cameras = iter([])
+
+    def detect(rgb_frame, gray_frame):
+        return boxes_by_camera[next(cameras)]
+
+    service._detect_faces = detect
+    service._encode_faces_many = lambda items: [[encoding_of_box[box] for box in boxes] for _, _, boxes in items]
+
+    def process(*camera_ids):
+        nonlocal cameras
+        cameras = iter(camera_ids)
+        frames = [(camera_id, np.zeros((120, 160, 3), dtype=np.uint8)) for camera_id in camera_ids]
+        return service.process_frames(frames, prescaled=True)
+    return process
+
+
+def test_process_frames_reports_each_student_once_per_frame(monkeypatch):
+    monkeypatch.setattr(Config, 'MIN_CONSECUTIVE_FRAMES', 1)
+    small, other, large = (10, 10, 30, 30), (50, 10, 80, 40), (90, 20, 150, 80)
+    process = _frame_service(
+        {'empty': [], 'one': [other], 'many': [small, other, large]},
+        {small: _unit(0), other: _unit(1), large: _unit(0)},
+    )
+
+    empty, one, many = process('empty', 'one', 'many')
+    assert empty == []
+    assert [(f['student_id'], f['box']) for f in one] == \
+        [('2', {'left': 100, 'top': 20, 'right': 160, 'bottom': 80})]
+    # Ann matched on two boxes: only the larger one is reported
+    assert sorted((f['student_id'], f['box']['left']) for f in many) == [('1', 180), ('2', 100)]
+    assert len({f['track_id'] for f in many}) == 2
+
+
+class ShapeCascade:
+    """Stands in for the Haar cascade: one fixed box per image size"""
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+    def detectMultiScale(self, gray, **kwargs):
+        return [self.boxes[gray.shape]]
+
+
+def test_live_template_is_framed_by_the_cascade_like_the_baseline(tmp_path, monkeypatch):
+    rng = np.random.default_rng(9)
+    photo = cv2.GaussianBlur(rng.integers(0, 256, size=(150, 130), dtype=np.uint8), (0, 0), 4)
+    frame = rng.integers(0, 256, size=(160, 200), dtype=np.uint8)
+    frame[40:110, 50:120] = cv2.resize(photo[10:140, 5:125], (70, 70))
+    cascade = ShapeCascade({photo.shape: (5, 10, 120, 130), frame.shape: (50, 40, 70, 70)})
+    monkeypatch.setattr(model_registry, 'haar_cascade', lambda path=None: cascade)
+    cv2.imwrite(str(tmp_path / 'ann.png'), photo)
+    gallery = LiveGallery()
+    gallery.upsert('1', 'Ann', _unit(0), str(tmp_path / 'ann.png'))
+
+    service = _service()
+    service.dlib_available = True
+    hog_box = (45, 30, 125, 115)  # dlib frames the same face more loosely
+    haar_boxes = []
+    match = service._match_encoding(gallery.current, _unit(5),
+                                    lambda: service._live_template(frame, hog_box, haar_boxes))
+
+    # The baseline: both faces cropped at their cascade boxes and resized to 100x100
+    stored = cv2.resize(photo[10:140, 5:125], (100, 100))
+    live = cv2.resize(frame[40:110, 50:120], (100, 100))
+    baseline = float(cv2.minMaxLoc(cv2.matchTemplate(live, stored, cv2.TM_CCOEFF_NORMED))[1])
+    assert baseline > 0.6
+    assert match is not None and match[1] == f"template ({baseline:.4f})"
+    # No cascade face over the box: no template match
+    assert service._live_template(frame, (150, 120, 190, 150), haar_boxes) is None
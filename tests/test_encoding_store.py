@@ -0,0 +1,190 @@
+import json
+
+import numpy as np
+
+from config import Config
+from services.encoding_store import EncodingStore, convert_students_json
+from services.gallery import LiveGallery
+
+
+def _store(tmp_path):
+    return EncodingStore(str(tmp_path / 'enc.f32'), str(tmp_path / 'enc.jsonl'))
+
+
+def test_convert_moves_encodings_out_of_students_json(tmp_path, monkeypatch):
+    students_path = tmp_path / 'students.json'
+    monkeypatch.setattr(Config, 'STUDENTS_JSON', str(students_path))
+    rng = np.random.default_rng(0)
+    encodings = rng.normal(scale=0.1, size=(3, 128))
+    students_path.write_text(json.dumps([
+        {'student_id': str(i), 'name': f'S{i}', 'encoding': enc.tolist()} for i, enc in enumerate(encodings)
+    ]))
+
+    store = _store(tmp_path)
+    assert convert_students_json(store, str(students_path)) == 3
+    students = json.loads(students_path.read_text())
+    assert all('encoding' not in s for s in students)
+    assert store.check_consistency(students) == []
+    np.testing.assert_allclose(store.open_matrix(), encodings, rtol=1e-6)
+    # Running it again is a no-op
+    assert convert_students_json(store, str(students_path)) == 0
+
+
+
+def test_convert_keeps_a_malformed_encoding_inline(tmp_path, monkeypatch):
+    students_path = tmp_path / 'students.json'
+    monkeypatch.setattr(Config, 'STUDENTS_JSON', str(students_path))
+    good = np.random.default_rng(1).normal(scale=0.1, size=128)
+    students_path.write_text(json.dumps([
+        {'student_id': '1', 'name': 'Ann', 'encoding': good.tolist()},
+        {'student_id': '2', 'name': 'Bo', 'encoding': [0.1, 0.2]},
+    ]))
+
+    store = _store(tmp_path)
+    assert convert_students_json(store, str(students_path)) == 1
+    students = json.loads(students_path.read_text())
+    assert 'encoding' not in students[0]
+    assert students[1]['encoding'] == [0.1, 0.2]
+    assert list(store.live_rows()) == ['1']
+    # Still retried (and still rejected) on the next run
+    assert convert_students_json(store, str(students_path)) == 0
+    assert json.loads(students_path.read_text())[1]['encoding'] == [0.1, 0.2]
+
+def test_store_backed_gallery_upserts_and_reloads(tmp_path):
+    store = _store(tmp_path)
+    rng = np.random.default_rng(1)
+    a, b, b2 = rng.normal(scale=0.1, size=(3, 128))
+    live = LiveGallery.from_store(store)
+    live.upsert('1', 'Alice', a)
+    live.upsert('2', 'Bob', b)
+    live.upsert('2', 'Bob', b2)
+    assert live.remove('1')
+
+    reloaded = LiveGallery.from_store(_store(tmp_path)).current
+    rows, distances, _ = reloaded.search(b2)
+    assert [reloaded.student_ids[r] for r in rows] == ['2']
+    assert distances[0] < 1e-2
+    assert not reloaded.matrix.flags.owndata  # mapped from the file, not copied
+
+    assert store.check_consistency([{'student_id': '2', 'name': 'Bob'}]) == []
+    assert store.compact() == 1
+    assert store.row_count() == 1
+
+
+def test_orphan_rows_are_ignored(tmp_path):
+    store = _store(tmp_path)
+    store.append('1', 'Alice', np.ones(128))
+    # A row written without its index line (crash between the two writes)
+    with open(store.matrix_path, 'ab') as f:
+        f.write(np.zeros(128, dtype='<f4').tobytes())
+    assert store.live_rows() == {'1': (0, 'Alice')}
+    assert store.append('2', 'Bob', np.ones(128)) == 2
+
+
+def test_galleries_in_other_workers_pick_up_writes(tmp_path):
+    # Two store objects on the same files stand in for two gunicorn workers
+    rng = np.random.default_rng(2)
+    a, b, b2 = rng.normal(scale=0.1, size=(3, 128))
+    worker_a = LiveGallery.from_store(_store(tmp_path))
+    worker_b = LiveGallery.from_store(_store(tmp_path))
+
+    worker_a.upsert('1', 'Alice', a, 'alice.jpg')
+    snapshot = worker_b.refresh()
+    assert snapshot.student_ids == ['1'] and snapshot.photos == ['alice.jpg']
+    assert worker_b.refresh() is snapshot  # unchanged generation: nothing to do
+
+    worker_a.upsert('2', 'Bob', b)
+    worker_a.upsert('2', 'Bob', b2)
+    _store(tmp_path).compact()
+    snapshot = worker_b.refresh()
+    rows, distances, _ = snapshot.search(b2)
+    assert sorted(snapshot.student_ids[r] for r in rows) == ['1', '2']
+    assert len(snapshot) == 2 and snapshot.photos[0] == 'alice.jpg'
+
+    # Writes from a worker that missed the compaction land on the right rows
+    assert worker_a.remove('1')
+    snapshot = worker_b.refresh()
+    rows, _, _ = snapshot.search(a)
+    assert [snapshot.student_ids[r] for r in rows] == ['2']
+
+
+def test_extra_embeddings_survive_reload_and_compaction(tmp_path):
+    rng = np.random.default_rng(3)
+    a1, a2, b = rng.normal(scale=0.1, size=(3, 128))
+    live = LiveGallery.from_store(_store(tmp_path))
+    live.upsert('1', 'Alice', a1, 'a1.jpg')
+    live.upsert('2', 'Bob', b)
+    live.enroll('1', 'Alice', a2, 'a2.jpg')
+
+    store = _store(tmp_path)
+    assert store.live_rows() == {'1': (2, 'Alice'), '2': (1, 'Bob')}
+    store.compact()
+    reloaded = LiveGallery.from_store(_store(tmp_path))
+    assert reloaded.embedding_count('1') == 2
+    assert sorted(p for p in reloaded.current.photos if p) == ['a1.jpg', 'a2.jpg']
+    # Removing a student retires every one of their rows
+    assert live.remove('1')
+    reloaded.refresh()
+    assert '1' not in reloaded and list(_store(tmp_path).live_rows()) == ['2']
+
+
+def test_enroll_sees_a_registration_from_another_worker(tmp_path):
+    rng = np.random.default_rng(4)
+    a1, a2 = rng.normal(scale=0.1, size=(2, 128))
+    worker_a = LiveGallery.from_store(_store(tmp_path))
+    worker_b = LiveGallery.from_store(_store(tmp_path))
+    worker_a.upsert('1', 'Alice', a1, 'a1.jpg')
+
+    # worker_b has not refreshed yet: the second photo must still become an extra embedding
+    assert worker_b.enroll('1', 'Alice', a2, 'a2.jpg')
+    assert worker_b.embedding_count('1') == 2
+
+
+def test_published_snapshots_do_not_change(tmp_path):
+    rng = np.random.default_rng(5)
+    a, b = rng.normal(scale=0.1, size=(2, 128)).astype(np.float32)
+    writer = _store(tmp_path)
+    writer.append('1', 'Alice', a)
+    live = LiveGallery.from_store(_store(tmp_path))
+    # Another worker's row is in the file but its index line is not written yet
+    with open(writer.matrix_path, 'ab') as f:
+        f.write(b.tobytes())
+    writer._bump_generation()
+    pending = live.refresh()
+    assert len(pending) == 2 and pending.student_ids == ['1', None]
+
+    writer._append_index({'row': 1, 'student_id': '2', 'name': 'Bob'})
+    writer._bump_generation()
+    snapshot = live.refresh()
+    assert snapshot.student_ids == ['1', '2'] and snapshot.names == ['Alice', 'Bob']
+    assert pending.student_ids == ['1', None] and pending.names == ['Alice', None]
+    np.testing.assert_allclose(snapshot.norms, np.linalg.norm([a, b], axis=1), rtol=1e-6)
+
+
+def test_convert_moves_extra_embeddings_too(tmp_path, monkeypatch):
+    students_path = tmp_path / 'students.json'
+    monkeypatch.setattr(Config, 'STUDENTS_JSON', str(students_path))
+    monkeypatch.setattr(Config, 'MAX_EMBEDDINGS_PER_STUDENT', 3)
+    rng = np.random.default_rng(2)
+    first, second, third, fourth, other = rng.normal(scale=0.1, size=(5, 128))
+    students_path.write_text(json.dumps([
+        {'student_id': '1', 'name': 'Ann', 'encoding': first.tolist(),
+         'encodings': [second.tolist(), third.tolist(), fourth.tolist()]},
+        {'student_id': '2', 'name': 'Bo', 'encodings': [other.tolist(), [0.1, 0.2]]},
+    ]))
+
+    store = _store(tmp_path)
+    # Ann keeps her newest three, as LiveGallery.from_students would; Bo's short one stays inline
+    assert convert_students_json(store, str(students_path)) == 4
+    students = json.loads(students_path.read_text())
+    assert 'encoding' not in students[0] and 'encodings' not in students[0]
+    assert students[1]['encodings'] == [[0.1, 0.2]]
+
+    gallery = LiveGallery.from_store(store)
+    assert gallery.embedding_count('1') == 3 and gallery.embedding_count('2') == 1
+    snapshot = gallery.current
+    for probe, student_id in ((second, '1'), (fourth, '1'), (other, '2')):
+        rows, distances, _ = snapshot.search(probe)
+        best = np.argmin(distances)
+        assert snapshot.student_ids[rows[best]] == student_id and distances[best] < 1e-2
+    assert snapshot.search(first)[1].min() > 1e-2
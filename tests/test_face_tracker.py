@@ -0,0 +1,51 @@
+import numpy as np
+
+from services.face_tracker import FaceTracker, box_iou
+
+ALICE = {'student_id': '1', 'name': 'Alice', 'photo_path': None}
+
+
+def test_box_iou():
+    assert box_iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1.0
+    assert box_iou((0, 0, 10, 10), (20, 20, 30, 30)) == 0.0
+    assert abs(box_iou((0, 0, 10, 10), (5, 0, 15, 10)) - 1 / 3) < 1e-9
+
+
+def test_confirmed_track_skips_encoding_until_interval():
+    tracker = FaceTracker(iou_threshold=0.3, reencode_interval=3, appearance_threshold=10.0, max_misses=1)
+    crop = np.full((100, 100), 128, dtype=np.uint8)
+
+    (track, needs), = tracker.update([(10, 10, 60, 60)], [crop])
+    assert needs
+    track.assign(ALICE, high_conf=True)
+
+    encoded = []
+    for shift in range(1, 7):
+        (same, needs), = tracker.update([(10 + shift, 10, 60 + shift, 60)], [crop])
+        assert same is track
+        encoded.append(needs)
+        if needs:
+            same.assign(ALICE, high_conf=True)
+        else:
+            same.carry()
+    assert encoded == [False, False, True, False, False, True]
+    assert track.streak == 7
+
+
+def test_appearance_change_forces_encoding():
+    tracker = FaceTracker(iou_threshold=0.3, reencode_interval=100, appearance_threshold=10.0, max_misses=1)
+    (track, _), = tracker.update([(0, 0, 50, 50)], [np.zeros((100, 100), dtype=np.uint8)])
+    track.assign(ALICE, high_conf=True)
+    (_, needs), = tracker.update([(0, 0, 50, 50)], [np.full((100, 100), 200, dtype=np.uint8)])
+    assert needs
+
+
+def test_unconfirmed_tracks_are_encoded_and_lost_tracks_dropped():
+    tracker = FaceTracker(iou_threshold=0.3, reencode_interval=100, appearance_threshold=10.0, max_misses=1)
+    (track, _), = tracker.update([(0, 0, 50, 50)])
+    track.assign(ALICE, high_conf=False)
+    (_, needs), = tracker.update([(0, 0, 50, 50)])
+    assert needs
+    tracker.update([])
+    tracker.update([])
+    assert tracker.tracks == []
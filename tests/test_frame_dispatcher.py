@@ -0,0 +1,162 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from services.frame_dispatcher import FrameDispatcher, FrameDropped
+
+
+def _jpeg(width):
+    ok, buf = cv2.imencode('.jpg', np.zeros((8, width, 3), dtype=np.uint8))
+    return buf.tobytes()
+
+
+class BlockingService:
+    """Records the width of every frame it sees; the first call blocks until released"""
+
+    def __init__(self):
+        self.seen = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def process_frame(self, frame, camera_id=None):
+        self.seen.append((camera_id, frame.shape[1]))
+        self.started.set()
+        self.release.wait(5)
+        return [{'width': frame.shape[1]}]
+
+
+def test_newer_frame_replaces_waiting_frame():
+    service = BlockingService()
+    dispatcher = FrameDispatcher(service, workers=0, queue_depth=1, timeout=5)
+    results = {}
+
+    def send(width):
+        try:
+            results[width] = dispatcher.dispatch('cam', _jpeg(width))
+        except FrameDropped as e:
+            results[width] = e
+
+    first = threading.Thread(target=send, args=(16,))
+    first.start()
+    assert service.started.wait(5)
+    second = threading.Thread(target=send, args=(24,))
+    second.start()
+    while dispatcher.load_hint('cam')['queue_depth'] < 2:
+        time.sleep(0.01)
+    third = threading.Thread(target=send, args=(32,))
+    third.start()
+    second.join(5)
+    assert isinstance(results[24], FrameDropped) and results[24].reason == 'superseded'
+
+    service.release.set()
+    first.join(5)
+    third.join(5)
+    assert [w for _, w in service.seen] == [16, 32]
+    faces, load = results[32]
+    assert faces == [{'width': 32}]
+    assert load['queue_depth'] == 0 and 'retry_after_ms' in load
+
+
+def test_undecodable_frame_returns_none():
+    service = BlockingService()
+    service.release.set()
+    dispatcher = FrameDispatcher(service, workers=0)
+    faces, load = dispatcher.dispatch('cam', b'not an image')
+    assert faces is None and service.seen == []
+
+
+def test_cameras_are_sharded_consistently():
+    dispatcher = FrameDispatcher(None, workers=4)
+    shards = {dispatcher._shard(f'cam-{i}') for i in range(64)}
+    assert shards == {0, 1, 2, 3}
+    assert dispatcher._shard('kiosk-1') == dispatcher._shard('kiosk-1')
+
+
+class PrescaledService:
+    FRAME_SCALE = 4
+
+    def process_frame(self, frame, camera_id=None, prescaled=False):
+        return [{'shape': frame.shape, 'prescaled': prescaled}]
+
+
+def test_frames_are_decoded_at_the_service_scale():
+    ok, buf = cv2.imencode('.jpg', np.full((480, 640, 3), 128, dtype=np.uint8))
+    faces, _ = FrameDispatcher(PrescaledService(), workers=0).dispatch('cam', buf.tobytes())
+    assert faces == [{'shape': (120, 160, 3), 'prescaled': True}]
+
+
+class BatchService:
+    FRAME_SCALE = 1
+
+    def __init__(self):
+        self.calls = []
+
+    def process_frames(self, frames, prescaled=False):
+        self.calls.append([camera_id for camera_id, _ in frames])
+        return [[{'camera_id': camera_id, 'width': frame.shape[1]}] for camera_id, frame in frames]
+
+
+def test_batch_is_recognized_in_one_call_per_shard():
+    service = BatchService()
+    dispatcher = FrameDispatcher(service, workers=0)
+    frames = [('a', _jpeg(16)), ('b', b'not an image'), ('c', _jpeg(24))]
+    results, load = dispatcher.dispatch_batch(frames)
+    assert service.calls == [['a', 'c']]
+    assert results == [[{'camera_id': 'a', 'width': 16}], None, [{'camera_id': 'c', 'width': 24}]]
+    assert load['queue_depth'] == 0
+
+
+class SlowBatchService(BlockingService):
+    """BlockingService that also recognizes batches; counts calls running at once"""
+
+    def __init__(self):
+        super().__init__()
+        self.running = 0
+        self.overlap = False
+
+    def process_frame(self, frame, camera_id=None):
+        self.running += 1
+        self.overlap |= self.running > 1
+        try:
+            return super().process_frame(frame, camera_id)
+        finally:
+            self.running -= 1
+
+    def process_frames(self, frames, prescaled=False):
+        return [self.process_frame(frame, camera_id) for camera_id, frame in frames]
+
+
+def test_batch_waits_for_the_camera_in_flight_and_is_not_dropped():
+    service = SlowBatchService()
+    dispatcher = FrameDispatcher(service, workers=0, queue_depth=1, timeout=5)
+    results = {}
+
+    def single(width):
+        try:
+            results[width] = dispatcher.dispatch('cam', _jpeg(width))
+        except FrameDropped as e:
+            results[width] = e
+
+    first = threading.Thread(target=single, args=(16,))
+    first.start()
+    assert service.started.wait(5)
+    batch = threading.Thread(target=lambda: results.update(batch=dispatcher.dispatch_batch([('cam', _jpeg(24))])))
+    batch.start()
+    while dispatcher.load_hint('cam')['queue_depth'] < 2:
+        time.sleep(0.01)
+    # A newer single frame does not supersede the waiting batch
+    third = threading.Thread(target=single, args=(32,))
+    third.start()
+    while dispatcher.load_hint('cam')['queue_depth'] < 3:
+        time.sleep(0.01)
+
+    service.release.set()
+    for thread in (first, batch, third):
+        thread.join(5)
+    assert not service.overlap
+    assert [w for _, w in service.seen] == [16, 24, 32]
+    assert results['batch'][0] == [[{'width': 24}]]
+    assert dispatcher._cameras == {}
@@ -0,0 +1,57 @@
+import json
+from collections import deque
+
+from services.frame_dispatcher import FrameDropped
+from services.frame_stream import stream_frames
+
+
+class FakeWebSocket:
+    """Messages are delivered in batches: everything in one batch is already
+    buffered when the server starts draining."""
+
+    def __init__(self, *batches):
+        self.batches = deque(deque(b) for b in batches)
+        self.sent = []
+        self._current = None
+
+    def receive(self, timeout=None):
+        while self.batches and not self.batches[0]:
+            self.batches.popleft()
+        if not self.batches:
+            return None
+        batch = self.batches[0]
+        if timeout == 0 and batch is not self._current:
+            return None
+        self._current = batch
+        return batch.popleft()
+
+    def send(self, text):
+        self.sent.append(json.loads(text))
+        # The next batch only "arrives" once a result has been sent
+        self._current = None
+        if self.batches and not self.batches[0]:
+            self.batches.popleft()
+
+
+def test_only_the_newest_buffered_frame_is_processed():
+    calls = []
+
+    def dispatch(camera_id, frame_bytes):
+        calls.append((camera_id, frame_bytes))
+        if frame_bytes == b'drop':
+            raise FrameDropped('superseded', {'queue_depth': 2, 'retry_after_ms': 80})
+        return [{'student_id': '1', 'name': 'Ann'}], {'queue_depth': 0, 'retry_after_ms': 0}
+
+    ws = FakeWebSocket(
+        [b'f1', b'f2', b'f3'],
+        ['{"camera_id": "door"}', b'f4'],
+        [b'drop'],
+    )
+    stream_frames(ws, 'default', dispatch, enrich=lambda faces: [dict(f, marked=True) for f in faces])
+
+    assert calls == [('default', b'f3'), ('door', b'f4'), ('door', b'drop')]
+    first, second, third = ws.sent
+    assert first['success'] and first['skipped'] == 2
+    assert first['recognized_faces'] == [{'student_id': '1', 'name': 'Ann', 'marked': True}]
+    assert second['skipped'] == 0
+    assert third['dropped'] and third['retry_after_ms'] == 80
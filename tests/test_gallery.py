@@ -0,0 +1,142 @@
+import numpy as np
+
+from services.gallery import FaceGallery, LiveGallery, top_k
+
+
+def _reference_scores(probe, encodings):
+    """Per-row loop mirroring the original process_frame scoring."""
+    fe = np.array(probe, dtype=float)
+    candidates = []
+    for i, ke in enumerate(encodings):
+        ke = np.array(ke, dtype=float)
+        distance = float(np.linalg.norm(fe - ke))
+        cosine = float(np.dot(fe, ke) / ((np.linalg.norm(fe) * np.linalg.norm(ke)) + 1e-9))
+        candidates.append({'i': i, 'distance': distance, 'cosine': cosine})
+    return candidates
+
+
+def test_scores_match_reference_loop():
+    rng = np.random.default_rng(0)
+    encodings = rng.normal(scale=0.1, size=(200, 128))
+    probe = encodings[17] + rng.normal(scale=0.01, size=128)
+
+    gallery, kept = FaceGallery.from_encodings(encodings.tolist())
+    assert kept == list(range(200))
+    distances, cosines = gallery.score(probe)
+
+    reference = _reference_scores(probe, encodings)
+    np.testing.assert_allclose(distances, [c['distance'] for c in reference], atol=1e-4)
+    np.testing.assert_allclose(cosines, [c['cosine'] for c in reference], atol=1e-4)
+
+    by_distance = sorted(reference, key=lambda c: c['distance'])
+    by_cosine = sorted(reference, key=lambda c: c['cosine'], reverse=True)
+    assert list(top_k(distances, 2)) == [c['i'] for c in by_distance[:2]]
+    assert list(top_k(cosines, 3, largest=True)) == [c['i'] for c in by_cosine[:3]]
+
+
+def test_top_k_breaks_ties_by_index():
+    values = np.array([0.5, 0.1, 0.1, 0.3, 0.1])
+    assert list(top_k(values, 2)) == [1, 2]
+    assert list(top_k(values, 10)) == [1, 2, 4, 3, 0]
+    assert list(top_k(values, 1, largest=True)) == [0]
+
+
+def test_malformed_encodings_are_skipped():
+    gallery, kept = FaceGallery.from_encodings([[0.1, 0.2], None, [0.3], [0.4, 0.5]])
+    assert kept == [0, 3]
+    assert len(gallery) == 2
+    assert gallery.matrix.dtype == np.float32
+
+
+def test_empty_gallery_scores_nothing():
+    gallery, kept = FaceGallery.from_encodings([])
+    distances, cosines = gallery.score(np.zeros(128))
+    assert kept == [] and distances.size == 0 and cosines.size == 0
+
+
+def test_live_gallery_upsert_remove_and_snapshots():
+    rng = np.random.default_rng(3)
+    a, b, b2 = rng.normal(scale=0.1, size=(3, 128))
+    live = LiveGallery(capacity=1)
+    assert live.upsert('1', 'Alice', a, 'a.jpg')
+    before = live.current
+    assert live.upsert('2', 'Bob', b)
+    assert not live.upsert('3', 'Broken', [1.0, 2.0])
+
+    # Earlier snapshots are unaffected by appends
+    assert len(before) == 1 and len(live.current) == 2
+
+    # Re-registering replaces the old row
+    live.upsert('2', 'Bob', b2)
+    rows, distances, _ = live.current.search(b2)
+    ids = [live.current.student_ids[r] for r in rows]
+    assert ids == ['1', '2']
+    assert distances[ids.index('2')] < 1e-2
+
+    assert live.remove('1') and not live.remove('1')
+    rows, _, _ = live.current.search(a)
+    assert [live.current.student_ids[r] for r in rows] == ['2']
+    assert len(live) == 1
+
+
+def test_live_gallery_compacts_dead_rows():
+    rng = np.random.default_rng(4)
+    live = LiveGallery.from_students(
+        [{'student_id': str(i), 'name': f'S{i}', 'encoding': rng.normal(size=128).tolist()} for i in range(200)]
+    )
+    for i in range(150):
+        live.remove(str(i))
+    snapshot = live.current
+    # Compacted once (at half dead); the remaining dead rows are only masked
+    assert len(snapshot) == 100 and snapshot.alive.sum() == 50
+    rows, _, _ = snapshot.search(np.zeros(128))
+    assert sorted((snapshot.student_ids[r] for r in rows), key=int) == [str(i) for i in range(150, 200)]
+
+
+def test_students_with_several_embeddings_count_once():
+    rng = np.random.default_rng(5)
+    front, side, other = rng.normal(scale=0.1, size=(3, 128))
+    live = LiveGallery()
+    live.upsert('1', 'Alice', front, 'front.jpg')
+    assert live.enroll('1', 'Alice', side, 'side.jpg')
+    live.upsert('2', 'Bob', other)
+    assert len(live) == 2 and live.embedding_count('1') == 2
+
+    # A probe near Alice's second photo matches that embedding, and Alice is
+    # listed once so her other photo cannot crowd out the runner-up
+    probe = side + rng.normal(scale=0.005, size=128)
+    gallery = live.current
+    rows, distances, cosines = gallery.search_students(probe)
+    assert sorted(gallery.student_ids[r] for r in rows) == ['1', '2']
+    best = rows[np.argmin(distances)]
+    assert gallery.photos[best] == 'side.jpg'
+    all_rows, all_distances, all_cosines = gallery.search(probe)
+    alice = [j for j, r in enumerate(all_rows) if gallery.student_ids[r] == '1']
+    assert distances.min() == all_distances[alice].min()
+    assert cosines[list(rows).index(best)] == all_cosines[alice].max()
+
+    # Extra embeddings are capped per student; a new name replaces them all
+    for _ in range(10):
+        live.add_embedding('1', 'Alice', front)
+    assert live.embedding_count('1') == 5
+    live.enroll('1', 'Alicia', front)
+    assert live.embedding_count('1') == 1
+
+
+def test_batched_search_matches_single_probe_search():
+    rng = np.random.default_rng(3)
+    live = LiveGallery()
+    for i in range(30):
+        live.upsert(str(i % 20), f'S{i % 20}', rng.normal(scale=0.1, size=128))
+    live.add_embedding('3', 'S3', rng.normal(scale=0.1, size=128))
+    gallery = live.current
+    probes = rng.normal(scale=0.1, size=(5, 128))
+
+    batched = gallery.search_students_many(probes)
+    assert len(batched) == 5
+    for probe, (rows, distances, cosines) in zip(probes, batched):
+        ref_rows, ref_distances, ref_cosines = gallery.search_students(probe)
+        assert list(rows) == list(ref_rows)
+        np.testing.assert_allclose(distances, ref_distances, atol=1e-5)
+        np.testing.assert_allclose(cosines, ref_cosines, atol=1e-5)
+    assert gallery.search_students_many(np.empty((0, 128))) == []
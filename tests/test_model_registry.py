@@ -0,0 +1,42 @@
+import threading
+
+import numpy as np
+
+from services import model_registry
+
+
+def test_objects_are_built_once_across_threads():
+    model_registry.clear()
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def factory():
+        calls.append(1)
+        return object()
+
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(model_registry.get('model', factory))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+    model_registry.clear()
+
+
+def test_cascade_and_clahe_are_shared():
+    model_registry.clear()
+    assert model_registry.haar_cascade() is model_registry.haar_cascade()
+    clahe = model_registry.clahe(2.0, [8, 8])
+    assert clahe is model_registry.clahe(2.0, (8, 8))
+    assert clahe is not model_registry.clahe(3.0, (8, 8))
+    image = np.arange(64 * 64, dtype=np.uint8).reshape(64, 64)
+    assert clahe.apply(image).shape == image.shape
+    model_registry.warm_up_cascade(model_registry.haar_cascade())
+    model_registry.clear()
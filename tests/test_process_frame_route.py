@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('face_recognition')
+pytest.importorskip('PIL')
+
+from config import Config
+from services.attendance_service import AttendanceService
+from services.frame_dispatcher import FrameDispatcher
+from services.gallery import LiveGallery
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # Importing app creates the data files, so point them at tmp_path first
+    monkeypatch.setattr(Config, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(Config, 'STUDENTS_JSON', str(tmp_path / 'students.json'))
+    monkeypatch.setattr(Config, 'ATTENDANCE_JSON', str(tmp_path / 'attendance.json'))
+    import app as app_module
+    import services.face_recognition_service as recognition
+
+    encoding = np.random.default_rng(0).normal(scale=0.1, size=128)
+    calls = {'encodings': 0}
+
+    def face_locations(rgb, **kwargs):
+        return [(20, 60, 60, 20)]  # one face that does not move
+
+    def face_encodings(rgb, locations=None, **kwargs):
+        calls['encodings'] += 1
+        return [encoding for _ in locations]
+
+    monkeypatch.setattr(recognition.face_recognition, 'face_locations', face_locations)
+    monkeypatch.setattr(recognition.face_recognition, 'face_encodings', face_encodings)
+    service = recognition.FaceRecognitionService(preload=False)
+    service.live_gallery = LiveGallery()
+    service.live_gallery.upsert('1', 'Ann', encoding)
+    monkeypatch.setattr(app_module, 'frame_dispatcher', FrameDispatcher(service, workers=0))
+    attendance = AttendanceService(write_behind=False)
+    monkeypatch.setattr(app_module, 'attendance_service', attendance)
+    yield app_module.app.test_client(), calls
+    attendance.close()
+
+
+def test_a_still_face_is_encoded_until_its_track_is_confirmed(client, monkeypatch):
+    client, calls = client
+    monkeypatch.setattr(Config, 'MIN_CONSECUTIVE_FRAMES', 2)
+    ok, jpeg = cv2.imencode('.jpg', np.full((240, 320, 3), 128, dtype=np.uint8))
+
+    responses = [client.post('/api/process-frame?camera_id=kiosk', data=jpeg.tobytes(),
+                             content_type='image/jpeg').get_json() for _ in range(5)]
+    assert [len(r['recognized_faces']) for r in responses] == [0, 1, 1, 1, 1]
+    # Confirmed on the second frame; the following frames reuse the track's identity
+    assert calls['encodings'] == 2
+    faces = [r['recognized_faces'][0] for r in responses[1:]]
+    assert {f['student_id'] for f in faces} == {'1'} and len({f['track_id'] for f in faces}) == 1
+    assert faces[0]['box'] == {'left': 80, 'top': 80, 'right': 240, 'bottom': 240}
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from config import Config
+from services.attendance_service import AttendanceService
+from services.session_timeouts import SessionTimeoutScheduler
+from utils.helpers import load_json
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_heap_keeps_one_entry_per_student_and_honours_later_sightings():
+    clock = Clock()
+    scheduler = SessionTimeoutScheduler(lambda ids: None, timeout=10, clock=clock)
+    scheduler._stopped = True  # drive it by hand
+    scheduler.touch('1')
+    clock.now = 4
+    scheduler.touch('2')
+    scheduler.touch('3')
+    for _ in range(50):
+        scheduler.touch('1')
+    assert len(scheduler._heap) == 3
+
+    clock.now = 8
+    scheduler.touch('1')  # now due at 18
+    assert scheduler.pop_expired(10) == []
+    assert scheduler.pop_expired(14) == ['2', '3']
+    scheduler.discard('1')
+    assert scheduler.pop_expired(100) == [] and len(scheduler) == 0
+
+
+
+def test_a_session_reopened_after_discard_reuses_its_heap_entry():
+    clock = Clock()
+    scheduler = SessionTimeoutScheduler(lambda ids: None, timeout=10, clock=clock)
+    scheduler._stopped = True
+    for now in range(5):
+        clock.now = now
+        scheduler.touch('1')
+        scheduler.discard('1')  # logout, then the student is seen again
+    scheduler.touch('1')
+    assert len(scheduler._heap) == 1 and len(scheduler) == 1
+
+    assert scheduler.pop_expired(13) == []
+    assert scheduler.pop_expired(14) == ['1']
+    assert scheduler.pop_expired(100) == [] and scheduler._heap == [] and len(scheduler) == 0
+
+def test_thread_wakes_when_sessions_expire():
+    closed = []
+    done = threading.Event()
+
+    def on_expire(ids):
+        closed.extend(ids)
+        if len(closed) == 2:
+            done.set()
+
+    scheduler = SessionTimeoutScheduler(on_expire, timeout=0.05)
+    scheduler.touch('1')
+    scheduler.touch('2')
+    assert done.wait(2)
+    assert sorted(closed) == ['1', '2'] and len(scheduler) == 0
+    scheduler.stop()
+
+
+def test_close_sessions_writes_the_held_back_last_sighting(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ATTENDANCE_JSON', str(tmp_path / 'attendance.json'))
+    monkeypatch.setattr(Config, 'ATTENDANCE_COALESCE_S', 3600)
+    service = AttendanceService(write_behind=False)
+    service.record_appearance('1', 'Ann')
+    time.sleep(0.002)
+    service.record_appearance('1', 'Ann')
+    latest = service.get_today_attendance('1')['logout_time']
+    assert load_json(Config.ATTENDANCE_JSON)[0]['logout_time'] != latest
+
+    assert service.close_sessions(['1'])
+    assert load_json(Config.ATTENDANCE_JSON)[0]['logout_time'] == latest
+    assert '1' not in service.active_sessions
+    service.close()
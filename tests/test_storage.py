@@ -0,0 +1,171 @@
+import json
+import os
+from datetime import timedelta
+
+import pytest
+
+from config import Config
+from services.attendance_service import AttendanceService
+from services.storage import EventLogStorage, JsonStorage, PartitionedStorage, SqliteStorage
+from utils.helpers import get_current_time
+
+
+@pytest.fixture
+def data_files(tmp_path, monkeypatch):
+    students = tmp_path / 'students.json'
+    attendance = tmp_path / 'attendance.json'
+    students.write_text(json.dumps([{'student_id': '1', 'name': 'Ann', 'photo_path': 'a.jpg', 'year': 2}]))
+    attendance.write_text(json.dumps([{'student_id': '1', 'name': 'Ann', 'login_time': '2026-10-16T09:00:00',
+                                       'logout_time': '2026-10-16T10:30:00', 'duration': '1.50 hours',
+                                       'date': '2026-10-16', 'work_hours': 1.5}]))
+    monkeypatch.setattr(Config, 'STUDENTS_JSON', str(students))
+    monkeypatch.setattr(Config, 'ATTENDANCE_JSON', str(attendance))
+    monkeypatch.setattr(Config, 'ATTENDANCE_JOURNAL_S', 3600)
+    return tmp_path
+
+
+def test_sqlite_imports_the_json_files_once(data_files):
+    storage = SqliteStorage(str(data_files / 'app.db'))
+    assert storage.list_students() == [{'student_id': '1', 'name': 'Ann', 'photo_path': 'a.jpg', 'year': 2}]
+    record = storage.get_attendance('1', '2026-10-16')
+    assert record['duration'] == '1.50 hours' and record['work_hours'] == 1.5
+    assert storage.attendance_on('2026-10-16') == storage.student_attendance('1') == [record]
+
+    # A second open (another process) does not import again
+    (data_files / 'students.json').write_text('[]')
+    assert SqliteStorage(str(data_files / 'app.db')).list_students()[0]['name'] == 'Ann'
+
+
+def _open(backend, data_files):
+    if backend == 'json':
+        return JsonStorage()
+    if backend == 'eventlog':
+        return EventLogStorage(str(data_files / 'log'), compact_interval=0)
+    if backend == 'partitioned':
+        return PartitionedStorage(str(data_files / 'days'))
+    return SqliteStorage(str(data_files / 'app.db'))
+
+
+@pytest.mark.parametrize('backend', ['json', 'partitioned', 'eventlog', 'sqlite'])
+def test_extend_attendance_keeps_earliest_login_and_latest_logout(data_files, backend):
+    storage = _open(backend, data_files)
+    noon = get_current_time().replace(hour=12, minute=0, second=0, microsecond=0)
+    storage.extend_attendance([('2', 'Bo', noon, noon + timedelta(minutes=30))])
+    merged = storage.extend_attendance([('2', 'Bo', noon - timedelta(hours=1), noon),
+                                        ('2', 'Bo', noon + timedelta(minutes=10), noon + timedelta(hours=1))])
+    assert merged[-1]['login_time'] == (noon - timedelta(hours=1)).isoformat()
+    assert merged[-1]['logout_time'] == (noon + timedelta(hours=1)).isoformat()
+    assert storage.get_attendance('2', noon.date().isoformat()) == merged[-1]
+    assert merged[-1]['duration'] == '2.00 hours'
+    assert [r['date'] for r in storage.attendance_between('2026-10-01', noon.date().isoformat())] == \
+        ['2026-10-16', noon.date().isoformat()]
+
+    storage.upsert_student({'student_id': '1', 'name': 'Ann B', 'photo_path': 'b.jpg'})
+    assert storage.get_student('1') == {'student_id': '1', 'name': 'Ann B', 'photo_path': 'b.jpg'}
+    assert len(storage.list_students()) == 1
+
+
+def test_attendance_service_on_sqlite(data_files):
+    storage = SqliteStorage(str(data_files / 'app.db'))
+    service = AttendanceService(storage=storage)
+    service.record_appearances([('1', 'Ann'), ('2', 'Bo')])
+    assert service.flush()
+    today = get_current_time().date().isoformat()
+    assert sorted(r['student_id'] for r in storage.attendance_on(today)) == ['1', '2']
+    assert len(service.get_student_attendance('1')) == 2
+    # The JSON files are left alone once imported
+    assert len(json.loads((data_files / 'attendance.json').read_text())) == 1
+    service.close()
+
+
+def test_event_log_appends_and_compacts_into_day_snapshots(data_files):
+    log_dir = data_files / 'log'
+    writer = EventLogStorage(str(log_dir), compact_interval=0)
+    reader = EventLogStorage(str(log_dir), compact_interval=0)
+    # attendance.json was imported as the first snapshot
+    assert reader.get_attendance('1', '2026-10-16')['duration'] == '1.50 hours'
+
+    noon = get_current_time().replace(hour=12, minute=0, second=0, microsecond=0)
+    today = noon.date().isoformat()
+    writer.extend_attendance([('2', 'Bo', noon, noon)])
+    writer.extend_attendance([('2', 'Bo', noon, noon + timedelta(hours=1))], 'logout')
+    lines = (log_dir / 'events.jsonl').read_text().splitlines()
+    assert [json.loads(line)['event'] for line in lines] == ['appearance', 'logout']
+    # The other instance tails the log
+    assert reader.get_attendance('2', today)['duration'] == '1.00 hours'
+
+    assert writer.compact() == 2
+    assert (log_dir / 'events.jsonl').read_text() == ''
+    assert json.loads((log_dir / 'days' / f'{today}.json').read_text())[0]['student_id'] == '2'
+    writer.extend_attendance([('3', 'Cy', noon, noon)])
+    # The reader notices the compaction and reloads from the snapshots
+    assert sorted(r['student_id'] for r in reader.attendance_on(today)) == ['2', '3']
+    restarted = EventLogStorage(str(log_dir), compact_interval=0)
+    assert restarted.all_attendance() == reader.all_attendance()
+
+
+def test_event_log_skips_a_torn_line(data_files):
+    log_dir = data_files / 'log'
+    storage = EventLogStorage(str(log_dir), compact_interval=0)
+    with open(log_dir / 'events.jsonl', 'a') as f:
+        f.write('{"event": "appearance", "student_id": "9"')  # writer died mid-line
+    noon = get_current_time().replace(hour=12, minute=0, second=0, microsecond=0)
+    storage.extend_attendance([('2', 'Bo', noon, noon)])
+    restarted = EventLogStorage(str(log_dir), compact_interval=0)
+    assert [r['student_id'] for r in restarted.attendance_on(noon.date().isoformat())] == ['2']
+
+
+def test_partitions_are_split_and_loaded_lazily(data_files):
+    days = data_files / 'days'
+    storage = PartitionedStorage(str(days), cache_days=1)
+    assert json.loads((days / 'manifest.json').read_text()) == {'days': {'2026-10-16': 1}}
+    assert storage.get_attendance('1', '2026-10-16')['work_hours'] == 1.5
+    assert storage.attendance_on('../students') == []
+
+    noon = get_current_time().replace(hour=12, minute=0, second=0, microsecond=0)
+    today = noon.date().isoformat()
+    storage.extend_attendance([('2', 'Bo', noon, noon), ('3', 'Cy', noon - timedelta(days=400), noon)])
+    assert sorted(json.loads((days / 'manifest.json').read_text())['days']) == \
+        sorted(['2026-10-16', today, (noon - timedelta(days=400)).date().isoformat()])
+    # Only today plus one other day stay cached
+    storage.attendance_on('2026-10-16')
+    assert set(storage._cache) == {today, '2026-10-16'}
+
+    # A write from another process is picked up
+    PartitionedStorage(str(days)).extend_attendance([('4', 'Di', noon, noon)])
+    assert [r['student_id'] for r in storage.attendance_on(today)] == ['2', '4']
+
+
+def test_student_registry_parses_only_when_the_file_changes(data_files, monkeypatch):
+    import services.storage as storage_module
+    parses = []
+    real_load = storage_module.load_json
+    monkeypatch.setattr(storage_module, 'load_json', lambda path: parses.append(path) or real_load(path))
+    storage = JsonStorage()
+    students = data_files / 'students.json'
+    students.write_text(json.dumps([{'student_id': '1', 'name': 'Ann', 'encoding': [0.1] * 128}]))
+
+    assert storage.get_student('1') == {'student_id': '1', 'name': 'Ann'}
+    for _ in range(5):
+        storage.get_student('1')
+        storage.list_students()
+    assert parses == [str(students)]
+
+    # A registration by another worker (any write to the file) is picked up
+    JsonStorage().upsert_student({'student_id': '2', 'name': 'Bo'})
+    assert storage.get_student('2')['name'] == 'Bo'
+    assert storage.get_student('missing') is None
+
+
+def test_event_log_compactor_starts_in_the_writing_process(data_files):
+    storage = EventLogStorage(str(data_files / 'log'), compact_interval=3600)
+    assert storage._compactor_pid is None
+    noon = get_current_time().replace(hour=12, minute=0, second=0, microsecond=0)
+    pid = os.fork()
+    if pid == 0:
+        # A preloaded gunicorn worker: the first append starts the compactor here
+        storage.extend_attendance([('2', 'Bo', noon, noon)])
+        os._exit(0 if storage._compactor_pid == os.getpid() else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert storage._compactor_pid is None
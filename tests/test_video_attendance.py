@@ -0,0 +1,68 @@
+import multiprocessing
+from datetime import timedelta
+
+import cv2
+import numpy as np
+import pytest
+
+from config import Config
+from services.attendance_service import AttendanceService
+from services.video_attendance import merge_sightings, plan_chunks, process_videos, scan_chunk
+from utils.helpers import get_current_time, load_json
+
+
+class BrightFaceService:
+    """Sees student 1 in every bright frame"""
+
+    def process_frame(self, frame, camera_id=None):
+        return [{'student_id': '1', 'name': 'Ann'}] if frame.mean() > 100 else []
+
+
+@pytest.fixture
+def clip(tmp_path):
+    # 100 frames at 25 fps; frames 20-59 are bright
+    path = str(tmp_path / 'lecture.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (32, 32))
+    if not writer.isOpened():
+        pytest.skip('OpenCV build cannot write MJPG video')
+    for i in range(100):
+        writer.write(np.full((32, 32, 3), 200 if 20 <= i < 60 else 0, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def test_plan_chunks_and_merge():
+    assert plan_chunks(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    merged = merge_sightings({'1': ['Ann', 10, 20, 3]}, {'1': ['Ann', 5, 12, 2], '2': ['Bo', 7, 7, 1]})
+    assert merged == {'1': ['Ann', 5, 20, 5], '2': ['Bo', 7, 7, 1]}
+
+
+def test_scan_chunk_samples_with_stride(clip):
+    sightings, frames_read = scan_chunk(BrightFaceService(), clip, 10, 50, stride=4)
+    assert frames_read == 40
+    # Processed frames are 12, 16, ..., 48; the bright ones start at 20
+    assert sightings == {'1': ['Ann', 20, 48, 8]}
+
+
+def test_process_videos_merges_parallel_chunks(clip):
+    progress = []
+    results = process_videos([clip], BrightFaceService, stride=2, workers=2, chunk_seconds=1,
+                             progress=lambda *p: progress.append(p), mp_context=multiprocessing.get_context('fork'))
+    sightings, fps = results[clip]
+    assert fps == 25
+    assert sightings == {'1': ['Ann', 20, 58, 20]}
+    assert len(progress) == 4 and progress[-1][:2] == (100, 100)
+
+
+def test_record_sightings_extends_the_day_record(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ATTENDANCE_JSON', str(tmp_path / 'attendance.json'))
+    service = AttendanceService()
+    noon = get_current_time().replace(hour=12, minute=0, second=0, microsecond=0)
+    assert service.record_sightings([('1', 'Ann', noon, noon + timedelta(hours=1))]) == 1
+    assert service.record_sightings([('1', 'Ann', noon - timedelta(hours=1), noon + timedelta(minutes=30)),
+                                     ('2', 'Bo', noon, noon)]) == 2
+    records = {r['student_id']: r for r in load_json(Config.ATTENDANCE_JSON)}
+    assert records['1']['login_time'] == (noon - timedelta(hours=1)).isoformat()
+    assert records['1']['logout_time'] == (noon + timedelta(hours=1)).isoformat()
+    assert records['1']['duration'] == '2.00 hours'
+    assert len(records) == 2
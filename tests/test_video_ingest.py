@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.video_ingest import VideoIngestWorker, VideoSource, parse_sources
+
+
+class FakeCapture:
+    """``frames`` frames at 25 fps; frame n is filled with the value n.
+
+    With a ``gate``, frames after the first wait until it is set.
+    """
+
+    def __init__(self, frames, gate=None):
+        self.frames = frames
+        self.gate = gate
+        self.position = -1
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        self.position += 1
+        if self.position > 0 and self.gate is not None:
+            self.gate.wait(5)
+        return self.position < self.frames
+
+    def retrieve(self):
+        return True, np.full((4, 4, 3), self.position, dtype=np.uint8)
+
+    def get(self, prop):
+        return self.position * 40.0
+
+    def release(self):
+        pass
+
+
+def test_parse_sources():
+    assert parse_sources('door=rtsp://cam/1?a=b; 0 ;lab=/videos/x.mp4') == [
+        ('door', 'rtsp://cam/1?a=b'), ('0', '0'), ('lab', '/videos/x.mp4')]
+    assert parse_sources('rtsp://cam/1?a=b') == [('rtsp://cam/1?a=b', 'rtsp://cam/1?a=b')]
+    assert parse_sources('') == []
+
+
+def test_frames_are_sampled_and_skipped_while_recognition_lags(tmp_path):
+    video = tmp_path / 'clip.avi'
+    video.write_bytes(b'')  # only its existence matters: it marks the source as a file
+    in_flight, release = threading.Event(), threading.Event()
+    seen = []
+
+    def dispatch_frame(source_id, frame):
+        in_flight.set()
+        release.wait(5)
+        seen.append(int(frame[0, 0, 0]))
+        return [{'student_id': '1', 'name': 'Ann'}], {}
+
+    source = VideoSource('cam', str(video), dispatch_frame, sample_fps=5, realtime=False,
+                         open_capture=lambda uri: FakeCapture(50, gate=in_flight))
+    source.start()
+    while source.running and source.frames_read < 50:
+        time.sleep(0.001)
+    release.set()
+    source.join(5)
+
+    stats = source.stats()
+    assert not stats['running']
+    assert stats['frames_read'] == 50
+    # 2 s of video sampled at 5 fps: every 5th frame
+    assert stats['frames_sampled'] == 10
+    # The first sample was in flight, only the newest of the rest was kept
+    assert seen == [0, 45]
+    assert stats['frames_skipped'] == 8
+    assert stats['frames_processed'] == 2 and stats['faces_recognized'] == 2
+    assert stats['avg_lag_ms'] is not None
+
+
+class RecordingAttendance:
+    def __init__(self):
+        self.calls = []
+
+    def record_appearances(self, appearances):
+        self.calls.append(appearances)
+        return {}
+
+
+class StubDispatcher:
+    """Source 'slow' blocks until released; the others answer immediately"""
+
+    def __init__(self):
+        self.in_flight = threading.Event()
+        self.release = threading.Event()
+
+    def dispatch_frame(self, source_id, frame):
+        if source_id == 'slow':
+            self.in_flight.set()
+            self.release.wait(5)
+        return [{'student_id': source_id, 'name': source_id.title()}], {}
+
+
+def test_slow_source_does_not_starve_others(tmp_path):
+    for name in ('slow', 'fast'):
+        (tmp_path / f'{name}.avi').write_bytes(b'')
+    dispatcher = StubDispatcher()
+    attendance = RecordingAttendance()
+    worker = VideoIngestWorker(dispatcher, attendance, sample_fps=25, realtime=False,
+                               open_capture=lambda uri: FakeCapture(20, gate=dispatcher.in_flight
+                                                                    if uri.endswith('slow.avi') else None))
+    slow = worker.add_source('slow', str(tmp_path / 'slow.avi'))
+    fast = worker.add_source('fast', str(tmp_path / 'fast.avi'))
+    fast.join(5)
+    stats = worker.stats()['fast']
+    assert not stats['running'] and stats['frames_sampled'] == 20
+    assert stats['frames_processed'] >= 1
+    assert stats['frames_processed'] + stats['frames_skipped'] == 20
+    assert attendance.calls.count([('fast', 'Fast')]) == stats['frames_processed']
+    assert worker.stats()['slow']['frames_processed'] == 0
+
+    dispatcher.release.set()
+    slow.join(5)
+    assert worker.stats()['slow']['frames_processed'] == 2
+    worker.stop()
+    assert worker.stats() == {}
+
+
+def test_configured_sources_start_once_per_process(tmp_path):
+    video = tmp_path / 'door.avi'
+    video.write_bytes(b'')
+    attendance = RecordingAttendance()
+    worker = VideoIngestWorker(StubDispatcher(), attendance, sample_fps=25, realtime=False,
+                               open_capture=lambda uri: FakeCapture(3))
+    worker.ensure_started([('door', str(video))])
+    first = worker.sources['door']
+    worker.ensure_started([('door', str(video))])
+    assert worker.sources['door'] is first
+    first.join(5)
+
+    pid = os.fork()
+    if pid == 0:
+        # A preloaded gunicorn worker: the parent's reader threads are gone, so start again
+        worker.ensure_started([('door', str(video))])
+        source = worker.sources['door']
+        source.join(5)
+        os._exit(0 if source is not first and source.stats()['frames_processed'] >= 1 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    worker.stop()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Utility: move inline face encodings from students.json into the binary store
+
+Encodings used to be stored as JSON float lists inside data/students.json. The
+app now keeps them in a float32 matrix (data/encodings.f32) with a small row
+index (data/encodings_index.jsonl) and students.json holds only metadata. The
+app converts automatically on startup; this script does the same on demand
+and can also verify or compact the store:
+
+    python tools/convert_encodings.py            # convert (no-op if already done)
+    python tools/convert_encodings.py --check    # report inconsistencies
+    python tools/convert_encodings.py --compact  # drop superseded/deleted rows
+
+"""
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+from services.encoding_store import EncodingStore, convert_students_json
+from services.storage import get_storage
+from config import Config
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--check', action='store_true', help='only check students.json against the store')
+parser.add_argument('--compact', action='store_true', help='rewrite the store without superseded rows')
+args = parser.parse_args()
+
+os.makedirs(Config.DATA_DIR, exist_ok=True)
+store = EncodingStore()
+
+if not args.check:
+    moved = convert_students_json(store)
+    print(f"Moved {moved} inline encoding(s) into {store.matrix_path}")
+
+if args.compact:
+    kept = store.compact()
+    print(f"Compacted store to {kept} row(s)")
+
+problems = store.check_consistency(get_storage().list_students())
+for problem in problems:
+    print(f"  {problem}")
+print("Store is consistent with the student records." if not problems else f"{len(problems)} problem(s) found.")
+sys.exit(1 if args.check and problems else 0)
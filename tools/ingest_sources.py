@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Utility: recognize faces from server-side video sources and record attendance
+
+Each source is `id=uri`, where uri is a camera index, a stream URL or a video
+file; the id is the camera id used for tracking. Sources can also come from
+the INGEST_SOURCES setting. Throughput and lag counters are printed
+periodically until interrupted (or until every file source has ended).
+
+    python tools/ingest_sources.py door=rtsp://10.0.0.5/stream lab=0
+    python tools/ingest_sources.py --fps 5 test=videos/classroom.mp4
+
+"""
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import time
+
+from config import Config
+from services.video_ingest import VideoIngestWorker, parse_sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sources', nargs='*', help='id=uri (default: INGEST_SOURCES)')
+    parser.add_argument('--fps', type=float, default=None, help='frames per second sampled from each source')
+    parser.add_argument('--loop', action='store_true', help='restart video files when they end')
+    parser.add_argument('--fast', action='store_true', help='read video files as fast as possible instead of in real time')
+    parser.add_argument('--stats-every', type=float, default=10.0, help='seconds between stats lines')
+    args = parser.parse_args()
+
+    sources = parse_sources(';'.join(args.sources)) if args.sources else parse_sources(Config.INGEST_SOURCES)
+    if not sources:
+        parser.error('no sources given and INGEST_SOURCES is empty')
+
+    # Imported here so --help works without the recognition stack
+    from services.face_recognition_service import FaceRecognitionService
+    from services.attendance_service import AttendanceService
+    from services.frame_dispatcher import FrameDispatcher
+
+    dispatcher = FrameDispatcher(FaceRecognitionService())
+    worker = VideoIngestWorker(dispatcher, AttendanceService(), sample_fps=args.fps,
+                               loop=args.loop, realtime=not args.fast)
+    for source_id, uri in sources:
+        print(f"Ingesting {source_id}: {uri}")
+        worker.add_source(source_id, uri)
+
+    try:
+        while any(source.running for source in worker.sources.values()):
+            time.sleep(args.stats_every)
+            print(json.dumps(worker.stats()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        final = dict(worker.sources)
+        worker.stop()
+        dispatcher.close()
+        print(json.dumps({source_id: source.stats() for source_id, source in final.items()}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Utility: produce attendance from recorded lecture videos
+
+Every video (or every video found in a directory) is decoded and recognized
+in parallel on all cores, sampling every --stride-th frame. The first and last
+sighting of each student is written to the attendance records in one batch.
+Video time is mapped to wall-clock time from --start, or else from the file's
+modification time (taken as the end of the recording).
+
+    python tools/process_video_attendance.py recordings/2026-10-17_lecture.mp4
+    python tools/process_video_attendance.py --stride 10 --workers 8 recordings/
+
+"""
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+from datetime import datetime, timedelta
+
+import pytz
+
+from config import Config
+from services.video_attendance import find_videos, process_videos
+
+
+def _progress(done, total, elapsed):
+    fps = done / elapsed if elapsed > 0 else 0.0
+    share = f"{100.0 * done / total:5.1f}% " if total else ''
+    print(f"  {share}{done}/{total or '?'} frames, {fps:.0f} fps", flush=True)
+
+
+def _recording_start(path, fps, frame_count, start):
+    tz = pytz.timezone(Config.TIMEZONE)
+    if start:
+        moment = datetime.fromisoformat(start)
+        return moment if moment.tzinfo else tz.localize(moment)
+    duration = frame_count / fps if fps else 0.0
+    return datetime.fromtimestamp(os.path.getmtime(path), tz) - timedelta(seconds=duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='video files or directories')
+    parser.add_argument('--stride', type=int, default=5, help='process every Nth frame (default 5)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--chunk-seconds', type=float, default=60, help='seconds of video per work unit')
+    parser.add_argument('--min-sightings', type=int, default=2,
+                        help='ignore students recognized in fewer processed frames than this')
+    parser.add_argument('--start', help='wall-clock start of the recording (ISO format; single video only)')
+    parser.add_argument('--dry-run', action='store_true', help='print the sightings without saving attendance')
+    args = parser.parse_args()
+
+    videos = find_videos(args.paths)
+    if not videos:
+        parser.error('no videos found')
+    if args.start and len(videos) > 1:
+        parser.error('--start only applies to a single video')
+
+    # Imported here so --help works without the recognition stack
+    from services.face_recognition_service import FaceRecognitionService
+    from services.attendance_service import AttendanceService
+    from services.video_attendance import video_info
+
+    print(f"Processing {len(videos)} video(s), every {args.stride} frame(s)")
+    results = process_videos(videos, FaceRecognitionService, stride=max(1, args.stride), workers=args.workers,
+                             chunk_seconds=args.chunk_seconds, progress=_progress)
+
+    batch = []
+    for path, (sightings, fps) in results.items():
+        frame_count, _ = video_info(path) or (0, fps)
+        began = _recording_start(path, fps, frame_count, args.start)
+        print(f"{path}: {len(sightings)} student(s)")
+        for student_id, (name, first, last, count) in sorted(sightings.items()):
+            if count < args.min_sightings:
+                continue
+            first_seen = began + timedelta(seconds=first / (fps or 25.0))
+            last_seen = began + timedelta(seconds=last / (fps or 25.0))
+            print(f"  {student_id} {name}: {first_seen:%H:%M:%S} - {last_seen:%H:%M:%S} ({count} frames)")
+            batch.append((student_id, name, first_seen, last_seen))
+
+    if args.dry_run:
+        print("Dry run: attendance not saved.")
+        return
+    written = AttendanceService().record_sightings(batch)
+    if written is None:
+        print("Failed to save attendance records")
+        sys.exit(1)
+    print(f"Saved {written} attendance record(s).")
+
+
+if __name__ == '__main__':
+    main()
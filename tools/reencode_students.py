@@ -1,66 +1,89 @@
 #!/usr/bin/env python3
 """Utility: re-generate face encodings for students using the FaceRecognitionService
 
-This script loads students from data/students.json and attempts to compute a new
+This script loads the student records (students.json or the SQLite storage) and attempts to compute a new
 face encoding for each student using their stored `photo_path` or by finding a
-matching photo file in the student photos directory. It overwrites the encoding
-in-place and saves the JSON if any updates succeed.
+matching photo file in the student photos directory. The new encoding is
+appended to the binary encoding store (superseding the old row) and the photo
+path in the student record is updated if any updates succeed.
+
+With --all-photos every photo of a student in the photos directory (the newest
+MAX_EMBEDDINGS_PER_STUDENT of them) is enrolled as a separate embedding.
 
 Run inside the conda env where face_recognition is available:
 
-    conda run -n faceenv python tools/reencode_students.py
+    conda run -n faceenv python tools/reencode_students.py [--all-photos]
 
 """
 import sys, os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import argparse
 from services.face_recognition_service import FaceRecognitionService
-from utils.helpers import load_json, save_json
+from services.encoding_store import EncodingStore
+from services.storage import get_storage
+from utils.helpers import list_student_photos
 from config import Config
 from pathlib import Path
 import os
 
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--all-photos', action='store_true',
+                    help='enroll every photo of each student as its own embedding')
+args = parser.parse_args()
+
 service = FaceRecognitionService()
-students = load_json(Config.STUDENTS_JSON) or []
+store = EncodingStore()
+storage = get_storage()
+students = storage.list_students()
+all_photos = list_student_photos() if args.all_photos else {}
 updated = False
 
 for i, s in enumerate(students):
     sid = s.get('student_id')
     print(f"Processing student {sid} - {s.get('name')}")
     photo_path = s.get('photo_path')
-    if photo_path and os.path.exists(photo_path):
-        path = photo_path
+    if args.all_photos and all_photos.get(str(sid)):
+        paths = all_photos[str(sid)][-Config.MAX_EMBEDDINGS_PER_STUDENT:]
+    elif photo_path and os.path.exists(photo_path):
+        paths = [photo_path]
     else:
         # try to find a file in STUDENT_PHOTOS_DIR that starts with this id
         files = list(Path(Config.STUDENT_PHOTOS_DIR).glob(f"{sid}_*.jpg"))
         if files:
-            path = str(files[0])
+            paths = [str(files[0])]
         else:
             print(f"  No photo found for {sid}; skipping")
             continue
 
     # load with OpenCV
     import cv2
-    img = cv2.imread(path)
-    if img is None:
-        print(f"  Failed to load image {path}")
-        continue
+    enrolled = 0
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"  Failed to load image {path}")
+            continue
+
+        enc = service.get_face_encoding(img)
+        if enc is None:
+            print(f"  Could not detect face for {sid} in {path}")
+            continue
 
-    enc = service.get_face_encoding(img)
-    if enc is None:
-        print(f"  Could not detect face for {sid} in {path}")
-        continue
+        # The first photo replaces the student's old rows, the others are added to it
+        store.append(sid, s.get('name'), enc, os.path.abspath(path), extra=enrolled > 0)
+        enrolled += 1
+        # also update photo_path to a normalized static path (store absolute path currently)
+        students[i]['photo_path'] = os.path.abspath(path)
 
-    students[i]['encoding'] = enc.tolist()
-    # also update photo_path to a normalized static path (store absolute path currently)
-    students[i]['photo_path'] = os.path.abspath(path)
-    updated = True
-    print(f"  Updated encoding for {sid}")
+    if enrolled:
+        updated = True
+        print(f"  Updated encoding for {sid} ({enrolled} photo(s))")
 
 if updated:
-    if save_json(Config.STUDENTS_JSON, students):
-        print("Students JSON updated with new encodings.")
+    if all(storage.upsert_student(s) for s in students):
+        print("Encodings stored; student records updated with photo paths.")
     else:
-        print("Failed to save updated students.json")
+        print("Failed to save updated student records")
 else:
     print("No updates made.")
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""Utility: split data/attendance.json into one file per day
+
+The 'partitioned' storage backend (STORAGE_BACKEND=partitioned) keeps
+attendance in data/attendance/<date>.json with a manifest.json listing the
+days. The app splits the monolithic file automatically the first time it
+opens that storage; this script does the same on demand:
+
+    python tools/split_attendance.py
+    python tools/split_attendance.py --source backup/attendance.json --dest /tmp/attendance
+
+"""
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+from services.storage import split_attendance_json
+from utils.helpers import file_lock
+from config import Config
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--source', default=Config.ATTENDANCE_JSON, help='monolithic attendance file')
+parser.add_argument('--dest', default=Config.ATTENDANCE_DIR, help='directory for the day files')
+args = parser.parse_args()
+
+with file_lock(args.dest + '.lock'):
+    if os.path.isdir(args.dest):
+        print(f"{args.dest} already exists; nothing to do.")
+        sys.exit(0)
+    count = split_attendance_json(args.dest, source=args.source)
+print(f"Wrote {count} record(s) to {args.dest}.")
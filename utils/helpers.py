@@ -1,10 +1,16 @@
 import json
 import os
+from contextlib import contextmanager
 from datetime import datetime
 import pytz
 from threading import Lock
 from config import Config
 
+try:
+    import fcntl
+except ImportError:  # Windows: cross-process locking is best effort
+    fcntl = None
+
 # Thread-safe file locks
 students_lock = Lock()
 attendance_lock = Lock()
@@ -40,6 +46,42 @@ def load_json(file_path):
             print(f"Error loading JSON file {file_path}: {str(e)}")
             return []
 
+@contextmanager
+def file_lock(lock_path):
+    """Exclusive cross-process lock on ``lock_path`` (a no-op where fcntl is unavailable)"""
+    with open(lock_path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def list_student_photos(photos_dir=None):
+    """Map student_id -> paths of all their photos, oldest first, with a single directory listing.
+
+    Photos are named ``<student_id>_<YYYYmmddHHMMSS>.jpg`` so lexical order
+    per id is chronological.
+    """
+    photos_dir = photos_dir or Config.STUDENT_PHOTOS_DIR
+    photos = {}
+    try:
+        names = sorted(os.listdir(photos_dir))
+    except Exception as e:
+        print(f"Error listing student photos in {photos_dir}: {str(e)}")
+        return photos
+    for fname in names:
+        if '_' not in fname:
+            continue
+        student_id = fname.rsplit('_', 1)[0]
+        photos.setdefault(student_id, []).append(os.path.join(photos_dir, fname))
+    return photos
+
+def index_student_photos(photos_dir=None):
+    """Map student_id -> path of their latest photo"""
+    return {student_id: paths[-1] for student_id, paths in list_student_photos(photos_dir).items()}
+
 def get_current_time():
     """Get current time in configured timezone"""
     return datetime.now(pytz.timezone(Config.TIMEZONE))